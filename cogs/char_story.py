@@ -1,19 +1,17 @@
 import discord
 from discord.ext import commands
 from discord import ui
-from openai import AsyncOpenAI
-import google.generativeai as genai # Import Gemini
-import httpx # Import httpx untuk Deepseek
 import logging
-from typing import Dict, Optional, List # Tambahkan Optional, List
+import time
+import asyncio
+from typing import Dict, Optional, List, Callable, Awaitable # Tambahkan Optional, List
 import io
 import re # Import re untuk membersihkan output JSON
 import json # Import json
-import itertools # Import itertools
-import asyncio # Import asyncio
 
 # Import fungsi database untuk cooldown
-from utils.database import check_ai_limit, increment_ai_usage, get_user_rank
+from utils.database import check_ai_limit_async, reserve_ai_quota_async, refund_ai_quota_async, get_user_rank_async
+from utils.ai_gateway import AIError, queue_status_updater
 
 # Mengambil logger
 logger = logging.getLogger(__name__)
@@ -226,6 +224,49 @@ STORY :
     }
 }
 
+# ============================
+# PREVIEW STREAMING
+# ============================
+# Discord membatasi edit pesan (~5 edit / 5 detik per channel), jadi preview diedit paling cepat tiap interval
+STREAM_EDIT_INTERVAL = 1.5
+STREAM_PREVIEW_CHARS = 1800
+
+class StoryStreamPreview:
+    """Mengedit pesan proses secara bertahap selama AI menulis cerita (maksimal satu edit per interval)."""
+
+    def __init__(self, message: discord.WebhookMessage, header: str, interval: float = STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.header = header
+        self.interval = interval
+        self._last_edit = 0.0
+        self._latest = ""
+        self._task: Optional[asyncio.Task] = None
+
+    async def update(self, text: str):
+        self._latest = text
+        # Edit sebelumnya belum selesai atau interval belum lewat: cukup simpan teks terbaru
+        if (self._task and not self._task.done()) or time.monotonic() - self._last_edit < self.interval:
+            return
+        self._last_edit = time.monotonic()
+        self._task = asyncio.create_task(self._edit(text))
+
+    async def _edit(self, text: str):
+        preview = text.replace("```", "")
+        if len(preview) > STREAM_PREVIEW_CHARS:
+            preview = "…" + preview[-STREAM_PREVIEW_CHARS:]
+        try:
+            await self.message.edit(content=f"{self.header}\n>>> {preview} ▌")
+        except discord.HTTPException as e:
+            logger.debug(f"Gagal update preview CS: {e}")
+
+    async def close(self):
+        """Tunggu edit yang sedang berjalan agar tidak menimpa pesan hasil akhir."""
+        if self._task and not self._task.done():
+            try:
+                await self._task
+            except Exception:
+                pass
+
 # ============================
 # UI COMPONENTS (MODAL & VIEWS) - Tetap sama
 # ============================
@@ -243,10 +284,23 @@ class CSInputModal_Part2(ui.Modal):
         self.part1_data = part1_data
 
     async def on_submit(self, interaction: discord.Interaction):
+        # Defer dulu: query kuota ke DB bisa lambat dan tidak boleh menghabiskan jendela 3 detik interaksi
         await interaction.response.defer()
-        processing_msg = await interaction.followup.send(f"⏳ Character Story untuk **{self.part1_data['nama_char']}** sedang diproses oleh AI...")
+        can_use, remaining, limit = await reserve_ai_quota_async(interaction.user.id)
+        if not can_use:
+            rank = await get_user_rank_async(interaction.user.id)
+            limit_display = "Unlimited" if limit == -1 else limit
+            await interaction.followup.send(
+                f"❌ Batas harian AI Anda (Rank: **{rank.title()}**) untuk membuat CS telah tercapai ({limit}/{limit_display}). Coba lagi besok.",
+                ephemeral=True
+            )
+            return
 
+        processing_msg, preview = None, None
         try:
+            processing_msg = await interaction.followup.send(f"⏳ Character Story untuk **{self.part1_data['nama_char']}** sedang diproses oleh AI...")
+            preview = StoryStreamPreview(processing_msg, f"✍️ AI sedang menulis Character Story untuk **{self.part1_data['nama_char']}**...")
+
             all_data = self.part1_data.copy()
             all_data.update({
                 "bakat": self.bakat_dominan.value,
@@ -256,7 +310,11 @@ class CSInputModal_Part2(ui.Modal):
                 "story_type": self.story_type,
             })
 
-            story_text = await self.bot.get_cog("CharacterStory").generate_story_from_ai(**all_data)
+            story_text = await self.bot.get_cog("CharacterStory").generate_story_from_ai(
+                **all_data, on_progress=preview.update, user_id=interaction.user.id,
+                on_queue=queue_status_updater(processing_msg)
+            )
+            await preview.close()
             # --- [BARU] Periksa jika AI gagal ---
             if story_text is None:
                 raise Exception("Semua layanan AI gagal dihubungi atau error.")
@@ -292,16 +350,17 @@ class CSInputModal_Part2(ui.Modal):
                 attachments=[story_file]
             )
 
-            increment_ai_usage(interaction.user.id)
-
         except Exception as e:
+            # CS tidak terkirim (AI gagal atau error Discord) -> kuota yang sudah dipakai dikembalikan
+            await refund_ai_quota_async(interaction.user.id)
+            if preview: await preview.close()
             logger.error(f"Gagal membuat CS: {e}", exc_info=True)
             # --- [PERBAIKAN] Pesan error lebih informatif ---
             error_msg = f"❌ Terjadi kesalahan: {e}"
             if "Semua layanan AI gagal" in str(e):
                 error_msg = "❌ Semua layanan AI sedang bermasalah atau gagal dihubungi. Coba lagi nanti."
             # --- [AKHIR PERBAIKAN] ---
-            await processing_msg.edit(content=error_msg, embed=None, view=None, attachments=[])
+            if processing_msg: await processing_msg.edit(content=error_msg, embed=None, view=None, attachments=[])
 
 class ContinueToPart2View(ui.View):
     def __init__(self, server: str, story_type: str, bot_instance, part1_data: Dict):
@@ -400,9 +459,9 @@ class CSPanelView(ui.View):
 
     @ui.button(label="Buat Character Story", style=discord.ButtonStyle.primary, emoji="📝", custom_id="create_cs_button")
     async def create_cs(self, interaction: discord.Interaction, button: ui.Button):
-        can_use, remaining, limit = check_ai_limit(interaction.user.id)
+        can_use, remaining, limit = await check_ai_limit_async(interaction.user.id)
         if not can_use:
-            rank = get_user_rank(interaction.user.id)
+            rank = await get_user_rank_async(interaction.user.id)
             limit_display = "Unlimited" if limit == -1 else limit
             usage_today = (limit - remaining) if limit > 0 else 0
             await interaction.response.send_message(
@@ -419,157 +478,13 @@ class CSPanelView(ui.View):
 class CharacterStoryCog(commands.Cog, name="CharacterStory"):
     def __init__(self, bot):
         self.bot = bot
-        # --- [PERBAIKAN] Tambahkan SEMUA key cyclers ---
-        self.openai_key_cycler = itertools.cycle(self.bot.config.OPENAI_API_KEYS) if self.bot.config.OPENAI_API_KEYS else None
-        self.gemini_key_cycler = itertools.cycle(self.bot.config.GEMINI_API_KEYS) if self.bot.config.GEMINI_API_KEYS else None
-        self.deepseek_key_cycler = itertools.cycle(self.bot.config.DEEPSEEK_API_KEYS) if self.bot.config.DEEPSEEK_API_KEYS else None
-        self.openrouter_key_cycler = itertools.cycle(self.bot.config.OPENROUTER_API_KEYS) if self.bot.config.OPENROUTER_API_KEYS else None
-        self.agentrouter_key_cycler = itertools.cycle(self.bot.config.AGENTROUTER_API_KEYS) if self.bot.config.AGENTROUTER_API_KEYS else None
-        # --- [AKHIR PERBAIKAN] ---
-
-        # Siapkan header OpenRouter jika ada key
-        if self.openrouter_key_cycler:
-            self.openrouter_headers = {
-                "HTTP-Referer": getattr(self.bot.config, 'OPENROUTER_SITE_URL', 'http://localhost'),
-                "X-Title": getattr(self.bot.config, 'OPENROUTER_SITE_NAME', 'MBOT'),
-            }
-
         if not hasattr(bot, 'persistent_views_added') or not bot.persistent_views_added:
             bot.add_view(CSPanelView(bot))
             bot.persistent_views_added = True
 
-    # --- [BARU] Fungsi AI Helper Terpisah ---
-
-    async def _try_openrouter(self, prompt: str) -> Optional[str]:
-        if not self.openrouter_key_cycler: return None
-        try:
-            key = next(self.openrouter_key_cycler)
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                logger.info(f"Char Story: Mencoba OpenRouter...")
-                payload = {
-                    "model": "mistralai/mistral-7b-instruct:free",
-                    "messages": [{"role": "user", "content": prompt}],
-                    # Tidak ada response_format (minta teks)
-                    "temperature": 0.75, "max_tokens": 1500
-                }
-                headers = {"Authorization": f"Bearer {key}"}
-                if hasattr(self, 'openrouter_headers'): headers.update(self.openrouter_headers)
-
-                response = await client.post("https://openrouter.ai/api/v1/chat/completions", json=payload, headers=headers)
-                response.raise_for_status()
-                story_text = response.json()["choices"][0]["message"]["content"]
-                if story_text:
-                    logger.info("AI (OpenRouter) berhasil generate Char Story.")
-                    return story_text
-            return None
-        except Exception as e:
-            logger.warning(f"Char Story: OpenRouter gagal: {e}")
-            await asyncio.sleep(1)
-            return None
-
-    async def _try_agentrouter(self, prompt: str) -> Optional[str]:
-        if not self.agentrouter_key_cycler: return None
-        try:
-            key = next(self.agentrouter_key_cycler)
-            logger.info(f"Char Story: Mencoba AgentRouter...")
-            client = AsyncOpenAI(api_key=key, base_url="https://agentrouter.org/v1", timeout=45.0)
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                # Tidak ada response_format (minta teks)
-                temperature=0.75,
-                max_tokens=1500
-            )
-            story_text = response.choices[0].message.content
-            if story_text:
-                logger.info("AI (AgentRouter) berhasil generate Char Story.")
-                return story_text
-            return None
-        except Exception as e:
-            logger.warning(f"Char Story: AgentRouter gagal: {e}")
-            await asyncio.sleep(1)
-            return None
-
-    async def _try_gemini(self, prompt: str) -> Optional[str]:
-        if not self.gemini_key_cycler: return None
-        try:
-            key = next(self.gemini_key_cycler)
-            genai.configure(api_key=key)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            logger.info(f"Char Story: Mencoba Gemini...")
-            response = await model.generate_content_async(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    # Tidak ada response_mime_type (minta teks)
-                    temperature=0.75
-                ),
-                request_options={"timeout": 60}
-            )
-            if response.prompt_feedback.block_reason: raise Exception(f"Diblokir: {response.prompt_feedback.block_reason.name}")
-            if response.candidates and response.candidates[0].finish_reason.name != "STOP": raise Exception(f"Finish reason: {response.candidates[0].finish_reason.name}")
-            story_text = response.text
-            if story_text:
-                 logger.info("AI (Gemini) berhasil generate Char Story.")
-                 return story_text
-            return None
-        except Exception as e:
-            logger.warning(f"Char Story: Gemini gagal: {e}")
-            await asyncio.sleep(1)
-            return None
-
-    async def _try_deepseek(self, prompt: str) -> Optional[str]:
-        if not self.deepseek_key_cycler: return None
-        try:
-            key = next(self.deepseek_key_cycler)
-            async with httpx.AsyncClient(timeout=40.0) as client:
-                logger.info(f"Char Story: Mencoba Deepseek...")
-                response = await client.post(
-                    "https://api.deepseek.com/chat/completions",
-                    json={
-                        "model": "deepseek-chat",
-                        "messages": [{"role": "user", "content": prompt}],
-                        # Tidak ada response_format (minta teks)
-                        "temperature": 0.75,
-                        "max_tokens": 1500,
-                    },
-                    headers={"Authorization": f"Bearer {key}"}
-                )
-                response.raise_for_status()
-                story_text = response.json()["choices"][0]["message"]["content"]
-                if story_text:
-                    logger.info("AI (Deepseek) berhasil generate Char Story.")
-                    return story_text
-                return None
-        except Exception as e:
-            logger.warning(f"Char Story: Deepseek gagal: {e}")
-            await asyncio.sleep(1)
-            return None
-
-    async def _try_openai(self, prompt: str) -> Optional[str]:
-        if not self.openai_key_cycler: return None
-        try:
-            key = next(self.openai_key_cycler)
-            client = AsyncOpenAI(api_key=key, timeout=30.0)
-            logger.info(f"Char Story: Mencoba OpenAI...")
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                # Tidak ada response_format (minta teks)
-                temperature=0.75,
-                max_tokens=1500,
-            )
-            story_text = response.choices[0].message.content
-            if story_text:
-                logger.info("AI (OpenAI) berhasil generate Char Story.")
-                return story_text
-            return None
-        except Exception as e:
-            logger.error(f"Char Story: OpenAI GAGAL (fallback terakhir): {e}")
-            return None
-
     # --- [FUNGSI GENERATE STORY DIPERBAIKI] ---
-    async def generate_story_from_ai(self, server: str, nama_char: str, tanggal_lahir: str, kota_asal: str, story_type: str, bakat: str, culture: str, detail: str, jenis_kelamin: str, level: str) -> Optional[str]:
-        """Menghasilkan story dari AI dengan fallback LENGKAP."""
+    async def generate_story_from_ai(self, server: str, nama_char: str, tanggal_lahir: str, kota_asal: str, story_type: str, bakat: str, culture: str, detail: str, jenis_kelamin: str, level: str, on_progress: Optional[Callable[[str], Awaitable[None]]] = None, user_id: Optional[int] = None, on_queue: Optional[Callable[[int], Awaitable[None]]] = None) -> Optional[str]:
+        """Menghasilkan story dari AI dengan fallback LENGKAP. on_progress: menerima teks sementara (streaming)."""
 
         server_rules = SERVER_CONFIG[server]["rules"]
 
@@ -611,39 +526,26 @@ class CharacterStoryCog(commands.Cog, name="CharacterStory"):
         Output akhir harus berupa teks cerita saja dalam Bahasa Indonesia, tanpa judul atau format tambahan. Pastikan cerita yang dihasilkan menarik, konsisten, dan memenuhi semua aturan.
         """
 
-        # --- [PERBAIKAN] Fallback Logic Lengkap ---
-        story_text = None
-        ai_used = "Tidak ada"
-
+        # --- [PERBAIKAN] Fallback lewat AI Gateway ---
         # Urutan Fallback: OpenRouter -> AgentRouter -> Gemini -> Deepseek -> OpenAI
-        story_text = await self._try_openrouter(prompt)
-        if story_text: ai_used = "OpenRouter"
-
-        if not story_text:
-            story_text = await self._try_agentrouter(prompt)
-            if story_text: ai_used = "AgentRouter"
-
-        if not story_text:
-            story_text = await self._try_gemini(prompt)
-            if story_text: ai_used = "Gemini"
-
-        if not story_text:
-            story_text = await self._try_deepseek(prompt)
-            if story_text: ai_used = "Deepseek"
-
-        if not story_text:
-            story_text = await self._try_openai(prompt)
-            if story_text: ai_used = "OpenAI"
-        # --- [AKHIR PERBAIKAN] ---
-
-        if story_text:
-            logger.info(f"AI ({ai_used}) berhasil generate Char Story.")
-            cleaned_story = story_text.strip().replace("```", "")
-            return cleaned_story
-        else:
+        try:
+            if on_progress:
+                ai = await self.bot.ai.stream_complete(
+                    prompt, on_text=on_progress, temperature=0.75, max_tokens=1500, feature="char_story",
+                    user_id=user_id, on_queue=on_queue
+                )
+            else:
+                ai = await self.bot.ai.complete(
+                    prompt, temperature=0.75, max_tokens=1500, feature="char_story", user_id=user_id, on_queue=on_queue
+                )
+        except AIError:
             logger.error(f"Semua AI gagal generate Char Story untuk {nama_char}.")
             return None # Return None jika semua AI gagal
 
+        logger.info(f"AI ({ai.name}) berhasil generate Char Story.")
+        cleaned_story = ai.text.strip().replace("```", "")
+        return cleaned_story
+
     @commands.command(name="setupcs")
     async def setup_cs_panel(self, ctx):
         """Mengirim panel untuk membuat Character Story."""
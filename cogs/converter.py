@@ -7,7 +7,7 @@ import logging
 import aiohttp
 from typing import Optional
 
-from utils.database import get_upload_channel, set_upload_channel
+from utils.database import get_upload_channel_async, set_upload_channel_async
 
 logger = logging.getLogger(__name__)
 
@@ -38,7 +38,7 @@ class ConverterCog(commands.Cog, name="Converter"):
     @commands.has_permissions(administrator=True)
     async def setup_upload_channel(self, ctx, channel: discord.TextChannel):
         """Atur channel untuk link streaming."""
-        if set_upload_channel(ctx.guild.id, channel.id):
+        if await set_upload_channel_async(ctx.guild.id, channel.id):
             await ctx.send(f"✅ Channel diatur ke {channel.mention}")
         else:
             await ctx.send("❌ Gagal menyimpan ke database.")
@@ -47,7 +47,7 @@ class ConverterCog(commands.Cog, name="Converter"):
     @commands.cooldown(1, 60, commands.BucketType.user)
     async def convert_command(self, ctx, *, url: str):
         """Convert YouTube/TikTok/Spotify jadi link MP3 streaming untuk SA-MP."""
-        upload_channel_id = get_upload_channel(ctx.guild.id)
+        upload_channel_id = await get_upload_channel_async(ctx.guild.id)
         if not upload_channel_id:
             return await ctx.send("❌ Channel belum diatur. Admin ketik `!setuploadchannel #channel`")
 
@@ -6,13 +6,25 @@ import logging
 import asyncio
 import time
 import io
+import math
+from datetime import datetime, timedelta, timezone
 from utils.database import (
-    set_rating_log_channel, get_rating_log_channel, 
-    add_rating, get_rating_stats, get_all_ratings, update_rating_image
+    set_rating_log_channel_async, get_rating_log_channel_async, 
+    add_rating_async, get_rating_stats_async, get_ratings_page_async, update_rating_image_async
 )
 
 logger = logging.getLogger(__name__)
 
+REVIEWS_PER_PAGE = 8
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Cursor halaman ulasan disimpan di custom_id tombol: (created_at dalam mikrodetik, user_id)
+def _encode_review_cursor(created_at: datetime, user_id: int) -> str:
+    return f"{(created_at - _EPOCH) // timedelta(microseconds=1)}:{user_id}"
+
+def _decode_review_cursor(created_us: str, user_id: str):
+    return _EPOCH + timedelta(microseconds=int(created_us)), int(user_id)
+
 # --- 1. MODAL (Popup Input) ---
 class RatingModal(ui.Modal):
     def __init__(self, topic, stars, bot, panel_message: discord.Message):
@@ -35,7 +47,7 @@ class RatingModal(ui.Modal):
         user_id = interaction.user.id
         
         # 1. Simpan Ulasan Teks ke Database
-        if add_rating(user_id, self.topic, self.stars, self.comment.value):
+        if await add_rating_async(user_id, self.topic, self.stars, self.comment.value):
             
             # 2. Update Panel Real-time
             await self.update_panel_display()
@@ -84,7 +96,7 @@ class RatingModal(ui.Modal):
                         
                         if permanent_image_url:
                             # 3. Update Database dengan URL Permanen
-                            update_rating_image(user_id, self.topic, permanent_image_url)
+                            await update_rating_image_async(user_id, self.topic, permanent_image_url)
                             await interaction.followup.send("✅ **Gambar berhasil disimpan!**", ephemeral=True)
                         else:
                             await interaction.followup.send("⚠️ Gambar terkirim tapi gagal disimpan permanen (Log Channel belum diatur).", ephemeral=True)
@@ -113,14 +125,14 @@ class RatingModal(ui.Modal):
 
     async def upload_to_log_and_get_url(self, interaction, file_bytes, filename):
         """Mengupload gambar ke Log Channel dan mengambil URL-nya."""
-        log_id = get_rating_log_channel(interaction.guild.id)
+        log_id = await get_rating_log_channel_async(interaction.guild.id)
         if not log_id: return None
 
         channel = self.bot.get_channel(log_id)
         if not channel: return None
 
         # Siapkan Embed Log
-        avg, count = get_rating_stats(self.topic)
+        avg, count = await get_rating_stats_async(self.topic)
         color = discord.Color.green() if self.stars >= 4 else discord.Color.red()
         
         embed_log = discord.Embed(title=f"📝 Ulasan Baru: {self.topic}", color=color, timestamp=discord.utils.utcnow())
@@ -146,11 +158,11 @@ class RatingModal(ui.Modal):
 
     async def send_text_log_only(self, interaction):
         """Kirim log tanpa gambar jika user tidak upload."""
-        log_id = get_rating_log_channel(interaction.guild.id)
+        log_id = await get_rating_log_channel_async(interaction.guild.id)
         if log_id:
             channel = self.bot.get_channel(log_id)
             if channel:
-                avg, count = get_rating_stats(self.topic)
+                avg, count = await get_rating_stats_async(self.topic)
                 color = discord.Color.green() if self.stars >= 4 else discord.Color.red()
                 embed_log = discord.Embed(title=f"📝 Ulasan Baru: {self.topic}", color=color, timestamp=discord.utils.utcnow())
                 embed_log.set_author(name=interaction.user.display_name, icon_url=interaction.user.display_avatar.url)
@@ -163,7 +175,7 @@ class RatingModal(ui.Modal):
     async def update_panel_display(self):
         """Helper untuk update tampilan panel rating."""
         if not self.panel_message: return
-        avg, count = get_rating_stats(self.topic)
+        avg, count = await get_rating_stats_async(self.topic)
         try:
             embed = self.panel_message.embeds[0]
             field_found = False
@@ -212,42 +224,83 @@ class RatingSystem(commands.Cog):
             try:
                 topic = cid.split(":")[1]
                 await interaction.response.defer(ephemeral=True)
+                await self._show_reviews_page(interaction, topic, page=1)
+            except Exception as e:
+                logger.error(f"Error tombol lihat ulasan: {e}")
+                await interaction.followup.send("❌ Gagal memuat ulasan.", ephemeral=True)
 
-                ratings = get_all_ratings(topic)
-                avg, count = get_rating_stats(topic)
+        elif cid.startswith("reviews_page:"):
+            # Format: reviews_page:<n|p>:<halaman>:<created_us>:<user_id>:<topic>
+            try:
+                _, direction, page, created_us, user_id, topic = cid.split(":", 5)
+                cursor = _decode_review_cursor(created_us, user_id)
+                newer = direction == "p"
+                page = int(page) + (-1 if newer else 1)
+                await self._show_reviews_page(interaction, topic, page, cursor, newer)
+            except Exception as e:
+                logger.error(f"Error tombol halaman ulasan: {e}")
+                if not interaction.response.is_done():
+                    await interaction.response.send_message("❌ Gagal memuat ulasan.", ephemeral=True)
+
+    async def _show_reviews_page(self, interaction: discord.Interaction, topic: str, page: int, cursor=None, newer: bool = False):
+        """Ambil satu halaman ulasan saja (keyset), lalu kirim / edit pesan dengan tombol Prev/Next."""
+        (ratings, has_more), (avg, count) = await asyncio.gather(
+            get_ratings_page_async(topic, REVIEWS_PER_PAGE, cursor, newer),
+            get_rating_stats_async(topic)
+        )
+        is_nav = cursor is not None
+
+        if not ratings:
+            msg = f"📭 Belum ada ulasan untuk topik **{topic}**." if not is_nav else "📭 Tidak ada ulasan lagi di halaman ini."
+            if is_nav:
+                await interaction.response.send_message(msg, ephemeral=True)
+            else:
+                await interaction.followup.send(msg, ephemeral=True)
+            return
+
+        embed = discord.Embed(title=f"📋 Daftar Ulasan: {topic}", description=f"**Rata-rata:** ⭐ {avg}/5.0 | **Total:** {count} Ulasan", color=discord.Color.blue())
+
+        for r in ratings:
+            user_id, stars, comment, created_at, image_url = r
+            user = interaction.guild.get_member(user_id)
+            name = user.display_name if user else f"User {user_id}"
+            date_str = created_at.strftime("%d/%m/%Y")
+            
+            text_val = f"{comment[:150]}"
+            if image_url:
+                text_val += f"\n🖼️ [Lihat Bukti]({image_url})"
+            
+            embed.add_field(name=f"{'⭐' * stars} - {name} ({date_str})", value=text_val, inline=False)
 
-                if not ratings:
-                    await interaction.followup.send(f"📭 Belum ada ulasan untuk topik **{topic}**.", ephemeral=True)
-                    return
+        total_pages = max(1, math.ceil(count / REVIEWS_PER_PAGE))
+        page = max(1, min(page, total_pages))
+        embed.set_footer(text=f"Halaman {page}/{total_pages}")
 
-                embed = discord.Embed(title=f"📋 Daftar Ulasan: {topic}", description=f"**Rata-rata:** ⭐ {avg}/5.0 | **Total:** {count} Ulasan", color=discord.Color.blue())
-                
-                limit = 8
-                for r in ratings[:limit]:
-                    user_id, stars, comment, created_at, image_url = r
-                    user = interaction.guild.get_member(user_id)
-                    name = user.display_name if user else f"User {user_id}"
-                    date_str = created_at.strftime("%d/%m/%Y")
-                    
-                    text_val = f"{comment[:150]}"
-                    if image_url:
-                        text_val += f"\n🖼️ [Lihat Bukti]({image_url})"
-                    
-                    embed.add_field(name=f"{'⭐' * stars} - {name} ({date_str})", value=text_val, inline=False)
-                
-                if len(ratings) > limit:
-                    embed.set_footer(text=f"Dan {len(ratings) - limit} ulasan lainnya...")
-                
-                await interaction.followup.send(embed=embed, ephemeral=True)
+        # Arah "newer" (Prev): has_more = masih ada halaman sebelumnya
+        has_prev = has_more if (is_nav and newer) else is_nav and page > 1
+        has_next = True if (is_nav and newer) else has_more
 
-            except Exception as e:
-                logger.error(f"Error tombol lihat ulasan: {e}")
-                await interaction.followup.send("❌ Gagal memuat ulasan.", ephemeral=True)
+        view = ui.View(timeout=None)
+        first, last = ratings[0], ratings[-1]
+        prev_id = f"reviews_page:p:{page}:{_encode_review_cursor(first[3], first[0])}:{topic}"
+        next_id = f"reviews_page:n:{page}:{_encode_review_cursor(last[3], last[0])}:{topic}"
+        # custom_id Discord maksimal 100 karakter; topik yang terlalu panjang tidak bisa dipaginasi
+        if len(prev_id) <= 100 and len(next_id) <= 100:
+            view.add_item(ui.Button(label="Prev", emoji="◀️", custom_id=prev_id, style=discord.ButtonStyle.secondary, disabled=not has_prev))
+            view.add_item(ui.Button(label="Next", emoji="▶️", custom_id=next_id, style=discord.ButtonStyle.secondary, disabled=not has_next))
+        # Tombol tanpa callback (klik ditangani on_interaction): view yang sudah di-stop tidak disimpan
+        # discord.py di view store, jadi custom_id per cursor tidak menumpuk setiap klik Prev/Next
+        view.stop()
+
+        if is_nav:
+            await interaction.response.edit_message(embed=embed, view=view)
+        else:
+            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
 
     @app_commands.command(name="config_rating_log", description="Atur channel untuk laporan rating masuk.")
     @app_commands.checks.has_permissions(administrator=True)
     async def config_rating_log(self, interaction: discord.Interaction, channel: discord.TextChannel):
-        if set_rating_log_channel(interaction.guild.id, channel.id):
+        if await set_rating_log_channel_async(interaction.guild.id, channel.id):
             await interaction.response.send_message(f"✅ Laporan rating akan dikirim ke {channel.mention}", ephemeral=True)
         else:
             await interaction.response.send_message("❌ Gagal menyimpan konfigurasi.", ephemeral=True)
@@ -262,7 +315,7 @@ class RatingSystem(commands.Cog):
     )
     @app_commands.checks.has_permissions(administrator=True)
     async def create_rating_panel(self, interaction: discord.Interaction, topik: str, judul: str, deskripsi: str, gambar: discord.Attachment = None, required_role: discord.Role = None):
-        avg, count = get_rating_stats(topik)
+        avg, count = await get_rating_stats_async(topik)
 
         embed = discord.Embed(title=judul, description=deskripsi, color=0xf1c40f)
         if gambar: embed.set_image(url=gambar.url)
@@ -4,7 +4,7 @@ from discord.ext import commands
 from discord import ui
 import logging
 import json
-from utils.database import save_catalog_config, get_catalog_config
+from utils.database import save_catalog_config_async, get_catalog_config_async
 
 logger = logging.getLogger(__name__)
 
@@ -35,7 +35,7 @@ class DynamicRoleSelect(ui.Select):
 
     async def callback(self, interaction: discord.Interaction):
         # 1. Tarik config dari Database berdasarkan ID Pesan
-        config = get_catalog_config(interaction.message.id)
+        config = await get_catalog_config_async(interaction.message.id)
         if not config:
             await interaction.response.send_message("❌ Data katalog ini hilang/rusak.", ephemeral=True)
             return
@@ -144,7 +144,7 @@ class RoleCatalogCog(commands.Cog, name="RoleCatalog"):
             sent_msg = await interaction.channel.send(embed=embed, view=view)
 
             # 5. Simpan Config ke Database (Biar tombol jalan selamanya)
-            save_success = save_catalog_config(sent_msg.id, interaction.guild.id, interaction.channel.id, config)
+            save_success = await save_catalog_config_async(sent_msg.id, interaction.guild.id, interaction.channel.id, config)
 
             if save_success:
                 await interaction.followup.send(f"✅ Katalog berhasil dibuat! (ID: {sent_msg.id})", ephemeral=True)
@@ -163,7 +163,7 @@ class RoleCatalogCog(commands.Cog, name="RoleCatalog"):
         # Listener biar tombol tetap hidup kalau bot restart
         if interaction.type == discord.InteractionType.component:
             if interaction.data.get("custom_id") == "dynamic_catalog_select":
-                config = get_catalog_config(interaction.message.id)
+                config = await get_catalog_config_async(interaction.message.id)
                 if not config:
                     await interaction.response.send_message("❌ Data katalog hilang.", ephemeral=True)
                     return
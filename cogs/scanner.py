@@ -1,39 +1,36 @@
 import discord
 from discord.ext import commands, tasks
 import os
-import zipfile
-import shutil
-import re
 import json
 import asyncio
 import aiohttp
 from typing import List, Tuple, Dict, Set, Union # Tambahkan Union
-import py7zr
-import rarfile
-from openai import AsyncOpenAI
-import google.generativeai as genai
-import httpx
 import time
-import itertools
 import hashlib
 import logging
+import math
+from collections import Counter
+from bisect import bisect_left
 from urllib.parse import urlparse
 from datetime import datetime, timedelta
 import io
-import sqlite3
 
 # Import fungsi dari folder utils
 # --- [PERBAIKAN REQ #3: Import Pangkat (Rank) & Limit AI Baru] ---
 from utils.database import (
-    check_ai_limit, increment_ai_usage, save_scan_history,
-    set_user_rank, VALID_RANKS, get_user_rank
+    check_ai_limit_async, reserve_ai_quota_async, refund_ai_quota_async, save_scan_history_async,
+    set_user_rank_async, VALID_RANKS, get_user_rank_async,
+    get_scan_history_async, count_user_scans_async, get_cache_stats, flush_pending_writes_async,
+    run_maintenance_async, get_query_stats, get_scan_verdicts_async, put_scan_verdict_async, clear_scan_verdicts_async
 )
 # --- [AKHIR PERBAIKAN] ---
 from utils.checks import check_user_cooldown
+from utils.scan_worker import ScanPool
+from utils.ai_gateway import AIError, HEDGE_POLICIES, parse_json, queue_status_updater
+from utils.ai_scheduler import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
 
 # Mengambil logger yang sudah dikonfigurasi di main.py
 logger = logging.getLogger(__name__)
-DB_FILE = 'scanner.db'
 
 # ============================
 # KONSTANTA & DEFINISI POLA
@@ -87,6 +84,19 @@ SUSPICIOUS_PATTERNS = {
     r"if not s\[[a-zA-Z_][a-zA-Z0-9_]*\]then s\[[a-zA-Z_][a-zA-Z0-9_]*\]=0x1": {"level": DangerLevel.SUSPICIOUS, "description": "Conditional table assignment - pattern obfuscation ringan"}
 }
 
+# Urutan fallback AI untuk mode 'auto' (juga daftar pilihan analis yang valid)
+SCANNER_AI_ORDER = ["openrouter", "agentrouter", "openai", "gemini", "deepseek"]
+
+# Analisis bertahap (map-reduce) untuk script besar: file dipotong per baris, lalu hanya potongan
+# yang relevan (awal file, sekitar pola terdeteksi, region ber-entropi tinggi) dikirim ke AI secara paralel.
+SCANNER_CHUNK_CHARS = int(os.getenv("SCANNER_CHUNK_CHARS", "3000"))
+SCANNER_AI_CHAR_BUDGET = int(os.getenv("SCANNER_AI_CHAR_BUDGET", "12000"))  # total karakter kode per file
+SCANNER_ENTROPY_THRESHOLD = float(os.getenv("SCANNER_ENTROPY_THRESHOLD", "5.2"))  # bit/karakter
+# File kecil dalam satu arsip digabung ke satu prompt (<= SCANNER_CHUNK_CHARS per file, <= budget per batch)
+SCANNER_BATCH_MAX_FILES = int(os.getenv("SCANNER_BATCH_MAX_FILES", "8"))
+# Batas ukuran satu member arsip setelah dekompresi (arsip dibaca ke memori)
+SCANNER_MAX_MEMBER_MB = int(os.getenv("SCANNER_MAX_MEMBER_MB", "20"))
+
 AI_PROMPT = """
 Anda adalah ahli keamanan siber berpengalaman. Analisis script berikut dengan teliti.
 
@@ -127,6 +137,154 @@ Format JSON:
 }}
 """
 
+AI_BATCH_PROMPT = """
+Anda adalah ahli keamanan siber berpengalaman. Analisis SETIAP file berikut secara TERPISAH.
+
+PENTING:
+- Level bahaya SUDAH ditentukan sistem deteksi pattern
+- JANGAN sebutkan platform: "SAMP", "GTA SA", "MoonLoader"
+- Langsung jelaskan FUNGSI KONKRET (aimbot, wallhack, keylogger, dll)
+- Identifikasi RISIKO SPESIFIK (mencuri password, kirim data kemana, dll)
+- PERHATIAN KHUSUS: Jika kode ter-obfuscate (MoonSec, hex values, kode acak) = SANGAT MENCURIGAKAN
+- Sebutkan konteks penggunaan legitimate jika memungkinkan
+- Maksimal 150 karakter per field JSON
+- WAJIB satu entri untuk setiap file, dengan "index" sesuai nomor FILE
+
+{files}
+
+Format JSON:
+{{
+    "files": [
+        {{
+            "index": <nomor FILE>,
+            "script_purpose": "Fungsi konkret script (maks 150 char)",
+            "analysis_summary": "Risiko spesifik (maks 150 char)",
+            "confidence_score": <1-100>
+        }}
+    ]
+}}
+"""
+
+AI_CHUNK_NOTE = """
+CATATAN: Script di bawah adalah POTONGAN {index}/{total} (baris {start}-{end} dari {lines} baris) dari file yang lebih besar.
+Potongan ini dipilih karena: {reason}. Analisis isi potongan ini saja.
+"""
+
+# Versi rule-set: berubah otomatis saat pola, prompt atau pengaturan potongan berubah,
+# sehingga verdict tersimpan (memori & tabel scan_verdicts) dari rule-set lama tidak terpakai lagi.
+RULES_VERSION = hashlib.sha256(json.dumps(
+    [SUSPICIOUS_PATTERNS, AI_PROMPT, AI_BATCH_PROMPT, AI_CHUNK_NOTE, SCANNER_CHUNK_CHARS, SCANNER_AI_CHAR_BUDGET, SCANNER_ENTROPY_THRESHOLD],
+    sort_keys=True
+).encode()).hexdigest()[:12]
+
+# ============================
+# PEMILIHAN POTONGAN UNTUK AI
+# ============================
+def _shannon_entropy(text: str) -> float:
+    if not text: return 0.0
+    total = len(text)
+    return -sum((n / total) * math.log2(n / total) for n in Counter(text).values())
+
+
+def _split_chunks(content: str, size: int = SCANNER_CHUNK_CHARS) -> List[Dict]:
+    """Potong konten per baris menjadi potongan <= size karakter (baris super panjang dipotong paksa)."""
+    chunks: List[Dict] = []
+    parts: List[str] = []
+    length, start_line, line_no = 0, 1, 0
+
+    def flush(end_line: int):
+        nonlocal parts, length
+        if parts:
+            chunks.append({"start": start_line, "end": end_line, "text": "".join(parts)})
+        parts, length = [], 0
+
+    for line_no, line in enumerate(content.splitlines(keepends=True), 1):
+        # Kode obfuscated sering satu baris raksasa: potong paksa
+        while len(line) > size:
+            flush(line_no - 1)
+            chunks.append({"start": line_no, "end": line_no, "text": line[:size]})
+            line = line[size:]
+        if not line: continue
+        if length + len(line) > size: flush(line_no - 1)
+        if not parts: start_line = line_no
+        parts.append(line)
+        length += len(line)
+    flush(line_no)
+    return chunks
+
+
+def _select_chunks(content: str, issues: List[Dict], budget: int = SCANNER_AI_CHAR_BUDGET) -> List[Dict]:
+    """
+    Pilih potongan untuk dianalisis AI dalam batas budget karakter:
+    awal file selalu ikut, lalu potongan dengan pola paling berbahaya, lalu entropi tertinggi.
+    Hasil diurutkan sesuai posisi di file.
+    """
+    chunks = _split_chunks(content)
+    if len(chunks) <= 1: return chunks
+
+    # Pola -> potongan lewat bisect pada baris awal potongan (file obfuscated bisa punya ribuan match)
+    starts = [c["start"] for c in chunks]
+    hit_counts, hit_levels = [0] * len(chunks), [0] * len(chunks)
+    for issue in issues:
+        idx = bisect_left(starts, issue["line"])
+        # Baris super panjang dipecah ke beberapa potongan: match dihitung di potongan pertamanya
+        if idx == len(chunks) or starts[idx] != issue["line"]: idx -= 1
+        if idx >= 0:
+            hit_counts[idx] += 1
+            hit_levels[idx] += issue["level"]
+
+    for idx, chunk in enumerate(chunks):
+        chunk["index"] = idx
+        chunk["hits"] = hit_levels[idx]
+        chunk["entropy"] = _shannon_entropy(chunk["text"])
+        reasons = []
+        if idx == 0: reasons.append("awal file")
+        if hit_counts[idx]: reasons.append(f"{hit_counts[idx]} pola terdeteksi")
+        if chunk["entropy"] >= SCANNER_ENTROPY_THRESHOLD: reasons.append(f"entropi tinggi ({chunk['entropy']:.1f} bit/karakter)")
+        chunk["reason"] = ", ".join(reasons)
+
+    candidates = [c for c in chunks[1:] if c["hits"] or c["entropy"] >= SCANNER_ENTROPY_THRESHOLD]
+    candidates.sort(key=lambda c: (-c["hits"], -c["entropy"]))
+    selected, used = [chunks[0]], len(chunks[0]["text"])
+    for chunk in candidates:
+        if used + len(chunk["text"]) > budget: continue
+        selected.append(chunk)
+        used += len(chunk["text"])
+    selected.sort(key=lambda c: c["index"])
+    return selected
+
+
+def _pack_batches(files: List[Tuple[int, str]], budget: int = SCANNER_AI_CHAR_BUDGET,
+                  max_files: int = SCANNER_BATCH_MAX_FILES) -> List[List[int]]:
+    """Kelompokkan (id, isi) file kecil ke batch dalam budget karakter (first-fit decreasing)."""
+    batches: List[Tuple[int, List[int]]] = []
+    for file_id, text in sorted(files, key=lambda f: -len(f[1])):
+        for i, (used, ids) in enumerate(batches):
+            if used + len(text) <= budget and len(ids) < max_files:
+                ids.append(file_id)
+                batches[i] = (used + len(text), ids)
+                break
+        else:
+            batches.append((len(text), [file_id]))
+    return [sorted(ids) for _, ids in batches]
+
+
+def _merge_chunk_verdicts(results: List[Dict]) -> Dict:
+    """Gabungkan verdict per potongan menjadi satu ringkasan (reduce)."""
+    if len(results) == 1: return dict(results[0])
+    summaries = list(dict.fromkeys(
+        f"L{r['lines']}: {r.get('analysis_summary', '').strip()}" for r in results if r.get('analysis_summary')
+    ))
+    scores = [r['confidence_score'] for r in results if isinstance(r.get('confidence_score'), (int, float))]
+    return {
+        "script_purpose": results[0].get('script_purpose', 'N/A'),
+        "analysis_summary": " | ".join(summaries) or "N/A",
+        # Konservatif: potongan yang paling tidak yakin menentukan
+        "confidence_score": min(scores) if scores else None,
+        "ai_type": ", ".join(dict.fromkeys(r['ai_type'] for r in results)),
+        "chunks_analyzed": len(results),
+    }
+
 # ============================
 # UI COMPONENTS (VIEWS)
 # ============================
@@ -214,49 +372,26 @@ class ScannerCog(commands.Cog, name="Scanner"):
         self.bot = bot
         self.config = bot.config
         self.processing_queue = asyncio.Queue(maxsize=self.config.QUEUE_MAX_SIZE)
-        self.file_cache = {}
         self.scan_stats = {"total_scans": 0, "dangerous_files": 0, "safe_files": 0}
 
-        self.deepseek_key_cycler = itertools.cycle(self.config.DEEPSEEK_API_KEYS) if self.config.DEEPSEEK_API_KEYS else None
-        self.gemini_key_cycler = itertools.cycle(self.config.GEMINI_API_KEYS) if self.config.GEMINI_API_KEYS else None
-        self.openai_key_cycler = itertools.cycle(self.config.OPENAI_API_KEYS) if self.config.OPENAI_API_KEYS else None
-
-        # --- [PERBAIKAN REQ #2: Gunakan config untuk SEMUA keys] ---
-        # Mengambil daftar key dari bot.config (yang dimuat di main.py)
-        self.openrouter_key_cycler = itertools.cycle(self.config.OPENROUTER_API_KEYS) if self.config.OPENROUTER_API_KEYS else None
-        self.agentrouter_key_cycler = itertools.cycle(self.config.AGENTROUTER_API_KEYS) if self.config.AGENTROUTER_API_KEYS else None
-
-        if self.config.OPENROUTER_API_KEYS:
-            self.openrouter_headers = {
-                "HTTP-Referer": getattr(self.config, 'OPENROUTER_SITE_URL', 'http://localhost'),
-                "X-Title": getattr(self.config, 'OPENROUTER_SITE_NAME', 'MBOT'),
-            }
-            logger.info(f"✅ OpenRouter keys ({len(self.config.OPENROUTER_API_KEYS)}) dimuat untuk Scanner.")
-        else:
-            logger.warning("⚠️ OpenRouter API keys (OPENROUTER_API_KEY) tidak ditemukan di config.")
-
-        if self.config.AGENTROUTER_API_KEYS:
-            logger.info(f"✅ AgentRouter keys ({len(self.config.AGENTROUTER_API_KEYS)}) dimuat untuk Scanner.")
-        else:
-            logger.warning("⚠️ AgentRouter API keys (AGENTROUTER_API_KEY) tidak ditemukan di config.")
-        # --- [AKHIR PERBAIKAN REQ #2] ---
+        # Semua provider AI lewat gateway bersama (bot.ai), key & client dikelola di sana
+        self.ai = bot.ai
+        # Kerja CPU scan (ekstrak, decode, pola, hash) di proses terpisah
+        self.scan_pool = ScanPool(SUSPICIOUS_PATTERNS)
 
-        self.cleanup_task.start()
-        logger.info("✅ Scanner Cog loaded, cleanup task started.")
+        self.db_maintenance_task.start()
+        logger.info("✅ Scanner Cog loaded, maintenance task started.")
 
-    def cog_unload(self):
-        self.cleanup_task.cancel()
+    async def cog_unload(self):
+        self.db_maintenance_task.cancel()
+        self.scan_pool.shutdown()
+        # Riwayat scan yang masih di buffer write-behind langsung ditulis ke DB
+        await flush_pending_writes_async()
         logger.info("🛑 Scanner Cog unloaded, cleanup task stopped.")
 
     # ============================
     # FUNGSI-FUNGSI HELPER
     # ============================
-    def _get_file_hash(self, content: bytes) -> str:
-        return hashlib.sha256(content).hexdigest()
-
-    def _is_cache_valid(self, timestamp: float) -> bool:
-        return time.time() - timestamp < (self.config.CACHE_EXPIRE_HOURS * 3600)
-
     def _get_level_emoji_color(self, level: int) -> Tuple[str, int]:
         if level == DangerLevel.SAFE: return "🟢", 0x00FF00
         if level == DangerLevel.SUSPICIOUS: return "🟡", 0xFFFF00
@@ -269,17 +404,8 @@ class ScannerCog(commands.Cog, name="Scanner"):
         percentage = int(100 * current / total)
         return f"[{'█' * filled}{'▒' * (length - filled)}] {percentage}%"
 
-    def _get_file_metadata(self, file_path: str) -> Dict:
-        try:
-            stats = os.stat(file_path)
-            return {
-                "size": stats.st_size,
-                "modified": datetime.fromtimestamp(stats.st_mtime).isoformat(),
-                "extension": os.path.splitext(file_path)[1].lower()
-            }
-        except Exception as e:
-            logger.error(f"Error getting file metadata: {e}")
-            return {}
+    def _get_file_metadata(self, filename: str, file_content: bytes) -> Dict:
+        return {"size": len(file_content), "extension": os.path.splitext(filename)[1].lower()}
 
     async def _download_from_url(self, url: str) -> Tuple[bytes, str]:
         async with aiohttp.ClientSession() as session:
@@ -295,106 +421,27 @@ class ScannerCog(commands.Cog, name="Scanner"):
                 filename = os.path.basename(urlparse(url).path) or "downloaded_file"
                 return content, filename
 
-    def _extract_archive(self, file_path: str, extract_to: str) -> bool:
-        file_count = 0
-        allowed_ext = tuple(self.config.ALLOWED_EXTENSIONS)
-        try:
-            if file_path.endswith('.zip'):
-                with zipfile.ZipFile(file_path, 'r') as zf:
-                    members = [m for m in zf.namelist() if m.endswith(allowed_ext) and not m.startswith('__MACOSX/')][:self.config.MAX_ARCHIVE_FILES]
-                    for member in members: zf.extract(member, extract_to); file_count += 1
-            elif file_path.endswith('.7z'):
-                with py7zr.SevenZipFile(file_path, mode='r') as szf:
-                    members = [m.filename for m in szf.files if m.filename.endswith(allowed_ext)][:self.config.MAX_ARCHIVE_FILES]
-                    for member in members: szf.extract(targets=member, path=extract_to); file_count += 1
-            elif file_path.endswith('.rar'):
-                with rarfile.RarFile(file_path) as rf:
-                    members = [m for m in rf.namelist() if m.endswith(allowed_ext)][:self.config.MAX_ARCHIVE_FILES]
-                    for member in members: rf.extract(member, extract_to); file_count += 1
-            return file_count > 0
-        except Exception as e:
-            logger.error(f"Gagal ekstrak {file_path}: {e}")
-            return False
-
     # ============================
     # FUNGSI ANALISIS AI
     # ============================
 
-    # Fungsi analisis OpenRouter dan AgentRouter (tetap sama)
-    async def _analyze_with_openrouter(self, code_snippet: str, api_key: str) -> Dict:
-        """Menganalisis kode dengan OpenRouter."""
-        async with httpx.AsyncClient(timeout=45.0) as client:
-            payload = {
-                "model": "mistralai/mistral-7b-instruct:free", # Model Teks Gratis
-                "messages": [{"role": "user", "content": AI_PROMPT.format(code_snippet=code_snippet[:3000])}],
-                "response_format": {"type": "json_object"},
-                "temperature": 0.0,
-                "max_tokens": 2048
-            }
-            headers = {"Authorization": f"Bearer {api_key}"}
-            if hasattr(self, 'openrouter_headers'):
-                headers.update(self.openrouter_headers)
-
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                json=payload,
-                headers=headers
-            )
-            response.raise_for_status()
-            response_json = response.json()
-            response_content = response_json["choices"][0]["message"]["content"]
-            cleaned_response = re.sub(r'```json\s*|\s*```', '', response_content.strip(), flags=re.DOTALL)
-            return json.loads(cleaned_response)
-
-    async def _analyze_with_agentrouter(self, code_snippet: str, api_key: str) -> Dict:
-        """Menganalisis kode dengan AgentRouter."""
-        client = AsyncOpenAI(
-            api_key=api_key,
-            base_url="https://agentrouter.org/v1",
-            timeout=45.0
-        )
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": AI_PROMPT.format(code_snippet=code_snippet[:3000])}],
-            response_format={"type": "json_object"},
-            temperature=0.0
-        )
-        response_content = response.choices[0].message.content
-        cleaned_response = re.sub(r'```json\s*|\s*```', '', response_content.strip(), flags=re.DOTALL)
-        return json.loads(cleaned_response)
-
-    # Fungsi analisis DeepSeek, OpenAI, Gemini (tetap sama)
-    async def _analyze_with_deepseek(self, code_snippet: str, api_key: str) -> Dict:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            response = await client.post(
-                "https://api.deepseek.com/chat/completions",
-                json={"model": "deepseek-chat", "messages": [{"role": "user", "content": AI_PROMPT.format(code_snippet=code_snippet[:3000])}], "response_format": {"type": "json_object"}, "temperature": 0.0},
-                headers={"Authorization": f"Bearer {api_key}"}
-            )
-            response.raise_for_status()
-            return json.loads(response.json()["choices"][0]["message"]["content"])
-
-    async def _analyze_with_openai(self, code_snippet: str, api_key: str) -> Dict:
-        client = AsyncOpenAI(api_key=api_key)
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": AI_PROMPT.format(code_snippet=code_snippet[:3000])}],
-            response_format={"type": "json_object"}, temperature=0.0
-        )
-        return json.loads(response.choices[0].message.content)
-
-    async def _analyze_with_gemini(self, code_snippet: str, api_key: str) -> Dict:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = await model.generate_content_async(
-            AI_PROMPT.format(code_snippet=code_snippet[:3000]),
-             generation_config=genai.types.GenerationConfig(
-                response_mime_type="application/json",
-                temperature=0.0
-             )
-        )
-        cleaned_response = re.sub(r'```json\s*|\s*```', '', response.text.strip(), flags=re.DOTALL)
-        return json.loads(cleaned_response)
+    @staticmethod
+    def _parse_analysis(text: str) -> Dict:
+        data = parse_json(text)
+        if not isinstance(data, dict): raise ValueError("Format JSON analisis tidak valid (bukan object).")
+        return data
+
+    @staticmethod
+    def _parse_batch_analysis(text: str) -> Dict[int, Dict]:
+        data = parse_json(text)
+        entries = data.get("files") if isinstance(data, dict) else data
+        if not isinstance(entries, list): raise ValueError("Format JSON batch tidak valid (tidak ada daftar 'files').")
+        verdicts = {}
+        for entry in entries:
+            if isinstance(entry, dict) and isinstance(entry.get("index"), int):
+                verdicts[entry["index"]] = entry
+        if not verdicts: raise ValueError("Batch JSON tidak berisi verdict per file.")
+        return verdicts
 
     def _analyze_manually(self, detected_issues: List[Dict]) -> Dict:
         if not detected_issues: return {"script_purpose": "Tidak ada pola mencurigakan", "analysis_summary": "Analisis manual tidak menemukan pola berbahaya.", "confidence_score": 85}
@@ -402,6 +449,34 @@ class ScannerCog(commands.Cog, name="Scanner"):
         return {"script_purpose": "Analisis manual berbasis pola", "analysis_summary": summary, "confidence_score": 75}
 
 
+    def _analysts_for(self, choice: str) -> List[str]:
+        if choice == 'auto':
+            return self.ai.available_providers(SCANNER_AI_ORDER)
+        return self.ai.available_providers([choice]) if choice in SCANNER_AI_ORDER else []
+
+    def _ai_callbacks(self, loading_msg: discord.Message, ctx_or_msg: Union[commands.Context, discord.Message]):
+        """Callback on_attempt/on_failure untuk AIGateway.complete (dipakai bersama oleh beberapa request paralel)."""
+        is_command = isinstance(ctx_or_msg, commands.Context)
+        notified_failures = set()
+
+        async def on_attempt(provider: str):
+            # Jaga pesan loading tetap generik
+            try:
+                await loading_msg.edit(content=f"🧠 Menganalisis dengan {self.ai.display_name(provider)}...")
+            except discord.NotFound:
+                pass
+
+        async def on_failure(provider: str, error: Exception):
+            # Kirim notifikasi kegagalan secara EPHEMERAL jika ini dari command (sekali per provider, bukan per request)
+            if is_command and provider not in notified_failures:
+                notified_failures.add(provider)
+                try:
+                    await ctx_or_msg.send(f"⚠️ {self.ai.display_name(provider)} gagal, mencoba fallback berikutnya...", ephemeral=True, delete_after=10)
+                except Exception as send_error:
+                    logger.warning(f"Gagal mengirim notifikasi fallback ephemeral: {send_error}")
+
+        return on_attempt, on_failure
+
     # --- [PERUBAHAN 3: Fallback & Ephemeral Error] ---
     async def _get_ai_analysis_with_fallback(
         self,
@@ -419,21 +494,14 @@ class ScannerCog(commands.Cog, name="Scanner"):
             manual_result['ai_type'] = "Manual"
             return manual_result, "Manual", [manual_result]
 
+        # File kosong / hanya whitespace: tidak ada potongan untuk AI, jangan laporkan sebagai "AI gagal"
+        if not code_snippet.strip():
+            empty_result = {"script_purpose": "File kosong", "analysis_summary": "File tidak berisi kode untuk dianalisis.", "confidence_score": 100, "ai_type": "Manual"}
+            return empty_result, "Manual", [empty_result]
+
         # Tentukan urutan AI berdasarkan 'choice'
-        analysts_to_try = []
         is_command = isinstance(ctx_or_msg, commands.Context) # Cek apakah ini dari command
-
-        if choice == 'auto':
-            if self.openrouter_key_cycler: analysts_to_try.append(("OpenRouter", self.openrouter_key_cycler, self._analyze_with_openrouter))
-            if self.agentrouter_key_cycler: analysts_to_try.append(("AgentRouter", self.agentrouter_key_cycler, self._analyze_with_agentrouter))
-            if self.openai_key_cycler: analysts_to_try.append(("OpenAI", self.openai_key_cycler, self._analyze_with_openai))
-            if self.gemini_key_cycler: analysts_to_try.append(("Gemini", self.gemini_key_cycler, self._analyze_with_gemini))
-            if self.deepseek_key_cycler: analysts_to_try.append(("DeepSeek", self.deepseek_key_cycler, self._analyze_with_deepseek))
-        elif choice == 'openrouter' and self.openrouter_key_cycler: analysts_to_try.append(("OpenRouter", self.openrouter_key_cycler, self._analyze_with_openrouter))
-        elif choice == 'agentrouter' and self.agentrouter_key_cycler: analysts_to_try.append(("AgentRouter", self.agentrouter_key_cycler, self._analyze_with_agentrouter))
-        elif choice == 'openai' and self.openai_key_cycler: analysts_to_try.append(("OpenAI", self.openai_key_cycler, self._analyze_with_openai))
-        elif choice == 'gemini' and self.gemini_key_cycler: analysts_to_try.append(("Gemini", self.gemini_key_cycler, self._analyze_with_gemini))
-        elif choice == 'deepseek' and self.deepseek_key_cycler: analysts_to_try.append(("DeepSeek", self.deepseek_key_cycler, self._analyze_with_deepseek))
+        analysts_to_try = self._analysts_for(choice)
 
         if not analysts_to_try:
             logger.warning(f"Tidak ada analis AI yang tersedia untuk pilihan '{choice}', menggunakan manual.")
@@ -441,28 +509,46 @@ class ScannerCog(commands.Cog, name="Scanner"):
             manual_result['ai_type'] = "Manual"
             return manual_result, "Manual", [manual_result]
 
-        # Loop fallback chain
-        for name, keys, analyzer_func in analysts_to_try:
+        on_attempt, on_failure = self._ai_callbacks(loading_msg, ctx_or_msg)
+
+        # Map: potongan terpilih dianalisis paralel dengan satu deadline bersama,
+        # jadi file besar tidak menambah latency berlipat
+        chunks = _select_chunks(code_snippet, detected_issues)
+        total_lines = code_snippet.count('\n') + 1
+        deadline = time.monotonic() + HEDGE_POLICIES["scanner"].budget
+
+        async def analyze_chunk(chunk: Dict) -> Union[Dict, None]:
+            prompt = AI_PROMPT.format(code_snippet=chunk["text"])
+            if len(chunks) > 1:
+                prompt = AI_CHUNK_NOTE.format(
+                    index=chunks.index(chunk) + 1, total=len(chunks), start=chunk["start"], end=chunk["end"],
+                    lines=total_lines, reason=chunk["reason"]
+                ) + prompt
             try:
-                # Jaga pesan loading tetap generik
-                await loading_msg.edit(content=f"🧠 Menganalisis dengan {name}...")
-                key = next(keys)
-                result = await analyzer_func(code_snippet, key)
-                result['ai_type'] = name
-                logger.info(f"Analisis AI ({name}) berhasil.")
-                return result, name, [result] # Sukses
-            except Exception as e:
-                logger.warning(f"====== SCANNER: {name} GAGAL: {e} ======")
-                # Kirim notifikasi kegagalan secara EPHEMERAL jika ini dari command
-                if is_command:
-                    try:
-                        # Coba kirim ephemeral, jika gagal (misal interaksi lama), abaikan
-                        await ctx_or_msg.send(f"⚠️ {name} gagal, mencoba fallback berikutnya...", ephemeral=True, delete_after=10)
-                    except Exception as send_error:
-                         logger.warning(f"Gagal mengirim notifikasi fallback ephemeral: {send_error}")
-                         pass # Lanjutkan fallback tanpa notifikasi ephemeral
-                # JANGAN edit loading_msg publik dengan error spesifik
-                await asyncio.sleep(1) # Jeda singkat
+                ai = await self.ai.complete(
+                    prompt,
+                    json_mode=True, temperature=0.0, max_tokens=2048, deadline=deadline,
+                    providers=analysts_to_try, parse=self._parse_analysis, feature="scanner",
+                    on_attempt=on_attempt, on_failure=on_failure, cache=True,
+                    user_id=ctx_or_msg.author.id, priority=PRIORITY_INTERACTIVE if is_command else PRIORITY_BACKGROUND,
+                    on_queue=queue_status_updater(loading_msg)
+                )
+            except AIError as e:
+                logger.warning(f"Analisis AI potongan baris {chunk['start']}-{chunk['end']} gagal: {e}")
+                return None
+            result = dict(ai.value)
+            result['ai_type'] = ai.name
+            result['lines'] = f"{chunk['start']}-{chunk['end']}"
+            return result
+
+        if len(chunks) > 1:
+            logger.info(f"Analisis bertahap: {len(chunks)} potongan dari {total_lines} baris dikirim ke AI.")
+        results = [r for r in await asyncio.gather(*(analyze_chunk(c) for c in chunks)) if r]
+
+        # Reduce: gabungkan verdict per potongan
+        if results:
+            merged = _merge_chunk_verdicts(results)
+            return merged, merged['ai_type'], results # Sukses
 
         # Jika semua AI gagal
         logger.error("Semua API AI gagal untuk Scanner setelah fallback.")
@@ -482,35 +568,18 @@ class ScannerCog(commands.Cog, name="Scanner"):
     # ============================
     async def _scan_file_content(
         self,
-        file_path: str,
-        file_content: bytes,
+        entry: Dict,
         choice: str,
         loading_msg: discord.Message,
         ctx_or_msg: Union[commands.Context, discord.Message] # Tambahkan parameter ini
     ) -> Tuple[List[Dict], Dict, str, List[Dict]]:
+        """entry: hasil scan_upload di worker pool ({"name", "hash", "text", "issues"}). Cache verdict dicek di _scan_files."""
 
-        file_hash = self._get_file_hash(file_content)
-        cache_key = f"{file_hash}_{choice}"
-
-        if cache_key in self.file_cache and self._is_cache_valid(self.file_cache[cache_key]['timestamp']):
-            cached = self.file_cache[cache_key]
-            logger.info(f"Menggunakan cache untuk {os.path.basename(file_path)}")
-            return cached['issues'], cached['summary'], cached['analyst'], cached['results']
-
-        content_str = file_content.decode('utf-8', errors='ignore')
-        issues = []
-        for pattern, info in SUSPICIOUS_PATTERNS.items():
-            try:
-                matches = re.finditer(pattern, content_str, re.IGNORECASE)
-                for match in matches:
-                    line_num = content_str[:match.start()].count('\n') + 1
-                    issues.append({'pattern': pattern, 'line': line_num, **info})
-            except re.error as e:
-                logger.error(f"Regex error pada pattern '{pattern}': {e}")
+        issues = entry['issues']
 
         # --- [PERUBAHAN 5: Pass ctx_or_msg] ---
         summary, analyst, results = await self._get_ai_analysis_with_fallback(
-            content_str,
+            entry['text'],
             issues,
             choice,
             loading_msg,
@@ -518,12 +587,131 @@ class ScannerCog(commands.Cog, name="Scanner"):
         )
         # --- [AKHIR PERUBAHAN 5] ---
 
+        return await self._store_scan(entry['hash'], choice, issues, summary, analyst, results)
+
+    @staticmethod
+    def _verdict_key(file_hash: str, choice: str) -> str:
+        return f"{file_hash}:{choice}:{RULES_VERSION}"
+
+    async def _store_scan(self, file_hash: str, choice: str, issues: List[Dict], summary: Dict, analyst: str, results: List[Dict]) -> Tuple[List[Dict], Dict, str, List[Dict]]:
         detected_max_level = max([i['level'] for i in issues], default=DangerLevel.SAFE)
         summary['danger_level'] = detected_max_level
 
-        self.file_cache[cache_key] = {'issues': issues, 'summary': summary, 'analyst': analyst, 'results': results, 'timestamp': time.time()}
+        # Fallback manual karena semua AI gagal tidak disimpan, agar upload berikutnya dicoba lagi ke AI
+        if analyst != "Manual" or choice == 'manual':
+            verdict = {'issues': issues, 'summary': summary, 'analyst': analyst, 'results': results}
+            await put_scan_verdict_async(self._verdict_key(file_hash, choice), file_hash, RULES_VERSION, verdict)
         return issues, summary, analyst, results
 
+    async def _scan_files(
+        self,
+        entries: List[Dict],
+        choice: str,
+        loading_msg: discord.Message,
+        ctx_or_msg: Union[commands.Context, discord.Message]
+    ) -> List[Tuple[List[Dict], Dict, str, List[Dict]]]:
+        """
+        Scan semua file hasil worker pool (hasil sesuai urutan entries). File kecil digabung menjadi satu request AI per batch,
+        file besar tetap dianalisis sendiri (bertahap); semua batch & file besar berjalan paralel.
+        """
+        outputs: List = [None] * len(entries)
+        # Satu lookup untuk semua file (memori lalu DB); verdict per sha256 bertahan lintas restart/deploy
+        cached = await get_scan_verdicts_async([self._verdict_key(entry['hash'], choice) for entry in entries])
+        pending: List[int] = []
+        for idx, entry in enumerate(entries):
+            verdict = cached.get(self._verdict_key(entry['hash'], choice))
+            if verdict:
+                logger.info(f"Menggunakan cache untuk {entry['name']}")
+                outputs[idx] = (verdict['issues'], verdict['summary'], verdict['analyst'], verdict['results'])
+            else:
+                pending.append(idx)
+
+        if len(pending) <= 1 or choice == 'manual' or not self._analysts_for(choice):
+            for idx in pending:
+                outputs[idx] = await self._scan_file_content(entries[idx], choice, loading_msg, ctx_or_msg)
+            return outputs
+
+        small: Dict[int, Tuple[str, str, List[Dict], str]] = {}
+        individual: List[int] = []
+        for idx in pending:
+            entry = entries[idx]
+            # File kosong tidak ikut batch: ditangani _get_ai_analysis_with_fallback tanpa AI
+            if entry['text'].strip() and len(entry['text']) <= SCANNER_CHUNK_CHARS:
+                small[idx] = (entry['name'], entry['text'], entry['issues'], entry['hash'])
+            else:
+                individual.append(idx)
+
+        batches = _pack_batches([(idx, item[1]) for idx, item in small.items()])
+        # Batch berisi satu file tidak perlu prompt gabungan
+        individual += [ids[0] for ids in batches if len(ids) == 1]
+        batches = [ids for ids in batches if len(ids) > 1]
+        if batches:
+            logger.info(f"Analisis batch: {sum(len(b) for b in batches)} file dalam {len(batches)} request AI, {len(individual)} file terpisah.")
+
+        async def run_individual(idx: int):
+            outputs[idx] = await self._scan_file_content(entries[idx], choice, loading_msg, ctx_or_msg)
+
+        async def run_batch(ids: List[int]):
+            for idx, output in (await self._scan_batch({idx: small[idx] for idx in ids}, choice, loading_msg, ctx_or_msg)).items():
+                outputs[idx] = output
+
+        await asyncio.gather(*(run_batch(ids) for ids in batches), *(run_individual(idx) for idx in individual))
+        return outputs
+
+    async def _scan_batch(
+        self,
+        batch: Dict[int, Tuple[str, str, List[Dict], str]],
+        choice: str,
+        loading_msg: discord.Message,
+        ctx_or_msg: Union[commands.Context, discord.Message]
+    ) -> Dict[int, Tuple[List[Dict], Dict, str, List[Dict]]]:
+        """Satu request AI untuk beberapa file kecil; file tanpa verdict di respons dianalisis ulang sendiri."""
+        is_command = isinstance(ctx_or_msg, commands.Context)
+        on_attempt, on_failure = self._ai_callbacks(loading_msg, ctx_or_msg)
+        numbered = list(batch.items())
+        files_block = "\n".join(
+            f"=== FILE {n}: {display_name} ===\n```\n{content_str}\n```" for n, (_, (display_name, content_str, _, _)) in enumerate(numbered, 1)
+        )
+
+        verdicts, ai_name = {}, None
+        try:
+            ai = await self.ai.complete(
+                AI_BATCH_PROMPT.format(files=files_block),
+                json_mode=True, temperature=0.0, max_tokens=max(2048, 400 * len(numbered)),
+                providers=self._analysts_for(choice), parse=self._parse_batch_analysis, feature="scanner",
+                on_attempt=on_attempt, on_failure=on_failure, cache=True,
+                user_id=ctx_or_msg.author.id, priority=PRIORITY_INTERACTIVE if is_command else PRIORITY_BACKGROUND,
+                on_queue=queue_status_updater(loading_msg)
+            )
+            verdicts, ai_name = ai.value, ai.name
+        except AIError:
+            logger.error("Semua API AI gagal untuk batch scanner, menggunakan analisis manual.")
+
+        outputs = {}
+        missing = []
+        for n, (idx, (display_name, content_str, issues, file_hash)) in enumerate(numbered, 1):
+            verdict = verdicts.get(n)
+            if ai_name is None:
+                summary = self._analyze_manually(issues)
+                summary['ai_type'] = "Manual"
+                outputs[idx] = await self._store_scan(file_hash, choice, issues, summary, "Manual", [summary])
+            elif verdict is None:
+                missing.append((idx, content_str, issues, file_hash))
+            else:
+                summary = {k: verdict.get(k) for k in ('script_purpose', 'analysis_summary', 'confidence_score')}
+                summary['ai_type'] = ai_name
+                outputs[idx] = await self._store_scan(file_hash, choice, issues, summary, ai_name, [summary])
+
+        if missing:
+            logger.warning(f"Respons batch AI tidak memuat {len(missing)} file, dianalisis terpisah.")
+
+            async def analyze_missing(idx, content_str, issues, file_hash):
+                summary, analyst, results = await self._get_ai_analysis_with_fallback(content_str, issues, choice, loading_msg, ctx_or_msg)
+                outputs[idx] = await self._store_scan(file_hash, choice, issues, summary, analyst, results)
+
+            await asyncio.gather(*(analyze_missing(*item) for item in missing))
+        return outputs
+
     async def _process_analysis(self, ctx_or_msg, attachment: discord.Attachment = None, choice: str = "auto", url: str = None):
 
         is_command = isinstance(ctx_or_msg, commands.Context)
@@ -531,16 +719,14 @@ class ScannerCog(commands.Cog, name="Scanner"):
         channel = ctx_or_msg.channel
 
         # --- [PERBAIKAN REQ #3]: _check_limits sekarang butuh 'choice' ---
-        if not self._check_limits(author_id, channel.id, "scan", is_command, choice):
+        if not await self._check_limits(author_id, channel.id, "scan", is_command, choice):
             return
         # --- [AKHIR PERBAIKAN] ---
 
         await self.processing_queue.put(author_id)
+        quota_reserved = is_command and choice != 'manual'
         loading_msg = None
-        download_path = None
-
-        msg_id = ctx_or_msg.id if not is_command else ctx_or_msg.message.id
-        extract_folder = os.path.join(self.config.TEMP_DIR, f"extracted_{msg_id}")
+        analysts = set()
 
         try:
             file_content, filename = await self._get_file_source(ctx_or_msg, attachment, url, is_command)
@@ -548,37 +734,29 @@ class ScannerCog(commands.Cog, name="Scanner"):
 
             loading_msg = await channel.send(f"⚙️ Menganalisis `{filename}`...")
 
-            # --- [PERBAIKAN REQ #3]: Increment AI Usage HANYA jika AI digunakan ---
-            if is_command and choice != 'manual':
-                increment_ai_usage(author_id) # Gunakan increment AI global
+            # --- [PERBAIKAN REQ #3]: Kuota AI sudah di-reserve di _check_limits ---
+            if quota_reserved:
                 self.scan_stats["total_scans"] += 1 # Hitung scan AI saja untuk stats
             # --- [AKHIR PERBAIKAN] ---
 
-            download_path = os.path.join(self.config.TEMP_DIR, filename)
-            with open(download_path, 'wb') as f: f.write(file_content)
-
             all_issues, all_summaries, all_results, analysts, scanned_files = [], [], [], set(), []
-            scan_paths = self._prepare_scan_paths(download_path, filename, extract_folder)
-            total_files = len(scan_paths)
-
-            for i, (file_path, display_name) in enumerate(scan_paths):
-                if total_files > 1: await loading_msg.edit(content=f"🔍 Scanning {self._create_progress_bar(i, total_files)} `{display_name}`")
-                with open(file_path, 'rb') as f_content:
-                    # --- [PERUBAHAN 6: Pass ctx_or_msg] ---
-                    issues, summary, analyst, results = await self._scan_file_content(
-                        file_path,
-                        f_content.read(),
-                        choice,
-                        loading_msg,
-                        ctx_or_msg # <-- Diteruskan
-                    )
-                    # --- [AKHIR PERUBAHAN 6] ---
+            # Ekstrak arsip (di memori), decode, pencocokan pola & hash jalan di worker pool, bukan di event loop
+            file_hash, scan_entries = await self.scan_pool.scan_upload(
+                file_content, filename, self.config.ALLOWED_EXTENSIONS, self.config.MAX_ARCHIVE_FILES, SCANNER_MAX_MEMBER_MB * 1024 * 1024
+            )
+            total_files = len(scan_entries)
 
+            if total_files > 1: await loading_msg.edit(content=f"🔍 Scanning {total_files} file dari arsip...")
+            # File kecil dalam arsip dianalisis dalam satu request AI (batch), file besar paralel
+            scanned = await self._scan_files(scan_entries, choice, loading_msg, ctx_or_msg)
+
+            for entry, (issues, summary, analyst, results) in zip(scan_entries, scanned):
+                display_name = entry['name']
                 scanned_files.append(display_name); analysts.add(analyst)
                 if issues: all_issues.extend([(display_name, issue) for issue in issues])
                 if summary: all_summaries.append(summary); all_results.extend(results)
 
-            await self._finalize_and_send_report(ctx_or_msg, loading_msg, filename, all_summaries, all_issues, scanned_files, analysts, all_results, download_path, is_command)
+            await self._finalize_and_send_report(ctx_or_msg, loading_msg, filename, all_summaries, all_issues, scanned_files, analysts, all_results, file_content, file_hash, is_command)
 
         except Exception as e:
             logger.error(f"Gagal proses analisis: {e}", exc_info=True)
@@ -586,29 +764,41 @@ class ScannerCog(commands.Cog, name="Scanner"):
             if loading_msg: await loading_msg.edit(content=error_msg, embed=None, view=None)
             else: await channel.send(error_msg)
         finally:
+            # Tidak ada AI yang berhasil (semua provider gagal / error) -> kuota dikembalikan
+            if quota_reserved and analysts <= {"Manual"}:
+                await refund_ai_quota_async(author_id)
             if not self.processing_queue.empty(): self.processing_queue.get_nowait()
-            if download_path and os.path.exists(download_path): os.remove(download_path)
-            if os.path.exists(extract_folder): shutil.rmtree(extract_folder)
 
-    def _check_limits(self, author_id: int, channel_id: int, command_name: str, is_command: bool, choice: str = 'manual') -> bool: # Tambah parameter choice
+    async def _check_limits(self, author_id: int, channel_id: int, command_name: str, is_command: bool, choice: str = 'manual') -> bool: # Tambah parameter choice
         can_proceed, cooldown = check_user_cooldown(author_id, command_name, self.config.COMMAND_COOLDOWN_SECONDS)
         if not can_proceed:
             if is_command:
                 asyncio.create_task(self.bot.get_channel(channel_id).send(f"⏳ Cooldown, tunggu {cooldown} detik lagi.", delete_after=10))
             return False
 
+        if self.config.ALLOWED_CHANNEL_IDS and channel_id not in self.config.ALLOWED_CHANNEL_IDS:
+            if is_command:
+                asyncio.create_task(self.bot.get_channel(channel_id).send("❌ Perintah ini tidak diizinkan di channel ini.", delete_after=10))
+            return False
+
+        if self.processing_queue.full():
+            if is_command:
+                asyncio.create_task(self.bot.get_channel(channel_id).send("⏳ Server sibuk, coba lagi nanti."))
+            return False
+
         # --- [PERBAIKAN REQ #3 & #4: Sistem Limit Pangkat] ---
         # Hanya cek limit jika:
         # 1. Ini adalah command (bukan auto-scan)
         # 2. Command-nya "scan" ATAU "history" ATAU "stats" (untuk menghindari spam) ATAU perintah AI lain
         # 3. Analyst-nya BUKAN "manual" (AI digunakan) untuk command "scan"
+        # Dicek paling akhir: kuota langsung di-reserve (atomik), caller wajib refund jika AI gagal.
         is_ai_command = (command_name == "scan" and choice != 'manual') # Tambahkan command AI lain di sini jika perlu
         
         if is_command and is_ai_command:
-            can_use, remaining, limit = check_ai_limit(author_id)
+            can_use, remaining, limit = await reserve_ai_quota_async(author_id)
 
             if not can_use:
-                rank = get_user_rank(author_id)
+                rank = await get_user_rank_async(author_id)
                 limit_display = "Unlimited" if limit == -1 else limit
                 usage_today = limit if limit > 0 else 0 # Jika unlimited, tampilkan 0
                 asyncio.create_task(self.bot.get_channel(channel_id).send(
@@ -619,16 +809,6 @@ class ScannerCog(commands.Cog, name="Scanner"):
         # Req #4 (manual scan unlimited) otomatis terpenuhi karena choice == 'manual'
         # Req #4 (auto-scan unlimited) otomatis terpenuhi karena is_command == False
         # --- [AKHIR PERBAIKAN] ---
-
-        if self.config.ALLOWED_CHANNEL_IDS and channel_id not in self.config.ALLOWED_CHANNEL_IDS:
-            if is_command:
-                asyncio.create_task(self.bot.get_channel(channel_id).send("❌ Perintah ini tidak diizinkan di channel ini.", delete_after=10))
-            return False
-
-        if self.processing_queue.full():
-            if is_command:
-                asyncio.create_task(self.bot.get_channel(channel_id).send("⏳ Server sibuk, coba lagi nanti."))
-            return False
         return True
 
     async def _get_file_source(self, ctx_or_msg, attachment, url, is_command) -> Tuple[bytes, str]:
@@ -645,20 +825,7 @@ class ScannerCog(commands.Cog, name="Scanner"):
 
         raise Exception("Tidak ada file atau URL diberikan")
 
-    def _prepare_scan_paths(self, download_path: str, filename: str, extract_folder: str) -> List[Tuple[str, str]]:
-        scan_paths = []
-        if filename.lower().endswith(('.zip', '.7z', '.rar')):
-            if self._extract_archive(download_path, extract_folder):
-                for root, _, files in os.walk(extract_folder):
-                    for file in files:
-                        full_path = os.path.join(root, file)
-                        relative_path = os.path.relpath(full_path, extract_folder)
-                        scan_paths.append((full_path, relative_path))
-        else:
-            scan_paths.append((download_path, filename))
-        return scan_paths[:self.config.MAX_ARCHIVE_FILES]
-
-    async def _finalize_and_send_report(self, ctx_or_msg, msg, filename, summaries, issues, scanned_files, analysts, results, download_path, is_command):
+    async def _finalize_and_send_report(self, ctx_or_msg, msg, filename, summaries, issues, scanned_files, analysts, results, file_content, file_hash, is_command):
         best_summary = max(summaries, key=lambda x: x.get('danger_level', 0), default={})
         max_level = best_summary.get('danger_level', DangerLevel.SAFE)
 
@@ -667,21 +834,18 @@ class ScannerCog(commands.Cog, name="Scanner"):
             elif max_level == DangerLevel.SAFE: self.scan_stats["safe_files"] += 1
 
         emoji, color = self._get_level_emoji_color(max_level)
-        embed = self._create_result_embed(filename, best_summary, max_level, emoji, color, issues, scanned_files, analysts, download_path)
+        embed = self._create_result_embed(filename, best_summary, max_level, emoji, color, issues, scanned_files, analysts, file_content)
         view = ScanResultView(filename, issues, summaries, analysts, scanned_files, results)
         await msg.edit(content=None, embed=embed, view=view)
 
-        with open(download_path, 'rb') as f:
-            file_hash = self._get_file_hash(f.read())
-
-        save_scan_history(ctx_or_msg.author.id, filename, file_hash, max_level, ", ".join(sorted(analysts)), ctx_or_msg.channel.id)
+        await save_scan_history_async(ctx_or_msg.author.id, filename, file_hash, max_level, ", ".join(sorted(analysts)), ctx_or_msg.channel.id)
 
         if (is_command or max_level >= DangerLevel.DANGEROUS) and self.config.ALERT_CHANNEL_ID:
             alert_channel = self.bot.get_channel(self.config.ALERT_CHANNEL_ID)
             if alert_channel:
                 await alert_channel.send(f"🚨 **PERINGATAN** oleh {ctx_or_msg.author.mention} di {ctx_or_msg.channel.mention}", embed=embed)
 
-    def _create_result_embed(self, filename, best_summary, max_level, emoji, color, all_issues, scanned_files, analysts, download_path):
+    def _create_result_embed(self, filename, best_summary, max_level, emoji, color, all_issues, scanned_files, analysts, file_content):
         level_titles = {1: "✅ AMAN", 2: "🤔 MENCURIGAKAN", 3: "⚠️ SANGAT MENCURIGAKAN", 4: "🚨 BAHAYA TINGGI"}
         embed = discord.Embed(color=color, title=f"{emoji} **{level_titles.get(max_level, 'HASIL SCAN')}**")
         embed.description = (f"**File:** `{filename}`\n"
@@ -691,7 +855,7 @@ class ScannerCog(commands.Cog, name="Scanner"):
         if best_summary.get('confidence_score'):
             embed.add_field(name="🎯 Confidence", value=f"{best_summary['confidence_score']}%", inline=True)
 
-        metadata = self._get_file_metadata(download_path)
+        metadata = self._get_file_metadata(filename, file_content)
         if metadata:
             embed.add_field(name="📊 File Info", value=f"Size: {metadata.get('size', 0):,} bytes\nType: {metadata.get('extension', 'N/A')}", inline=True)
 
@@ -731,23 +895,11 @@ class ScannerCog(commands.Cog, name="Scanner"):
     @commands.command(name="history")
     async def history_command(self, ctx, limit: int = 5):
         """Melihat riwayat scan Anda."""
-        if not self._check_limits(ctx.author.id, ctx.channel.id, "history", is_command=True, choice='manual'): return # Pake choice manual agar lolos
+        if not await self._check_limits(ctx.author.id, ctx.channel.id, "history", is_command=True, choice='manual'): return # Pake choice manual agar lolos
         limit = min(max(1, limit), 20)
 
-        try:
-            # --- [PERBAIKAN]: Ambil koneksi DB dari bot ---
-            conn = self.bot.db_connection
-            if not conn or conn.closed != 0:
-                logger.error("Koneksi DB (history) tidak tersedia.")
-                return await ctx.send("❌ Gagal terhubung ke database riwayat.")
-            # --- [AKHIR PERBAIKAN] ---
-
-            cursor = conn.cursor()
-            cursor.execute("SELECT filename, danger_level, timestamp FROM scan_history WHERE user_id = %s ORDER BY timestamp DESC LIMIT %s", (ctx.author.id, limit))
-            results = cursor.fetchall()
-            cursor.close()
-        except Exception as e:
-            logger.error(f"Gagal mengambil history: {e}")
+        results = await get_scan_history_async(ctx.author.id, limit)
+        if results is None:
             return await ctx.send("❌ Gagal mengambil data riwayat dari database.")
 
         if not results: return await ctx.send("📋 Tidak ada riwayat scan ditemukan.")
@@ -760,38 +912,23 @@ class ScannerCog(commands.Cog, name="Scanner"):
     @commands.command(name="stats")
     async def stats_command(self, ctx):
         """Melihat statistik bot dan penggunaan Anda."""
-        if not self._check_limits(ctx.author.id, ctx.channel.id, "stats", is_command=True, choice='manual'): return # Pake choice manual agar lolos
+        if not await self._check_limits(ctx.author.id, ctx.channel.id, "stats", is_command=True, choice='manual'): return # Pake choice manual agar lolos
 
         embed = discord.Embed(title="📊 Statistik Bot Scanner", color=0x3498db)
 
         # --- [PERBAIKAN REQ #3: Stats Pangkat (Rank)] ---
-        try:
-            conn = self.bot.db_connection # Ambil koneksi DB dari bot
-            if not conn or conn.closed != 0:
-                logger.error("Koneksi DB (stats) tidak tersedia.")
-                return await ctx.send("❌ Gagal terhubung ke database statistik.")
-
-            cursor = conn.cursor()
-
-            # Ambil rank
-            rank = get_user_rank(ctx.author.id)
-            # Ambil sisa limit
-            can_use, remaining, limit = check_ai_limit(ctx.author.id)
-
-            usage_today = (limit - remaining) if limit > 0 else 0
-            limit_display = "Unlimited" if limit == -1 else limit
-
-            # Ambil total scan (dari history)
-            cursor.execute("SELECT COUNT(*) FROM scan_history WHERE user_id = %s", (ctx.author.id,))
-            user_total = cursor.fetchone()
-            cursor.close()
-
-            user_total_count = user_total[0] if user_total else 0
-
-        except Exception as e:
-            logger.error(f"Gagal mengambil stats: {e}")
+        # Ambil rank, sisa limit & total scan secara paralel
+        rank, (can_use, remaining, limit), user_total_count = await asyncio.gather(
+            get_user_rank_async(ctx.author.id),
+            check_ai_limit_async(ctx.author.id),
+            count_user_scans_async(ctx.author.id)
+        )
+        if user_total_count is None:
             return await ctx.send("❌ Gagal mengambil data statistik dari database.")
 
+        usage_today = (limit - remaining) if limit > 0 else 0
+        limit_display = "Unlimited" if limit == -1 else limit
+
         embed.add_field(name="👤 Statistik Anda",
                         value=f"Rank: **{rank.title()}**\n"
                               f"AI Harian: {usage_today}/{limit_display}\n"
@@ -819,11 +956,98 @@ class ScannerCog(commands.Cog, name="Scanner"):
 
     @commands.command(name="clearcache", hidden=True)
     @commands.is_owner()
-    async def clearcache_command(self, ctx):
-        """Membersihkan cache bot (owner only)."""
-        cache_count = len(self.file_cache)
-        self.file_cache.clear()
-        await ctx.send(f"🧹 Cache dibersihkan. {cache_count} entri dihapus.", delete_after=10)
+    async def clearcache_command(self, ctx, scope: str = None):
+        """Membersihkan cache verdict scan di memori; `!clearcache db` juga mengosongkan tabel scan_verdicts (owner only)."""
+        cache_count, row_count = await clear_scan_verdicts_async(persistent=(scope == "db"))
+        db_note = f" dan {row_count} baris DB" if scope == "db" else ""
+        await ctx.send(f"🧹 Cache dibersihkan. {cache_count} entri memori{db_note} dihapus.", delete_after=10)
+
+    @commands.command(name="dbcache", hidden=True)
+    @commands.is_owner()
+    async def dbcache_command(self, ctx):
+        """Statistik cache rank & setting guild (owner only)."""
+        lines = []
+        for name, st in get_cache_stats().items():
+            lines.append(
+                f"`{name}`: {st['size']}/{st['maxsize']} entri | hit {st['hits']} | miss {st['misses']} | "
+                f"hit rate {st['hit_rate']:.0%} | TTL {st['ttl']:.0f}s"
+                + (f" | {st['bytes'] / 1048576:.1f}/{st['max_bytes'] / 1048576:.0f} MB" if st['max_bytes'] else "")
+            )
+        await ctx.send("🗃️ **Cache Database**\n" + "\n".join(lines))
+
+    @commands.command(name="dbstats", hidden=True)
+    @commands.is_owner()
+    async def dbstats_command(self, ctx, top: int = 15):
+        """Latency query database per fungsi: p50/p95/p99 (owner only)."""
+        stats = get_query_stats()
+        if not stats:
+            return await ctx.send("📭 Belum ada query database yang tercatat.")
+        rows = sorted(stats.items(), key=lambda kv: kv[1]["p95_ms"], reverse=True)[:max(1, top)]
+        lines = [f"{'fungsi':<24}{'calls':>7}{'err':>5}{'slow':>5}{'p50':>8}{'p95':>8}{'p99':>8}"]
+        for name, st in rows:
+            lines.append(
+                f"{name[:23]:<24}{st['calls']:>7}{st['errors']:>5}{st['slow']:>5}"
+                f"{st['p50_ms']:>8.1f}{st['p95_ms']:>8.1f}{st['p99_ms']:>8.1f}"
+            )
+        await ctx.send("📈 **Latency Query DB (ms)**\n```\n" + "\n".join(lines)[:1900] + "\n```")
+
+    @commands.command(name="dbmaintenance", hidden=True)
+    @commands.is_owner()
+    async def dbmaintenance_command(self, ctx, usage_days: int = None, scan_days: int = None):
+        """Jalankan retensi + rollup bulanan database sekarang (owner only)."""
+        reclaimed = await run_maintenance_async(usage_days, scan_days)
+        if reclaimed is None:
+            return await ctx.send("❌ Maintenance database gagal, cek log.")
+        lines = "\n".join(f"`{table}`: {rows} baris" for table, rows in reclaimed.items())
+        await ctx.send(f"🧹 **Maintenance Database Selesai**\n{lines}")
+
+    @commands.command(name="aikeys", hidden=True)
+    @commands.is_owner()
+    async def aikeys_command(self, ctx, action: str = None, provider: str = None):
+        """Status pool API key AI: in-flight, error, cooldown. `!aikeys reset [provider]` (owner only)."""
+        if action == "reset":
+            self.ai.reset_key_cooldowns(provider)
+            return await ctx.send(f"♻️ Cooldown key {provider or 'semua provider'} direset.")
+        stats = self.ai.key_stats()
+        if not stats:
+            return await ctx.send("📭 Tidak ada API key AI yang dikonfigurasi.")
+        lines = []
+        for prov, keys in stats.items():
+            lines.append(f"**{self.ai.display_name(prov)}**")
+            for k in keys:
+                status = f"⏳ cooldown {k['cooldown']:.0f}s" if k['cooldown'] > 0 else "✅ sehat"
+                last = f" | terakhir HTTP {k['last_status']}" if k['last_status'] else ""
+                lines.append(f"`{k['key']}` {status} | in-flight {k['in_flight']} | ok {k['successes']} | gagal {k['failures']}{last}")
+        await ctx.send("🔑 **Pool API Key AI**\n" + "\n".join(lines)[:1900])
+
+    @commands.command(name="aistats", hidden=True)
+    @commands.is_owner()
+    async def aistats_command(self, ctx):
+        """EWMA latency & sukses provider AI per fitur, plus status circuit breaker (owner only)."""
+        stats = self.ai.provider_stats()
+        if not stats:
+            return await ctx.send("📭 Belum ada panggilan AI yang tercatat.")
+        lines = []
+        for feature, rows in stats.items():
+            lines.append(f"**{feature}**")
+            for r in sorted(rows, key=lambda r: r['score']):
+                state = {"closed": "🟢", "half-open": "🟡", "open": f"🔴 {r['reopen_in']:.0f}s"}[r['state']]
+                lines.append(
+                    f"{state} {self.ai.display_name(r['provider'])}: {r['latency']:.1f}s | sukses {r['success']:.0%} | "
+                    f"n={r['samples']} | skor {r['score']:.1f}"
+                )
+        await ctx.send("📈 **Statistik Provider AI**\n" + "\n".join(lines)[:1900])
+
+    @commands.command(name="aiqueue", hidden=True)
+    @commands.is_owner()
+    async def aiqueue_command(self, ctx):
+        """Status antrean & rate limit AI global (owner only)."""
+        st = self.ai.scheduler_stats()
+        tokens = " | ".join(f"{self.ai.display_name(p)}: {t}" for p, t in st['tokens'].items()) or "-"
+        await ctx.send(
+            f"🚦 **Antrean AI**\nAktif: {st['active']}/{st['max_concurrent']} | Menunggu: {st['waiting']} | "
+            f"Dilayani: {st['served']} | Rata-rata tunggu: {st['avg_wait']:.1f}s\nToken bucket: {tokens}"
+        )
 
     # --- [BARU REQ #3: Admin Commands] ---
     @commands.command(name="setrank", hidden=True)
@@ -835,7 +1059,7 @@ class ScannerCog(commands.Cog, name="Scanner"):
             valid_ranks_str = ", ".join(VALID_RANKS)
             return await ctx.send(f"❌ Rank tidak valid. Pilihan: `{valid_ranks_str}`")
 
-        if set_user_rank(member.id, rank_lower):
+        if await set_user_rank_async(member.id, rank_lower):
             await ctx.send(f"✅ Rank **{member.display_name}** diatur ke **{rank_lower.title()}**.")
         else:
             await ctx.send(f"❌ Gagal mengatur rank di database.")
@@ -844,8 +1068,8 @@ class ScannerCog(commands.Cog, name="Scanner"):
     @commands.is_owner() # Atau @commands.has_permissions(administrator=True)
     async def checkrank_command(self, ctx, member: discord.Member):
         """[ADMIN] Memeriksa pangkat (rank) AI pengguna."""
-        rank = get_user_rank(member.id)
-        can_use, remaining, limit = check_ai_limit(member.id)
+        rank = await get_user_rank_async(member.id)
+        can_use, remaining, limit = await check_ai_limit_async(member.id)
         usage_today = (limit - remaining) if limit > 0 else 0
         limit_display = "Unlimited" if limit == -1 else limit
 
@@ -859,28 +1083,17 @@ class ScannerCog(commands.Cog, name="Scanner"):
     # ============================
     # BACKGROUND TASK & LISTENERS
     # ============================
-    @tasks.loop(hours=1)
-    async def cleanup_task(self):
-        # Clean expired cache
-        expired_keys = [k for k, v in self.file_cache.items() if not self._is_cache_valid(v.get('timestamp', 0))]
-        for key in expired_keys: del self.file_cache[key]
-        if expired_keys: logger.info(f"🧹 Membersihkan {len(expired_keys)} cache yang kedaluwarsa.")
-
-        # Clean old temp files
-        cleaned_files = 0
-        for item in os.listdir(self.config.TEMP_DIR):
-            item_path = os.path.join(self.config.TEMP_DIR, item)
-            try:
-                if os.path.getmtime(item_path) < time.time() - 3600:
-                    if os.path.isfile(item_path): os.remove(item_path)
-                    elif os.path.isdir(item_path): shutil.rmtree(item_path)
-                    cleaned_files += 1
-            except Exception as e:
-                logger.error(f"Gagal membersihkan file temp {item_path}: {e}")
-        if cleaned_files > 0: logger.info(f"🧹 Membersihkan {cleaned_files} file/folder temp.")
-
-    @cleanup_task.before_loop
-    async def before_cleanup(self):
+    @tasks.loop(hours=24)
+    async def db_maintenance_task(self):
+        """Rollup & hapus baris usage/scan lama dari DB (lihat DB_*_RETENTION_DAYS)."""
+        reclaimed = await run_maintenance_async()
+        if reclaimed is None:
+            logger.error("❌ Maintenance database gagal.")
+        elif any(reclaimed.values()):
+            logger.info(f"🧹 Maintenance database: {reclaimed} baris lama di-rollup & dihapus.")
+
+    @db_maintenance_task.before_loop
+    async def before_db_maintenance(self):
         await self.bot.wait_until_ready()
 
     @commands.Cog.listener()
@@ -935,26 +1148,5 @@ class ScannerCog(commands.Cog, name="Scanner"):
             except discord.NotFound: pass
 
 async def setup(bot):
-    if not os.path.exists(bot.config.TEMP_DIR):
-        os.makedirs(bot.config.TEMP_DIR)
-
-    # --- [PERBAIKAN: Koneksi DB] ---
-    # Memastikan bot memiliki koneksi DB yang di-pass dari main.py
-    # (Kode ini ada di file asli, jadi kita pastikan tetap ada)
-    if not hasattr(bot, 'db_connection') or not hasattr(bot, 'get_db_connection'):
-        try:
-            # Ambil fungsi dari utils
-            from utils.database import get_db_connection
-            # Lampirkan fungsi dan koneksi ke objek bot
-            bot.get_db_connection = get_db_connection
-            bot.db_connection = get_db_connection()
-            if bot.db_connection:
-                 logger.info("Koneksi DB berhasil dilampirkan ke bot dari Scanner.")
-            else:
-                 logger.error("Gagal melampirkan koneksi DB ke bot dari Scanner.")
-        except ImportError:
-             logger.error("Gagal impor 'get_db_connection' di scanner setup.")
-    # --- [AKHIR PERBAIKAN] ---
-
     await bot.add_cog(ScannerCog(bot))
 
@@ -3,16 +3,11 @@ from discord.ext import commands
 from discord import ui
 import asyncio
 import logging
-import json
-import re # Import re
 from typing import List, Dict, Any, Optional
-from openai import AsyncOpenAI
-import google.generativeai as genai # Import Gemini
-import httpx # Import httpx
-import itertools
 
 # Import database untuk limit AI
-from utils.database import check_ai_limit, increment_ai_usage, get_user_rank
+from utils.database import check_ai_limit_async, reserve_ai_quota_async, refund_ai_quota_async, get_user_rank_async
+from utils.ai_gateway import AIError, parse_json, queue_status_updater
 
 # Mengambil logger
 logger = logging.getLogger(__name__)
@@ -143,9 +138,9 @@ class ServerCreationView(BaseInteractiveView):
         elif not sel and chan in self.selections[cat]: self.selections[cat].remove(chan)
 
     async def handle_refresh(self, interaction: discord.Interaction):
-        can_use, remaining, limit = check_ai_limit(self.ctx.author.id)
+        can_use, remaining, limit = await check_ai_limit_async(self.ctx.author.id)
         if not can_use:
-            rank = get_user_rank(self.ctx.author.id)
+            rank = await get_user_rank_async(self.ctx.author.id)
             limit_display = "Unlimited" if limit == -1 else limit
             usage_today = (limit - remaining) if limit > 0 else 0
             await interaction.response.send_message(
@@ -220,9 +215,9 @@ class CategoryCreationView(ServerCreationView):
         self.add_item(self.RefreshButton())
 
     async def handle_refresh(self, interaction: discord.Interaction):
-        can_use, remaining, limit = check_ai_limit(self.ctx.author.id)
+        can_use, remaining, limit = await check_ai_limit_async(self.ctx.author.id)
         if not can_use:
-            rank = get_user_rank(self.ctx.author.id)
+            rank = await get_user_rank_async(self.ctx.author.id)
             limit_display = "Unlimited" if limit == -1 else limit
             usage_today = (limit - remaining) if limit > 0 else 0
             await interaction.response.send_message(
@@ -264,180 +259,26 @@ class ServerCreatorCog(commands.Cog, name="ServerCreator"):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
         self.config = bot.config
-        # Tambahkan key cyclers untuk SEMUA provider
-        self.openai_client = None
-        self.openai_key_cycler = itertools.cycle(self.config.OPENAI_API_KEYS) if self.config.OPENAI_API_KEYS else None
-        self.gemini_key_cycler = itertools.cycle(self.config.GEMINI_API_KEYS) if self.config.GEMINI_API_KEYS else None
-        self.deepseek_key_cycler = itertools.cycle(self.config.DEEPSEEK_API_KEYS) if self.config.DEEPSEEK_API_KEYS else None
-        self.openrouter_key_cycler = itertools.cycle(self.config.OPENROUTER_API_KEYS) if self.config.OPENROUTER_API_KEYS else None
-        self.agentrouter_key_cycler = itertools.cycle(self.config.AGENTROUTER_API_KEYS) if self.config.AGENTROUTER_API_KEYS else None
-
-        if self.openai_key_cycler:
-            first_key = self.config.OPENAI_API_KEYS[0]
-            self.openai_client = AsyncOpenAI(api_key=first_key, timeout=30.0)
-            logger.info(f"✅ OpenAI client untuk Server Creator berhasil diinisialisasi (menggunakan {len(self.config.OPENAI_API_KEYS)} keys).")
-        else:
-            logger.warning("⚠️ OPENAI_API_KEYS tidak ada.")
-        if not self.gemini_key_cycler: logger.warning("⚠️ GEMINI_API_KEYS tidak ada.")
-        if not self.deepseek_key_cycler: logger.warning("⚠️ DEEPSEEK_API_KEYS tidak ada.")
-        if not self.openrouter_key_cycler: logger.warning("⚠️ OPENROUTER_API_KEYS tidak ada.")
-        if not self.agentrouter_key_cycler: logger.warning("⚠️ AGENTROUTER_API_KEYS tidak ada.")
-
-        # Siapkan header OpenRouter
-        if self.openrouter_key_cycler:
-            self.openrouter_headers = {
-                "HTTP-Referer": getattr(self.config, 'OPENROUTER_SITE_URL', 'http://localhost'),
-                "X-Title": getattr(self.config, 'OPENROUTER_SITE_NAME', 'MBOT'),
-            }
-
-    # --- [BARU] Fungsi AI Helper Terpisah ---
-    async def _try_gemini(self, system_prompt: str, user_prompt: str) -> Optional[Dict[str, Any]]:
-        if not self.gemini_key_cycler: return None
-        try:
-            key = next(self.gemini_key_cycler)
-            genai.configure(api_key=key)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            logger.info(f"Server Creator: Mencoba Gemini...")
-            response = await model.generate_content_async(
-                [system_prompt, user_prompt],
-                generation_config=genai.types.GenerationConfig(
-                    response_mime_type="application/json", temperature=0.7
-                ),
-                request_options={"timeout": 60}
-            )
-            if response.prompt_feedback.block_reason: raise Exception(f"Diblokir: {response.prompt_feedback.block_reason.name}")
-            if response.candidates and response.candidates[0].finish_reason.name != "STOP": raise Exception(f"Finish reason: {response.candidates[0].finish_reason.name}")
-            cleaned = re.sub(r'```json\s*|\s*```', '', response.text.strip(), flags=re.DOTALL)
-            if not cleaned: raise ValueError("Respons JSON kosong.")
-            data = json.loads(cleaned)
-            logger.info("AI (Gemini) berhasil generate.")
-            return data
-        except Exception as e:
-            logger.warning(f"Server Creator: Gemini gagal: {e}")
-            await asyncio.sleep(1)
-            return None
-
-    async def _try_deepseek(self, system_prompt: str, user_prompt: str) -> Optional[Dict[str, Any]]:
-        if not self.deepseek_key_cycler: return None
-        try:
-            key = next(self.deepseek_key_cycler)
-            async with httpx.AsyncClient(timeout=40.0) as client:
-                logger.info(f"Server Creator: Mencoba Deepseek...")
-                response = await client.post(
-                    "https://api.deepseek.com/chat/completions",
-                    json={
-                        "model": "deepseek-chat",
-                        "messages": [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
-                        "response_format": {"type": "json_object"},
-                        "temperature": 0.7
-                    },
-                    headers={"Authorization": f"Bearer {key}"}
-                )
-                response.raise_for_status()
-                cleaned = re.sub(r'```json\s*|\s*```', '', response.json()["choices"][0]["message"]["content"].strip(), flags=re.DOTALL)
-                if not cleaned: raise ValueError("Respons JSON kosong.")
-                data = json.loads(cleaned)
-                logger.info("AI (DeepSeek) berhasil generate.")
-                return data
-        except Exception as e:
-            logger.warning(f"Server Creator: DeepSeek gagal: {e}")
-            await asyncio.sleep(1)
-            return None
-
-    async def _try_openai(self, system_prompt: str, user_prompt: str) -> Optional[Dict[str, Any]]:
-        if not self.openai_key_cycler or not self.openai_client: return None
-        max_retries = len(self.bot.config.OPENAI_API_KEYS)
-        for attempt in range(max_retries):
-            try:
-                key = next(self.openai_key_cycler)
-                self.openai_client.api_key = key
-                logger.info(f"Server Creator: Mencoba OpenAI Key #{attempt+1}...")
-                response = await self.openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
-                    response_format={"type": "json_object"}, temperature=0.7)
-                cleaned = re.sub(r'```json\s*|\s*```', '', response.choices[0].message.content.strip(), flags=re.DOTALL)
-                if not cleaned: raise ValueError("Respons JSON kosong.")
-                data = json.loads(cleaned)
-                logger.info("AI (OpenAI) berhasil generate.")
-                return data
-            except Exception as e:
-                logger.warning(f"Server Creator: OpenAI Key #{attempt+1} gagal: {e}")
-                if "rate_limit_exceeded" in str(e).lower() or "429" in str(e):
-                    if attempt < max_retries - 1:
-                        await asyncio.sleep(1)
-                        continue
-                    else:
-                        logger.error("Semua OpenAI keys rate limited.")
-                        return None
-                else:
-                     return None
-        return None
-
-    async def _try_openrouter(self, system_prompt: str, user_prompt: str) -> Optional[Dict[str, Any]]:
-        if not self.openrouter_key_cycler: return None
-        try:
-            key = next(self.openrouter_key_cycler)
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                logger.info(f"Server Creator: Mencoba OpenRouter...")
-                payload = {
-                    "model": "mistralai/mistral-7b-instruct:free",
-                    "messages": [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
-                    "response_format": {"type": "json_object"},
-                    "temperature": 0.7, "max_tokens": 2048
-                }
-                headers = {"Authorization": f"Bearer {key}"}
-                if hasattr(self, 'openrouter_headers'): headers.update(self.openrouter_headers)
-
-                response = await client.post("https://openrouter.ai/api/v1/chat/completions", json=payload, headers=headers)
-                response.raise_for_status()
-                cleaned = re.sub(r'```json\s*|\s*```', '', response.json()["choices"][0]["message"]["content"].strip(), flags=re.DOTALL)
-                if not cleaned: raise ValueError("Respons JSON kosong.")
-                data = json.loads(cleaned)
-                logger.info("AI (OpenRouter) berhasil generate.")
-                return data
-        except Exception as e:
-            logger.warning(f"Server Creator: OpenRouter gagal: {e}")
-            await asyncio.sleep(1)
-            return None
 
-    async def _try_agentrouter(self, system_prompt: str, user_prompt: str) -> Optional[Dict[str, Any]]:
-        if not self.agentrouter_key_cycler: return None
-        try:
-            key = next(self.agentrouter_key_cycler)
-            logger.info(f"Server Creator: Mencoba AgentRouter...")
-            client = AsyncOpenAI(api_key=key, base_url="https://agentrouter.org/v1", timeout=45.0)
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
-                response_format={"type": "json_object"},
-                temperature=0.7
-            )
-            cleaned = re.sub(r'```json\s*|\s*```', '', response.choices[0].message.content.strip(), flags=re.DOTALL)
-            if not cleaned: raise ValueError("Respons JSON kosong.")
-            data = json.loads(cleaned)
-            logger.info("AI (AgentRouter) berhasil generate.")
-            return data
-        except Exception as e:
-            logger.warning(f"Server Creator: AgentRouter gagal: {e}")
-            await asyncio.sleep(1)
-            return None
+    @staticmethod
+    def _parse_proposal(text: str) -> Dict[str, Any]:
+        data = parse_json(text)
+        if not isinstance(data, dict): raise ValueError("Format JSON proposal tidak valid (bukan object).")
+        return data
 
-    async def _get_ai_proposal(self, system_prompt: str, user_prompt: str) -> Dict[str, Any]:
+    async def _get_ai_proposal(self, system_prompt: str, user_prompt: str, user_id: Optional[int] = None, status_message: Optional[discord.Message] = None) -> Dict[str, Any]:
         """Menghasilkan proposal dari AI dengan fallback lengkap."""
-        proposal_json = None
-
         # Urutan Fallback: OpenRouter -> AgentRouter -> Gemini -> Deepseek -> OpenAI
-        proposal_json = await self._try_openrouter(system_prompt, user_prompt)
-        if not proposal_json: proposal_json = await self._try_agentrouter(system_prompt, user_prompt)
-        if not proposal_json: proposal_json = await self._try_gemini(system_prompt, user_prompt)
-        if not proposal_json: proposal_json = await self._try_deepseek(system_prompt, user_prompt)
-        if not proposal_json: proposal_json = await self._try_openai(system_prompt, user_prompt)
-
-        if not proposal_json:
+        try:
+            ai = await self.bot.ai.complete(
+                user_prompt, system=system_prompt, json_mode=True, temperature=0.7, max_tokens=2048,
+                parse=self._parse_proposal, feature="server_creator",
+                user_id=user_id, on_queue=queue_status_updater(status_message) if status_message else None
+            )
+        except AIError:
             raise Exception("Semua layanan AI gagal dihubungi atau error.")
 
-        return proposal_json
+        return ai.value
     # --- [AKHIR PERBAIKAN] ---
 
 
@@ -445,9 +286,9 @@ class ServerCreatorCog(commands.Cog, name="ServerCreator"):
     @commands.has_permissions(administrator=True)
     @commands.cooldown(1, 120, commands.BucketType.user)
     async def create_server(self, ctx: commands.Context, *, deskripsi: str, existing_message: Optional[discord.Message] = None):
-        can_use, remaining, limit = check_ai_limit(ctx.author.id)
+        can_use, remaining, limit = await reserve_ai_quota_async(ctx.author.id)
         if not can_use:
-            rank = get_user_rank(ctx.author.id)
+            rank = await get_user_rank_async(ctx.author.id)
             limit_display = "Unlimited" if limit == -1 else limit
             usage_today = (limit - remaining) if limit > 0 else 0
             await ctx.send(
@@ -469,8 +310,11 @@ class ServerCreatorCog(commands.Cog, name="ServerCreator"):
                  await ctx.send("Terjadi error saat update status, proses tetap berjalan.")
 
         try:
-            proposal = await self._get_ai_proposal(SYSTEM_PROMPT_FULL_SERVER, deskripsi)
-            increment_ai_usage(ctx.author.id)
+            try:
+                proposal = await self._get_ai_proposal(SYSTEM_PROMPT_FULL_SERVER, deskripsi, ctx.author.id, message_handler)
+            except Exception:
+                await refund_ai_quota_async(ctx.author.id)
+                raise
 
             embed = discord.Embed(title=f"🤖 Proposal Server AI: {proposal.get('server_name', 'Tanpa Nama')}", description="Pilih channel yang ingin dibuat. Anda juga bisa meminta proposal baru atau membatalkan.", color=0x5865F2)
             role_list = ", ".join([f"`{r['name']}`" for r in proposal.get('roles', [])]) or "Tidak ada"
@@ -490,9 +334,9 @@ class ServerCreatorCog(commands.Cog, name="ServerCreator"):
     @commands.has_permissions(administrator=True)
     @commands.cooldown(1, 60, commands.BucketType.user)
     async def create_category(self, ctx: commands.Context, *, deskripsi: str, existing_message: Optional[discord.Message] = None):
-        can_use, remaining, limit = check_ai_limit(ctx.author.id)
+        can_use, remaining, limit = await reserve_ai_quota_async(ctx.author.id)
         if not can_use:
-            rank = get_user_rank(ctx.author.id)
+            rank = await get_user_rank_async(ctx.author.id)
             limit_display = "Unlimited" if limit == -1 else limit
             usage_today = (limit - remaining) if limit > 0 else 0
             await ctx.send(
@@ -514,8 +358,11 @@ class ServerCreatorCog(commands.Cog, name="ServerCreator"):
                  await ctx.send("Terjadi error saat update status, proses tetap berjalan.")
 
         try:
-            proposal = await self._get_ai_proposal(SYSTEM_PROMPT_SINGLE_CATEGORY, deskripsi)
-            increment_ai_usage(ctx.author.id)
+            try:
+                proposal = await self._get_ai_proposal(SYSTEM_PROMPT_SINGLE_CATEGORY, deskripsi, ctx.author.id, message_handler)
+            except Exception:
+                await refund_ai_quota_async(ctx.author.id)
+                raise
 
             category_name_ai = proposal.get('category_name', 'Nama Kategori AI')
             embed = discord.Embed(title=f"🤖 Proposal Kategori AI", description=f"Pilih channel yang ingin dibuat untuk kategori **{category_name_ai}**.", color=0x3498DB)
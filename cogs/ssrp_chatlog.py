@@ -6,22 +6,21 @@ import logging
 import io
 import base64
 from PIL import Image, ImageDraw, ImageFont, ImageOps
-from openai import AsyncOpenAI
-import httpx
-import google.generativeai as genai
 from typing import List, Dict, Optional, Tuple
 import asyncio
 import re
 import os
-import json
 import textwrap
-import itertools
 
 # --- [BARU REQ #3] Import database untuk limit AI ---
-from utils.database import check_ai_limit, increment_ai_usage, get_user_rank
+from utils.database import check_ai_limit_async, reserve_ai_quota_async, refund_ai_quota_async, get_user_rank_async
+from utils.ai_gateway import AIError, parse_json, queue_status_updater
 
 logger = logging.getLogger(__name__)
 
+# Urutan provider AI untuk SSRP (hanya teks)
+SSRP_AI_ORDER = ["openrouter", "agentrouter", "openai", "gemini", "deepseek"]
+
 # ============================
 # MODAL & VIEW COMPONENTS (Tidak Berubah)
 # ============================
@@ -257,49 +256,6 @@ class SSRPChatlogCog(commands.Cog, name="SSRPChatlog"):
         self.bot = bot
         self.config = bot.config
 
-        # Setup API Clients & Key Cyclers
-        self.openai_key_cycler = None
-        if hasattr(self.config, 'OPENAI_API_KEYS') and self.config.OPENAI_API_KEYS:
-            self.openai_key_cycler = itertools.cycle(self.config.OPENAI_API_KEYS)
-            logger.info(f"✅ OpenAI keys ({len(self.config.OPENAI_API_KEYS)}) dimuat untuk SSRP Chatlog.")
-        else:
-            logger.warning("⚠️ OpenAI API keys (OPENAI_API_KEYS) tidak ditemukan di config.")
-
-        self.deepseek_key_cycler = None
-        if hasattr(self.config, 'DEEPSEEK_API_KEYS') and self.config.DEEPSEEK_API_KEYS:
-            self.deepseek_key_cycler = itertools.cycle(self.config.DEEPSEEK_API_KEYS)
-            logger.info(f"✅ DeepSeek keys ({len(self.config.DEEPSEEK_API_KEYS)}) dimuat untuk SSRP Chatlog.")
-        else:
-            logger.warning("⚠️ DeepSeek API keys (DEEPSEEK_API_KEYS) tidak ditemukan di config.")
-
-        self.gemini_key_cycler = None
-        if hasattr(self.config, 'GEMINI_API_KEYS') and self.config.GEMINI_API_KEYS:
-            self.gemini_key_cycler = itertools.cycle(self.config.GEMINI_API_KEYS)
-            logger.info(f"✅ Gemini keys ({len(self.config.GEMINI_API_KEYS)}) dimuat untuk SSRP Chatlog.")
-        else:
-            logger.warning("⚠️ Gemini API keys (GEMINI_API_KEYS) tidak ditemukan di config.")
-
-        self.openrouter_key_cycler = None
-        # --- [PERBAIKAN REQ #2] Gunakan ..._KEYS (plural) dari config ---
-        if hasattr(self.config, 'OPENROUTER_API_KEYS') and self.config.OPENROUTER_API_KEYS:
-            self.openrouter_key_cycler = itertools.cycle(self.config.OPENROUTER_API_KEYS)
-            self.openrouter_headers = {
-                "HTTP-Referer": getattr(self.config, 'OPENROUTER_SITE_URL', 'http://localhost'),
-                "X-Title": getattr(self.config, 'OPENROUTER_SITE_NAME', 'MBOT'),
-            }
-            logger.info(f"✅ OpenRouter keys ({len(self.config.OPENROUTER_API_KEYS)}) dimuat untuk SSRP Chatlog.")
-        else:
-            logger.warning("⚠️ OpenRouter API keys (OPENROUTER_API_KEY) tidak ditemukan di config.")
-
-        self.agentrouter_key_cycler = None
-        # --- [PERBAIKAN REQ #2] Gunakan ..._KEYS (plural) dari config ---
-        if hasattr(self.config, 'AGENTROUTER_API_KEYS') and self.config.AGENTROUTER_API_KEYS:
-            self.agentrouter_key_cycler = itertools.cycle(self.config.AGENTROUTER_API_KEYS)
-            logger.info(f"✅ AgentRouter keys ({len(self.config.AGENTROUTER_API_KEYS)}) dimuat untuk SSRP Chatlog.")
-        else:
-            logger.warning("⚠️ AgentRouter API keys (AGENTROUTER_API_KEY) tidak ditemukan di config.")
-        # --- [AKHIR PERBAIKAN REQ #2] ---
-
         # ===== STYLING SETTINGS (DIPERBAIKI) =====
         self.FONT_SIZE = 13  # Dinaikkan dari 12 untuk ketajaman
         self.LINE_HEIGHT_ADD = 4  # Sedikit ditambah
@@ -418,9 +374,9 @@ class SSRPChatlogCog(commands.Cog, name="SSRPChatlog"):
         """Buat SSRP Chatlog dari gambar dengan AI (gaya Chatlog Magician)"""
 
         # --- [BARU REQ #3] Cek Limitasi AI berbasis Pangkat (Rank) ---
-        can_use, remaining, limit = check_ai_limit(ctx.author.id)
+        can_use, remaining, limit = await check_ai_limit_async(ctx.author.id)
         if not can_use:
-            rank = get_user_rank(ctx.author.id)
+            rank = await get_user_rank_async(ctx.author.id)
             limit_display = "Unlimited" if limit == -1 else limit
             usage_today = (limit - remaining) if limit > 0 else 0
             await ctx.send(
@@ -429,9 +385,7 @@ class SSRPChatlogCog(commands.Cog, name="SSRPChatlog"):
             return
         # --- [AKHIR PERBAIKAN REQ #3] ---
 
-        if not self.openai_key_cycler and not self.deepseek_key_cycler and \
-           not self.gemini_key_cycler and not self.openrouter_key_cycler and \
-           not self.agentrouter_key_cycler:
+        if not self.bot.ai.available_providers(SSRP_AI_ORDER):
             await ctx.send("❌ Fitur SSRP Chatlog tidak tersedia (Tidak ada API Key AI yang dikonfigurasi)")
             return
 
@@ -522,19 +476,30 @@ class SSRPChatlogCog(commands.Cog, name="SSRPChatlog"):
 
         warnings = []
 
+        # --- [BARU REQ #3] Reserve kuota AI (atomik), dikembalikan jika semua AI gagal ---
+        can_use, remaining, limit = await reserve_ai_quota_async(interaction.user.id)
+        if not can_use:
+            rank = await get_user_rank_async(interaction.user.id)
+            limit_display = "Unlimited" if limit == -1 else limit
+            await processing_msg.edit(
+                content=f"❌ {interaction.user.mention}, batas harian AI Anda (Rank: **{rank.title()}**) telah tercapai ({limit}/{limit_display}). Coba lagi besok."
+            )
+            return
+        # --- [AKHIR PERBAIKAN REQ #3] ---
+
         try:
             await processing_msg.edit(content=f"🧠 {interaction.user.mention}, AI sedang membuat dialog...")
 
             language = info_data.get('language', 'Bahasa Indonesia baku')
 
-            all_dialogs_raw, ai_used = await self.generate_dialogs_with_ai(
-                images_bytes_list, info_data, dialog_counts, language,
-                processing_msg, interaction.user.mention
-            )
-
-            # --- [BARU REQ #3] Tambah hitungan AI usage SETELAH AI berhasil ---
-            increment_ai_usage(interaction.user.id)
-            # --- [AKHIR PERBAIKAN REQ #3] ---
+            try:
+                all_dialogs_raw, ai_used = await self.generate_dialogs_with_ai(
+                    images_bytes_list, info_data, dialog_counts, language,
+                    processing_msg, interaction.user.mention, interaction.user.id
+                )
+            except Exception:
+                await refund_ai_quota_async(interaction.user.id)
+                raise
 
             processed_images_bytes = []
             for idx, (img_bytes, raw_dialogs, position, bg_style) in enumerate(zip(images_bytes_list, all_dialogs_raw, positions, background_styles)):
@@ -595,179 +560,13 @@ class SSRPChatlogCog(commands.Cog, name="SSRPChatlog"):
 
     # ===== FUNGSI AI DENGAN PROMPT DIPERBAIKI =====
 
-    async def _generate_with_openai(self, api_key: str, prompt: str, image_content: Optional[Dict]) -> Optional[List[List[str]]]:
-        """Coba generate dialog dengan OpenAI (Hanya Teks)"""
-        try:
-            client = AsyncOpenAI(api_key=api_key, timeout=30.0)
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "Anda adalah penulis SSRP ahli. Output HANYA JSON."},
-                    {"role": "user", "content": prompt} # --- PERBAIKAN: Hanya kirim teks prompt
-                ],
-                response_format={"type": "json_object"},
-                max_tokens=3000,
-                temperature=0.7
-            )
-            response_content = response.choices[0].message.content
-            cleaned_response = re.sub(r'```json\s*|\s*```', '', response_content.strip(), flags=re.DOTALL)
-            data = json.loads(cleaned_response)
-            result = data.get("dialogs_per_image")
-            if not result or not isinstance(result, list):
-                 raise ValueError("Format JSON dari OpenAI tidak valid (bukan list).")
-            return result
-        except Exception as e:
-            logger.warning(f"SPOILER: OpenAI Gagal: {e}")
-            if "rate_limit_exceeded" in str(e).lower() or "429" in str(e):
-                 raise Exception(f"OpenAI Rate Limit. Mencoba AI lain...") from e
-            raise e
-
-    async def _generate_with_agentrouter(self, api_key: str, prompt: str, image_content: Optional[Dict]) -> Optional[List[List[str]]]:
-        """Coba generate dialog dengan Agent Router (Hanya Teks)"""
-        try:
-            client = AsyncOpenAI(
-                api_key=api_key,
-                base_url="https://agentrouter.org/v1",
-                timeout=45.0
-            )
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "Anda adalah penulis SSRP ahli. Output HANYA JSON."},
-                    {"role": "user", "content": prompt} # --- PERBAIKAN: Hanya kirim teks prompt
-                ],
-                response_format={"type": "json_object"},
-                max_tokens=3000,
-                temperature=0.7
-            )
-            response_content = response.choices[0].message.content
-            cleaned_response = re.sub(r'```json\s*|\s*```', '', response_content.strip(), flags=re.DOTALL)
-            data = json.loads(cleaned_response)
-            result = data.get("dialogs_per_image")
-            if not result or not isinstance(result, list):
-                 raise ValueError("Format JSON dari AgentRouter tidak valid (bukan list).")
-            return result
-        except Exception as e:
-            logger.warning(f"SPOILER: AgentRouter Gagal: {e}")
-            raise e
-
-    async def _generate_with_deepseek(self, api_key: str, prompt: str, image_content: Optional[Dict]) -> Optional[List[List[str]]]:
-        """Coba generate dialog dengan DeepSeek (Hanya Teks)"""
-        try:
-            async with httpx.AsyncClient(timeout=45.0) as client:
-                payload = {
-                    "model": "deepseek-chat",
-                    "messages": [{"role": "user", "content": prompt}],
-                    "response_format": {"type": "json_object"},
-                    "temperature": 0.7,
-                    "max_tokens": 3000
-                }
-
-                response = await client.post(
-                    "https://api.deepseek.com/chat/completions",
-                    json=payload,
-                    headers={"Authorization": f"Bearer {api_key}"}
-                )
-                response.raise_for_status()
-
-                response_json = response.json()
-                response_content = response_json["choices"][0]["message"]["content"]
-
-                cleaned_response = re.sub(r'```json\s*|\s*```', '', response_content.strip(), flags=re.DOTALL)
+    @staticmethod
+    def _parse_dialogs(text: str) -> List[List[str]]:
+        result = parse_json(text).get("dialogs_per_image")
+        if not result or not isinstance(result, list):
+            raise ValueError("Format JSON dari AI tidak valid (bukan list).")
+        return result
 
-                data = json.loads(cleaned_response)
-                result = data.get("dialogs_per_image")
-                if not result or not isinstance(result, list):
-                     raise ValueError("Format JSON dari DeepSeek tidak valid (bukan list).")
-                return result
-        except Exception as e:
-            logger.warning(f"SPOILER: DeepSeek Gagal: {e}")
-            raise e
-
-    async def _generate_with_gemini(self, api_key: str, prompt: str, image_content: Optional[Dict]) -> Optional[List[List[str]]]:
-        """Coba generate dialog dengan Gemini (Hanya Teks)"""
-        try:
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-1.5-flash-latest')
-
-            # --- PERBAIKAN: Hanya kirim teks prompt
-            gemini_content = [prompt]
-            # --- BLOK IMAGE DIHAPUS ---
-
-            response = await model.generate_content_async(
-                gemini_content,
-                generation_config=genai.types.GenerationConfig(
-                    response_mime_type="application/json",
-                    temperature=0.7
-                ),
-                request_options={"timeout": 60}
-            )
-
-            if response.prompt_feedback.block_reason:
-                raise Exception(f"Gemini diblokir: {response.prompt_feedback.block_reason.name}")
-            if response.candidates and response.candidates[0].finish_reason.name != "STOP":
-                raise Exception(f"Gemini finish reason: {response.candidates[0].finish_reason.name}")
-
-            cleaned_response = re.sub(r'```json\s*|\s*```', '', response.text.strip(), flags=re.DOTALL)
-            if not cleaned_response:
-                 raise ValueError("Respons JSON dari Gemini kosong setelah dibersihkan.")
-
-            data = json.loads(cleaned_response)
-            result = data.get("dialogs_per_image")
-            if not result or not isinstance(result, list):
-                 raise ValueError("Format JSON dari Gemini tidak valid (bukan list).")
-            return result
-        except Exception as e:
-            logger.warning(f"SPOILER: Gemini Gagal: {e}")
-            raise e
-
-    async def _generate_with_openrouter(self, api_key: str, prompt: str, image_content: Optional[Dict]) -> Optional[List[List[str]]]:
-        """Coba generate dialog dengan OpenRouter (Hanya Teks)"""
-        # --- PERBAIKAN: Hapus cek image content
-
-        try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                # --- PERBAIKAN: Model Teks dan Payload Teks ---
-                payload = {
-                    "model": "mistralai/mistral-7b-instruct:free", # Model Teks Gratis
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": prompt # Hanya Teks
-                        }
-                    ],
-                    "response_format": {"type": "json_object"},
-                    "temperature": 0.7,
-                    "max_tokens": 3000
-                }
-                # --- AKHIR PERBAIKAN PAYLOAD ---
-
-                headers = {"Authorization": f"Bearer {api_key}"}
-                if hasattr(self, 'openrouter_headers'):
-                    headers.update(self.openrouter_headers)
-
-                response = await client.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    json=payload,
-                    headers=headers
-                )
-                response.raise_for_status()
-
-                response_json = response.json()
-                response_content = response_json["choices"][0]["message"]["content"]
-
-                cleaned_response = re.sub(r'```json\s*|\s*```', '', response_content.strip(), flags=re.DOTALL)
-
-                data = json.loads(cleaned_response)
-                result = data.get("dialogs_per_image")
-                if not result or not isinstance(result, list):
-                    raise ValueError("Format JSON dari OpenRouter tidak valid (bukan list).")
-                return result
-        except Exception as e:
-            logger.warning(f"SPOILER: OpenRouter Gagal: {e}")
-            raise e
-
-    # ===== PROMPT AI YANG DIPERBAIKI =====
     async def generate_dialogs_with_ai(
         self,
         images_bytes_list: List[bytes],
@@ -775,7 +574,8 @@ class SSRPChatlogCog(commands.Cog, name="SSRPChatlog"):
         dialog_counts: List[int],
         language: str,
         processing_msg: discord.Message,
-        user_mention: str
+        user_mention: str,
+        user_id: Optional[int] = None
     ) -> Tuple[List[List[str]], str]:
         """Generate dialog SSRP SAMP dengan fallback AI - HANYA TEKS - PROMPT DIPERBAIKI"""
 
@@ -858,75 +658,29 @@ PENTING:
 - Lanjutkan cerita antar gambar
 """
 
-        dialogs_list = None
-        ai_used = "Tidak ada"
+        async def on_attempt(provider: str):
+            await processing_msg.edit(content=f"🧠 {user_mention}, Mencoba {self.bot.ai.display_name(provider)} (Teks)...")
 
-        # --- PERBAIKAN: Kirim 'None' untuk argumen image_content ---
+        async def on_failure(provider: str, error: Exception):
+            logger.error(f"====== SSRP: {self.bot.ai.display_name(provider).upper()} GAGAL: {error} ======")
+            await processing_msg.edit(content=f"⚠️ {user_mention}, {self.bot.ai.display_name(provider)} gagal...")
 
-        # Coba OpenRouter (Prioritas 1)
-        if self.openrouter_key_cycler:
-            try:
-                await processing_msg.edit(content=f"🧠 {user_mention}, Mencoba OpenRouter (Teks)...")
-                key = next(self.openrouter_key_cycler)
-                dialogs_list = await self._generate_with_openrouter(key, prompt, None)
-                if dialogs_list: ai_used = "OpenRouter (Teks)"
-            except Exception as e:
-                 logger.error(f"====== SSRP: OPENROUTER GAGAL: {e} ======")
-                 await processing_msg.edit(content=f"⚠️ {user_mention}, OpenRouter gagal... Mencoba AgentRouter...")
-                 await asyncio.sleep(1)
-
-        # Coba AgentRouter (Prioritas 2)
-        if not dialogs_list and self.agentrouter_key_cycler:
-            try:
-                await processing_msg.edit(content=f"🧠 {user_mention}, Mencoba AgentRouter (Teks)...")
-                key = next(self.agentrouter_key_cycler)
-                dialogs_list = await self._generate_with_agentrouter(key, prompt, None)
-                if dialogs_list: ai_used = "AgentRouter (Teks)"
-            except Exception as e:
-                 logger.error(f"====== SSRP: AGENTROUTER GAGAL: {e} ======")
-                 await processing_msg.edit(content=f"⚠️ {user_mention}, AgentRouter gagal... Mencoba OpenAI...")
-                 await asyncio.sleep(1)
-
-        # Coba OpenAI (Fallback 1)
-        if not dialogs_list and self.openai_key_cycler:
-            try:
-                await processing_msg.edit(content=f"🧠 {user_mention}, Mencoba OpenAI (Teks)...")
-                key = next(self.openai_key_cycler)
-                dialogs_list = await self._generate_with_openai(key, prompt, None)
-                if dialogs_list: ai_used = "OpenAI (Teks)"
-            except Exception as e:
-                 logger.error(f"====== SSRP: OPENAI GAGAL: {e} ======")
-                 await processing_msg.edit(content=f"⚠️ {user_mention}, OpenAI gagal... Mencoba Gemini...")
-                 await asyncio.sleep(1)
-
-        # Coba Gemini (Fallback 2)
-        if not dialogs_list and self.gemini_key_cycler:
-            try:
-                await processing_msg.edit(content=f"🧠 {user_mention}, Mencoba Gemini (Teks)...")
-                key = next(self.gemini_key_cycler)
-                dialogs_list = await self._generate_with_gemini(key, prompt, None)
-                if dialogs_list: ai_used = "Gemini (Teks)"
-            except Exception as e:
-                 logger.error(f"====== SSRP: GEMINI GAGAL: {e} ======")
-                 await processing_msg.edit(content=f"⚠️ {user_mention}, Gemini gagal... Mencoba DeepSeek...")
-                 await asyncio.sleep(1)
-
-        # Coba DeepSeek (Fallback 3)
-        if not dialogs_list and self.deepseek_key_cycler:
-            try:
-                await processing_msg.edit(content=f"🧠 {user_mention}, Mencoba DeepSeek (Hanya Teks)...")
-                key = next(self.deepseek_key_cycler)
-                dialogs_list = await self._generate_with_deepseek(key, prompt, None)
-                if dialogs_list: ai_used = "DeepSeek (Text-Only)"
-            except Exception as e:
-                 logger.error(f"====== SSRP: DEEPSEEK GAGAL: {e} ======")
-                 await processing_msg.edit(content=f"⚠️ {user_mention}, DeepSeek gagal...")
-                 await asyncio.sleep(1)
-
-        if not dialogs_list:
+        # Urutan: OpenRouter -> AgentRouter -> OpenAI -> Gemini -> DeepSeek (hanya teks)
+        try:
+            ai = await self.bot.ai.complete(
+                prompt, system="Anda adalah penulis SSRP ahli. Output HANYA JSON.", json_mode=True,
+                temperature=0.7, max_tokens=3000, providers=SSRP_AI_ORDER,
+                models={"gemini": "gemini-1.5-flash-latest"}, parse=self._parse_dialogs, feature="ssrp",
+                on_attempt=on_attempt, on_failure=on_failure,
+                user_id=user_id, on_queue=queue_status_updater(processing_msg, f"{user_mention}, ")
+            )
+        except AIError:
             logger.error("Semua API AI gagal untuk SSRP Chatlog setelah fallback.")
             raise Exception("Semua layanan AI gagal dihubungi atau error.")
 
+        dialogs_list = ai.value
+        ai_used = f"{ai.name} (Teks)"
+
         # Padding/Truncating
         while len(dialogs_list) < len(images_bytes_list):
             dialogs_list.append([f"[AI Error Gbr {len(dialogs_list)+1}]"])
@@ -3,18 +3,12 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 import logging
-import asyncio
-import json
-import re
 from typing import Optional, Dict, List
-import httpx
-from openai import AsyncOpenAI
-import google.generativeai as genai
 import io # Import io untuk file buffer
-import itertools # Import itertools untuk key cycling
 
 # Import database untuk limit AI
-from utils.database import check_ai_limit, increment_ai_usage, get_user_rank
+from utils.database import check_ai_limit_async, reserve_ai_quota_async, refund_ai_quota_async, get_user_rank_async
+from utils.ai_gateway import AIError, parse_json, queue_status_updater
 
 logger = logging.getLogger(__name__)
 
@@ -343,170 +337,28 @@ class TemplateCreatorCog(commands.Cog, name="TemplateCreator"):
         self.bot = bot
         self.config = bot.config
         self.active_sessions = {}
-        # Tambahkan key cyclers untuk SEMUA provider
-        self.gemini_key_cycler = itertools.cycle(self.config.GEMINI_API_KEYS) if self.config.GEMINI_API_KEYS else None
-        self.deepseek_key_cycler = itertools.cycle(self.config.DEEPSEEK_API_KEYS) if self.config.DEEPSEEK_API_KEYS else None
-        self.openai_key_cycler = itertools.cycle(self.config.OPENAI_API_KEYS) if self.config.OPENAI_API_KEYS else None
-        self.openrouter_key_cycler = itertools.cycle(self.config.OPENROUTER_API_KEYS) if self.config.OPENROUTER_API_KEYS else None
-        self.agentrouter_key_cycler = itertools.cycle(self.config.AGENTROUTER_API_KEYS) if self.config.AGENTROUTER_API_KEYS else None
-
-        # Siapkan header OpenRouter jika ada key
-        if self.openrouter_key_cycler:
-            self.openrouter_headers = {
-                "HTTP-Referer": getattr(self.config, 'OPENROUTER_SITE_URL', 'http://localhost'),
-                "X-Title": getattr(self.config, 'OPENROUTER_SITE_NAME', 'MBOT'),
-            }
-
-    # --- [BARU] Fungsi AI Helper Terpisah ---
-    async def _try_gemini(self, prompt: str) -> Optional[List[Dict]]:
-        if not self.gemini_key_cycler: return None
-        try:
-            key = next(self.gemini_key_cycler)
-            genai.configure(api_key=key)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            logger.info(f"Template Creator: Mencoba Gemini...")
-            response = await model.generate_content_async(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    response_mime_type="application/json", temperature=0.7
-                ),
-                request_options={"timeout": 60}
-            )
-            if response.prompt_feedback.block_reason: raise Exception(f"Diblokir: {response.prompt_feedback.block_reason.name}")
-            if response.candidates and response.candidates[0].finish_reason.name != "STOP": raise Exception(f"Finish reason: {response.candidates[0].finish_reason.name}")
-            cleaned = re.sub(r'```json\s*|\s*```', '', response.text.strip(), flags=re.DOTALL)
-            if not cleaned: raise ValueError("Respons JSON kosong.")
-            data = json.loads(cleaned)
-            logger.info("AI (Gemini) berhasil generate.")
-            return data.get("steps")
-        except Exception as e:
-            logger.warning(f"Template Creator: Gemini gagal: {e}")
-            await asyncio.sleep(1)
-            return None
-
-    async def _try_deepseek(self, prompt: str) -> Optional[List[Dict]]:
-        if not self.deepseek_key_cycler: return None
-        try:
-            key = next(self.deepseek_key_cycler)
-            async with httpx.AsyncClient(timeout=40.0) as client:
-                logger.info(f"Template Creator: Mencoba Deepseek...")
-                response = await client.post(
-                    "https://api.deepseek.com/chat/completions",
-                    json={
-                        "model": "deepseek-chat",
-                        "messages": [{"role": "user", "content": prompt}],
-                        "response_format": {"type": "json_object"},
-                        "temperature": 0.7
-                    },
-                    headers={"Authorization": f"Bearer {key}"}
-                )
-                response.raise_for_status()
-                cleaned = re.sub(r'```json\s*|\s*```', '', response.json()["choices"][0]["message"]["content"].strip(), flags=re.DOTALL)
-                if not cleaned: raise ValueError("Respons JSON kosong.")
-                data = json.loads(cleaned)
-                logger.info("AI (DeepSeek) berhasil generate.")
-                return data.get("steps")
-        except Exception as e:
-            logger.warning(f"Template Creator: DeepSeek gagal: {e}")
-            await asyncio.sleep(1)
-            return None
-
-    async def _try_openai(self, prompt: str) -> Optional[List[Dict]]:
-        if not self.openai_key_cycler: return None
-        max_retries = len(self.bot.config.OPENAI_API_KEYS)
-        for attempt in range(max_retries):
-            try:
-                key = next(self.openai_key_cycler)
-                client = AsyncOpenAI(api_key=key, timeout=30.0)
-                logger.info(f"Template Creator: Mencoba OpenAI Key #{attempt+1}...")
-                response = await client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[{"role": "user", "content": prompt}],
-                    response_format={"type": "json_object"},
-                    temperature=0.7
-                )
-                cleaned = re.sub(r'```json\s*|\s*```', '', response.choices[0].message.content.strip(), flags=re.DOTALL)
-                if not cleaned: raise ValueError("Respons JSON kosong.")
-                data = json.loads(cleaned)
-                logger.info("AI (OpenAI) berhasil generate.")
-                return data.get("steps")
-            except Exception as e:
-                logger.warning(f"Template Creator: OpenAI Key #{attempt+1} gagal: {e}")
-                if "rate_limit_exceeded" in str(e).lower() or "429" in str(e):
-                    if attempt < max_retries - 1:
-                        await asyncio.sleep(1)
-                        continue
-                    else:
-                        logger.error("Semua OpenAI keys rate limited.")
-                        return None # Gagal setelah semua key dicoba
-                else:
-                     return None # Error lain, hentikan percobaan OpenAI
-        return None # Gagal setelah loop
 
-    async def _try_openrouter(self, prompt: str) -> Optional[List[Dict]]:
-        if not self.openrouter_key_cycler: return None
-        try:
-            key = next(self.openrouter_key_cycler)
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                logger.info(f"Template Creator: Mencoba OpenRouter...")
-                payload = {
-                    "model": "mistralai/mistral-7b-instruct:free",
-                    "messages": [{"role": "user", "content": prompt}],
-                    "response_format": {"type": "json_object"},
-                    "temperature": 0.7, "max_tokens": 2048
-                }
-                headers = {"Authorization": f"Bearer {key}"}
-                if hasattr(self, 'openrouter_headers'): headers.update(self.openrouter_headers)
-
-                response = await client.post("https://openrouter.ai/api/v1/chat/completions", json=payload, headers=headers)
-                response.raise_for_status()
-                cleaned = re.sub(r'```json\s*|\s*```', '', response.json()["choices"][0]["message"]["content"].strip(), flags=re.DOTALL)
-                if not cleaned: raise ValueError("Respons JSON kosong.")
-                data = json.loads(cleaned)
-                logger.info("AI (OpenRouter) berhasil generate.")
-                return data.get("steps")
-        except Exception as e:
-            logger.warning(f"Template Creator: OpenRouter gagal: {e}")
-            await asyncio.sleep(1)
-            return None
-
-    async def _try_agentrouter(self, prompt: str) -> Optional[List[Dict]]:
-        if not self.agentrouter_key_cycler: return None
-        try:
-            key = next(self.agentrouter_key_cycler)
-            logger.info(f"Template Creator: Mencoba AgentRouter...")
-            client = AsyncOpenAI(api_key=key, base_url="https://agentrouter.org/v1", timeout=45.0)
-            response = await client.chat.completions.create(
-                model="gpt-4o-mini", # Ganti model jika perlu
-                messages=[{"role": "user", "content": prompt}],
-                response_format={"type": "json_object"},
-                temperature=0.7
-            )
-            cleaned = re.sub(r'```json\s*|\s*```', '', response.choices[0].message.content.strip(), flags=re.DOTALL)
-            if not cleaned: raise ValueError("Respons JSON kosong.")
-            data = json.loads(cleaned)
-            logger.info("AI (AgentRouter) berhasil generate.")
-            return data.get("steps")
-        except Exception as e:
-            logger.warning(f"Template Creator: AgentRouter gagal: {e}")
-            await asyncio.sleep(1)
-            return None
+    @staticmethod
+    def _parse_steps(text: str) -> List[Dict]:
+        steps = parse_json(text).get("steps")
+        if not steps: raise ValueError("Respons AI tidak berisi 'steps'.")
+        return steps
 
-    async def _get_ai_analysis(self, theme: str, details: str, language: str) -> Optional[List[Dict]]:
+    async def _get_ai_analysis(self, theme: str, details: str, language: str, user_id: Optional[int] = None, status_message: Optional[discord.Message] = None) -> Optional[List[Dict]]:
         """Menggunakan AI untuk generate langkah-langkah RP dengan fallback lengkap."""
         prompt = AI_TEMPLATE_PROMPT.format(theme=theme, details=details, language=language)
-        steps = None
 
         # Urutan Fallback: OpenRouter -> AgentRouter -> Gemini -> Deepseek -> OpenAI
-        steps = await self._try_openrouter(prompt)
-        if not steps: steps = await self._try_agentrouter(prompt)
-        if not steps: steps = await self._try_gemini(prompt)
-        if not steps: steps = await self._try_deepseek(prompt)
-        if not steps: steps = await self._try_openai(prompt)
-
-        if not steps:
+        try:
+            ai = await self.bot.ai.complete(
+                prompt, json_mode=True, temperature=0.7,
+                parse=self._parse_steps, feature="template_creator",
+                user_id=user_id, on_queue=queue_status_updater(status_message) if status_message else None
+            )
+        except AIError:
             logger.error("Semua AI gagal untuk Template Creator.")
-        return steps
+            return None
+        return ai.value
     # --- [AKHIR PERBAIKAN] ---
 
     def _format_pc_auto_rp(self, title: str, modifier: str, primary_key: str, steps: List[Dict]) -> str:
@@ -528,9 +380,9 @@ class TemplateCreatorCog(commands.Cog, name="TemplateCreator"):
     @commands.cooldown(1, 30, commands.BucketType.user)
     async def create_template_command(self, ctx):
         """Membuat template Auto RP untuk KotkaHelper (PC/Mobile)"""
-        can_use, remaining, limit = check_ai_limit(ctx.author.id)
+        can_use, remaining, limit = await check_ai_limit_async(ctx.author.id)
         if not can_use:
-            rank = get_user_rank(ctx.author.id)
+            rank = await get_user_rank_async(ctx.author.id)
             limit_display = "Unlimited" if limit == -1 else limit
             usage_today = (limit - remaining) if limit > 0 else 0
             await ctx.send(
@@ -668,6 +520,14 @@ class TemplateCreatorCog(commands.Cog, name="TemplateCreator"):
             session = self.active_sessions.get(ctx.author.id)
             if not session: raise Exception("Sesi tidak ditemukan setelah modal submit.")
 
+            # Reserve kuota AI (atomik) tepat sebelum generate, dikembalikan jika AI gagal
+            can_use, remaining, limit = await reserve_ai_quota_async(ctx.author.id)
+            if not can_use:
+                limit_display = "Unlimited" if limit == -1 else limit
+                await ctx.send(f"❌ Batas harian AI Anda telah tercapai ({limit}/{limit_display}). Coba lagi besok.")
+                ctx.command.reset_cooldown(ctx)
+                return
+
             loading_msg = await ctx.send("🤖 **Generating AI...**")
             steps_draw, steps_holster, steps_single = None, None, None
             language = session.get("language", "Bahasa Indonesia baku")
@@ -678,18 +538,20 @@ class TemplateCreatorCog(commands.Cog, name="TemplateCreator"):
                 theme_h = session.get("theme_holster", "menyimpan")
                 details_h = session.get("details_holster", "")
                 await loading_msg.edit(content=f"🤖 Generating 'Keluarkan' ({language})...")
-                steps_draw = await self._get_ai_analysis(theme_d, details_d, language)
+                steps_draw = await self._get_ai_analysis(theme_d, details_d, language, ctx.author.id, loading_msg)
                 await loading_msg.edit(content=f"🤖 Generating 'Simpan' ({language})...")
-                steps_holster = await self._get_ai_analysis(theme_h, details_h, language)
-                if not steps_draw or not steps_holster: raise Exception("AI Gagal Generate (Both Actions)")
+                steps_holster = await self._get_ai_analysis(theme_h, details_h, language, ctx.author.id, loading_msg)
+                if not steps_draw or not steps_holster:
+                    await refund_ai_quota_async(ctx.author.id)
+                    raise Exception("AI Gagal Generate (Both Actions)")
             else:
                 theme = session.get("theme", "rp")
                 details = session.get("details", "")
                 await loading_msg.edit(content=f"🤖 Generating RP ({language})...")
-                steps_single = await self._get_ai_analysis(theme, details, language)
-                if not steps_single: raise Exception("AI Gagal Generate (Single Action)")
-
-            increment_ai_usage(ctx.author.id)
+                steps_single = await self._get_ai_analysis(theme, details, language, ctx.author.id, loading_msg)
+                if not steps_single:
+                    await refund_ai_quota_async(ctx.author.id)
+                    raise Exception("AI Gagal Generate (Single Action)")
 
             session = self.active_sessions[ctx.author.id] # Refresh
             theme_display = "N/A"
@@ -12,7 +12,8 @@ import base64
 from datetime import timezone, datetime # Tambahkan datetime
 from typing import Dict # Import Dict jika belum ada
 
-from utils.database import init_database
+from utils.database import init_database, close_pool
+from utils.ai_gateway import AIGateway
 # Impor fungsi helper HANYA untuk Config class, cog akan mengimpornya sendiri
 from cogs.token import get_github_file, update_github_file, parse_repo_slug 
 
@@ -64,7 +65,6 @@ class Config:
         self.ALLOWED_CHANNEL_IDS = [int(cid.strip()) for cid in os.getenv("ALLOWED_CHANNEL_IDS", "").split(',') if cid.strip()]
         self.ADMIN_CHANNEL_ID = int(os.getenv("ADMIN_CHANNEL_ID")) if os.getenv("ADMIN_CHANNEL_ID") else None
         self.ALLOWED_EXTENSIONS = ['.lua', '.txt', '.zip', '.7z', '.rar', '.py', '.js', '.php']
-        self.TEMP_DIR = "temp_scan"
         self.MAX_FILE_SIZE_MB = 3
         self.MAX_ARCHIVE_FILES = 5
         self.COMMAND_COOLDOWN_SECONDS = 60
@@ -74,7 +74,6 @@ class Config:
         # --- [AKHIR PENGHAPUSAN] ---
         
         self.QUEUE_MAX_SIZE = 3
-        self.CACHE_EXPIRE_HOURS = 24
 
         # =================================================
         # VARIABEL BARU UNTUK FITUR TOKEN & ROLE
@@ -133,6 +132,8 @@ class MyBot(commands.Bot):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.config = Config()
+        # Gateway AI bersama untuk semua cog (client HTTP/SDK dipakai ulang)
+        self.ai = AIGateway(self.config)
         self.start_time = time.time()
         self.persistent_views_added = False
         
@@ -325,20 +326,22 @@ async def main():
         
         logger.info('------')
 
-    if not os.path.exists(bot.config.TEMP_DIR):
-        os.makedirs(bot.config.TEMP_DIR)
-        
-    async with bot:
-        await load_cogs()
-        if not bot.config.BOT_TOKEN:
-            logger.error("❌ FATAL ERROR: BOT_TOKEN tidak ditemukan.")
-            return
-        try:
-            await bot.start(bot.config.BOT_TOKEN)
-        except discord.errors.LoginFailure:
-            logger.error("❌ FATAL ERROR: Gagal login. Token tidak valid.")
-        except Exception as e:
-            logger.error(f"❌ FATAL ERROR saat startup: {e}", exc_info=True)
+    try:
+        async with bot:
+            await load_cogs()
+            if not bot.config.BOT_TOKEN:
+                logger.error("❌ FATAL ERROR: BOT_TOKEN tidak ditemukan.")
+                return
+            try:
+                await bot.start(bot.config.BOT_TOKEN)
+            except discord.errors.LoginFailure:
+                logger.error("❌ FATAL ERROR: Gagal login. Token tidak valid.")
+            except Exception as e:
+                logger.error(f"❌ FATAL ERROR saat startup: {e}", exc_info=True)
+    finally:
+        # Tutup koneksi AI & pool DB setelah semua cog di-unload
+        await bot.ai.aclose()
+        close_pool()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,613 @@
+import os
+import re
+import asyncio
+import json
+import time
+import hashlib
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+from google.ai import generativelanguage as glm
+
+from utils.key_pool import KeyPool, NoHealthyKey
+from utils.provider_health import HealthTracker
+from utils.ai_scheduler import AIScheduler, RateLimitTimeout, PRIORITY_INTERACTIVE
+from utils.database import get_ai_cached_responses_async, put_ai_cached_response_async
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 butuh paket 'h2' (httpx[http2]); tanpa itu tetap jalan dengan HTTP/1.1 keep-alive
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# =================================================================
+# DEFINISI PROVIDER
+# =================================================================
+# kind: "http"   -> endpoint chat/completions OpenAI-compatible lewat httpx langsung
+#       "openai" -> SDK AsyncOpenAI (base_url opsional)
+#       "gemini" -> GeminiAdapter (client google.ai.generativelanguage per key)
+PROVIDERS: Dict[str, Dict[str, Any]] = {
+    "openrouter": {
+        "name": "OpenRouter", "kind": "http", "timeout": 60.0,
+        "url": "https://openrouter.ai/api/v1/chat/completions",
+        "model": "mistralai/mistral-7b-instruct:free",
+        "config_keys": "OPENROUTER_API_KEYS",
+    },
+    "agentrouter": {
+        "name": "AgentRouter", "kind": "openai", "timeout": 45.0,
+        "base_url": "https://agentrouter.org/v1",
+        "model": "gpt-4o-mini",
+        "config_keys": "AGENTROUTER_API_KEYS",
+    },
+    "openai": {
+        "name": "OpenAI", "kind": "openai", "timeout": 30.0,
+        "base_url": None,
+        "model": "gpt-4o-mini",
+        "config_keys": "OPENAI_API_KEYS",
+    },
+    "gemini": {
+        "name": "Gemini", "kind": "gemini", "timeout": 60.0,
+        "model": "gemini-1.5-flash",
+        "config_keys": "GEMINI_API_KEYS",
+    },
+    "deepseek": {
+        "name": "DeepSeek", "kind": "http", "timeout": 45.0,
+        "url": "https://api.deepseek.com/chat/completions",
+        "model": "deepseek-chat",
+        "config_keys": "DEEPSEEK_API_KEYS",
+    },
+}
+
+# Urutan fallback default: OpenRouter -> AgentRouter -> Gemini -> Deepseek -> OpenAI
+DEFAULT_ORDER = ["openrouter", "agentrouter", "gemini", "deepseek", "openai"]
+
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", "50"))
+AI_KEEPALIVE_EXPIRY = float(os.getenv("AI_KEEPALIVE_EXPIRY", "120"))
+
+
+class HedgePolicy(NamedTuple):
+    hedge_delay: float  # detik menunggu jawaban sebelum provider berikutnya ikut dijalankan
+    max_parallel: int   # maksimal request yang berjalan bersamaan (1 = fallback serial)
+    budget: float       # batas waktu total (detik) jika caller tidak memberi deadline
+
+
+# Kebijakan hedging per fitur. max_parallel membatasi pemakaian kuota: provider
+# cadangan hanya dipanggil jika yang sebelumnya lambat atau gagal.
+HEDGE_POLICIES: Dict[str, HedgePolicy] = {
+    "default": HedgePolicy(float(os.getenv("AI_HEDGE_DELAY", "10")), int(os.getenv("AI_HEDGE_MAX_PARALLEL", "2")), 90.0),
+    "scanner": HedgePolicy(8.0, 2, 90.0),
+    "ssrp": HedgePolicy(12.0, 2, 120.0),
+    "char_story": HedgePolicy(12.0, 2, 120.0),
+    "server_creator": HedgePolicy(10.0, 2, 90.0),
+    "template_creator": HedgePolicy(8.0, 2, 60.0),
+}
+
+
+class AIError(Exception):
+    """Semua provider gagal (atau deadline habis)."""
+
+
+class AIResult(NamedTuple):
+    provider: str       # id provider, cth: "openrouter"
+    name: str           # nama tampilan, cth: "OpenRouter"
+    text: str           # teks mentah dari AI
+    value: Any          # hasil parse (atau teks jika tanpa parse)
+    latency: float      # detik
+    cached: bool = False  # diambil dari cache respons AI
+
+
+def queue_status_updater(message, prefix: str = "") -> Callable[[int], Awaitable[None]]:
+    """Callback on_queue standar: edit pesan status dengan posisi antrean AI."""
+    async def on_queue(position: int):
+        await message.edit(content=f"{prefix}⏳ Menunggu antrean AI (posisi #{position})...")
+    return on_queue
+
+
+def parse_json(text: str) -> Any:
+    """Membersihkan pagar ```json lalu parse JSON. Error jika kosong/invalid."""
+    cleaned = re.sub(r'```json\s*|\s*```', '', text.strip(), flags=re.DOTALL)
+    if not cleaned: raise ValueError("Respons JSON kosong.")
+    return json.loads(cleaned)
+
+
+# =================================================================
+# GEMINI
+# =================================================================
+class GeminiAdapter:
+    """
+    Satu GenerativeServiceAsyncClient per API key, dibuat sekali dan dipakai selama proses hidup.
+    Tidak memakai genai.configure() (state global), jadi panggilan paralel dengan key berbeda aman.
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, "glm.GenerativeServiceAsyncClient"] = {}
+
+    def client(self, key: str) -> "glm.GenerativeServiceAsyncClient":
+        client = self._clients.get(key)
+        if client is None:
+            client = self._clients[key] = glm.GenerativeServiceAsyncClient(client_options={"api_key": key})
+        return client
+
+    @staticmethod
+    def request(model: str, prompt: str, system: Optional[str], json_mode: bool, temperature: float, max_tokens: Optional[int]):
+        config = {"temperature": temperature}
+        if max_tokens: config["max_output_tokens"] = max_tokens
+        if json_mode: config["response_mime_type"] = "application/json"
+        kwargs = {
+            "model": model if model.startswith("models/") else f"models/{model}",
+            "contents": [glm.Content(role="user", parts=[glm.Part(text=prompt)])],
+            "generation_config": glm.GenerationConfig(**config),
+        }
+        if system: kwargs["system_instruction"] = glm.Content(parts=[glm.Part(text=system)])
+        return glm.GenerateContentRequest(**kwargs)
+
+    @staticmethod
+    def extract_text(response, final: bool = True) -> str:
+        """Teks dari GenerateContentResponse; raise jika diblokir / berhenti tidak normal."""
+        if response.prompt_feedback and response.prompt_feedback.block_reason:
+            raise Exception(f"Diblokir: {response.prompt_feedback.block_reason.name}")
+        if not response.candidates: return ""
+        candidate = response.candidates[0]
+        reason = candidate.finish_reason.name
+        # Potongan stream di tengah belum punya finish_reason; MAX_TOKENS di akhir stream tetap dipakai
+        allowed = ("STOP",) if final else ("STOP", "FINISH_REASON_UNSPECIFIED", "MAX_TOKENS")
+        if reason not in allowed:
+            raise Exception(f"Finish reason: {reason}")
+        return "".join(part.text for part in candidate.content.parts)
+
+    async def generate(self, key, model, prompt, system, json_mode, temperature, max_tokens, timeout) -> str:
+        request = self.request(model, prompt, system, json_mode, temperature, max_tokens)
+        response = await self.client(key).generate_content(request, timeout=timeout)
+        return self.extract_text(response)
+
+    async def stream(self, key, model, prompt, system, temperature, max_tokens, timeout) -> AsyncIterator[str]:
+        request = self.request(model, prompt, system, False, temperature, max_tokens)
+        responses = await self.client(key).stream_generate_content(request, timeout=timeout)
+        async for chunk in responses:
+            text = self.extract_text(chunk, final=False)
+            if text: yield text
+
+    async def aclose(self):
+        for client in self._clients.values():
+            try:
+                await client.transport.close()
+            except Exception as e:
+                logger.debug(f"Gagal menutup client Gemini: {e}")
+        self._clients.clear()
+
+
+# =================================================================
+# GATEWAY
+# =================================================================
+class AIGateway:
+    """Satu pintu untuk semua panggilan AI. Client HTTP & SDK dibuat sekali lalu dipakai ulang."""
+
+    def __init__(self, config):
+        self.config = config
+        self.keys: Dict[str, List[str]] = {p: list(getattr(config, spec["config_keys"], []) or []) for p, spec in PROVIDERS.items()}
+        self.key_pools: Dict[str, KeyPool] = {p: KeyPool(p, keys) for p, keys in self.keys.items() if keys}
+        self.health = HealthTracker()
+        self.scheduler = AIScheduler()
+        for p, keys in self.keys.items():
+            if keys: self.scheduler.configure_provider(p, len(keys))
+        self.openrouter_headers = {
+            "HTTP-Referer": getattr(config, 'OPENROUTER_SITE_URL', 'http://localhost'),
+            "X-Title": getattr(config, 'OPENROUTER_SITE_NAME', 'MBOT'),
+        }
+        self._http: Optional[httpx.AsyncClient] = None
+        self._openai_clients: Dict[tuple, AsyncOpenAI] = {}
+        self.gemini = GeminiAdapter()
+
+        for p, keys in self.keys.items():
+            if keys: logger.info(f"✅ AI Gateway: {PROVIDERS[p]['name']} ({len(keys)} keys).")
+        if not HTTP2_AVAILABLE:
+            logger.info("ℹ️ Paket 'h2' tidak ada, AI Gateway memakai HTTP/1.1 keep-alive.")
+
+    # --- Client yang dipakai ulang (keep-alive) ---
+    def _http_client(self) -> httpx.AsyncClient:
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=httpx.Timeout(60.0, connect=10.0),
+                limits=httpx.Limits(max_connections=AI_MAX_CONNECTIONS, max_keepalive_connections=AI_MAX_CONNECTIONS, keepalive_expiry=AI_KEEPALIVE_EXPIRY),
+            )
+            self._openai_clients.clear()
+        return self._http
+
+    def _openai_client(self, provider: str, key: str) -> AsyncOpenAI:
+        http = self._http_client()
+        client = self._openai_clients.get((provider, key))
+        if client is None:
+            spec = PROVIDERS[provider]
+            client = AsyncOpenAI(api_key=key, base_url=spec.get("base_url"), timeout=spec["timeout"], http_client=http)
+            self._openai_clients[(provider, key)] = client
+        return client
+
+    async def aclose(self):
+        """Tutup koneksi HTTP (dipanggil saat bot shutdown)."""
+        if self._http is not None and not self._http.is_closed:
+            await self._http.aclose()
+        self._openai_clients.clear()
+        await self.gemini.aclose()
+
+    # --- Info ---
+    def is_available(self, provider: str) -> bool:
+        return bool(self.keys.get(provider))
+
+    def available_providers(self, order: Optional[List[str]] = None) -> List[str]:
+        return [p for p in (order or DEFAULT_ORDER) if self.is_available(p)]
+
+    def has_healthy_key(self, provider: str) -> bool:
+        pool = self.key_pools.get(provider)
+        return pool is not None and pool.healthy_count() > 0
+
+    def key_stats(self) -> Dict[str, List[Dict]]:
+        return {p: pool.snapshot() for p, pool in self.key_pools.items()}
+
+    def provider_stats(self) -> Dict[str, List[Dict]]:
+        return self.health.snapshot()
+
+    def scheduler_stats(self) -> Dict:
+        return self.scheduler.stats()
+
+    def reset_key_cooldowns(self, provider: Optional[str] = None):
+        for p, pool in self.key_pools.items():
+            if provider is None or p == provider: pool.reset()
+
+    @staticmethod
+    def _error_info(e: Exception):
+        """(status HTTP, headers) dari exception httpx / openai / google-api-core, jika ada."""
+        response = getattr(e, "response", None)
+        status = getattr(e, "status_code", None) or getattr(response, "status_code", None)
+        if status is None and isinstance(getattr(e, "code", None), int): status = e.code
+        return status, getattr(response, "headers", None)
+
+    # --- Panggilan satu provider ---
+    async def call(
+        self, provider: str, prompt: str, *, system: Optional[str] = None, json_mode: bool = False,
+        temperature: float = 0.7, max_tokens: Optional[int] = None, timeout: Optional[float] = None,
+        model: Optional[str] = None, key: Optional[str] = None,
+    ) -> str:
+        """
+        Satu request ke satu provider. Return teks, atau raise jika gagal/kosong.
+        Tanpa key eksplisit, key diambil dari KeyPool provider dan hasilnya dicatat (cooldown jika 429/401/5xx).
+        """
+        spec = PROVIDERS[provider]
+        model = model or spec["model"]
+        timeout = min(timeout, spec["timeout"]) if timeout else spec["timeout"]
+        messages = ([{"role": "system", "content": system}] if system else []) + [{"role": "user", "content": prompt}]
+        args = (model, prompt, system, messages, json_mode, temperature, max_tokens, timeout)
+
+        # Batasi laju request per provider (token bucket global)
+        await self.scheduler.provider_token(provider, timeout)
+
+        if key:
+            text, _ = await self._dispatch(provider, key, *args)
+        else:
+            pool = self.key_pools[provider]
+            # Key yang kena 429/401/5xx masuk cooldown, lalu coba key sehat berikutnya dari provider yang sama
+            for attempt in range(len(pool)):
+                key = pool.acquire()
+                try:
+                    text, headers = await self._dispatch(provider, key, *args)
+                except asyncio.CancelledError:
+                    # Dibatalkan oleh hedging: bukan kesalahan key
+                    pool.cancel(key)
+                    raise
+                except Exception as e:
+                    status, headers = self._error_info(e)
+                    pool.release(key, ok=False, status=status, headers=headers, error=f"{type(e).__name__}: {e}"[:120])
+                    if not pool.is_key_error(status) or attempt == len(pool) - 1 or not pool.healthy_count():
+                        raise
+                    logger.info(f"AI: key {spec['name']} ditolak (HTTP {status}), mencoba key lain.")
+                    continue
+                pool.release(key, ok=True, status=200, headers=headers)
+                break
+
+        if not text or not text.strip():
+            raise ValueError(f"Respons {spec['name']} kosong.")
+        return text
+
+    async def _dispatch(self, provider, key, model, prompt, system, messages, json_mode, temperature, max_tokens, timeout) -> Tuple[str, Any]:
+        kind = PROVIDERS[provider]["kind"]
+        if kind == "gemini":
+            return await self._call_gemini(key, model, prompt, system, json_mode, temperature, max_tokens, timeout)
+        if kind == "openai":
+            return await self._call_openai(provider, key, model, messages, json_mode, temperature, max_tokens, timeout)
+        return await self._call_http(provider, key, model, messages, json_mode, temperature, max_tokens, timeout)
+
+    async def _call_http(self, provider, key, model, messages, json_mode, temperature, max_tokens, timeout) -> Tuple[str, Any]:
+        payload = {"model": model, "messages": messages, "temperature": temperature}
+        if max_tokens: payload["max_tokens"] = max_tokens
+        if json_mode: payload["response_format"] = {"type": "json_object"}
+        headers = {"Authorization": f"Bearer {key}"}
+        if provider == "openrouter": headers.update(self.openrouter_headers)
+
+        response = await self._http_client().post(PROVIDERS[provider]["url"], json=payload, headers=headers, timeout=timeout)
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"], response.headers
+
+    async def _call_openai(self, provider, key, model, messages, json_mode, temperature, max_tokens, timeout) -> Tuple[str, Any]:
+        kwargs = {"model": model, "messages": messages, "temperature": temperature, "timeout": timeout}
+        if max_tokens: kwargs["max_tokens"] = max_tokens
+        if json_mode: kwargs["response_format"] = {"type": "json_object"}
+        raw = await self._openai_client(provider, key).chat.completions.with_raw_response.create(**kwargs)
+        return raw.parse().choices[0].message.content, raw.headers
+
+    async def _call_gemini(self, key, model_name, prompt, system, json_mode, temperature, max_tokens, timeout) -> Tuple[str, Any]:
+        return await self.gemini.generate(key, model_name, prompt, system, json_mode, temperature, max_tokens, timeout), None
+
+    # --- Streaming (SSE untuk provider OpenAI-compatible, stream=True untuk Gemini) ---
+    async def _stream_http(self, provider, key, model, messages, temperature, max_tokens, timeout) -> AsyncIterator[str]:
+        payload = {"model": model, "messages": messages, "temperature": temperature, "stream": True}
+        if max_tokens: payload["max_tokens"] = max_tokens
+        headers = {"Authorization": f"Bearer {key}", "Accept": "text/event-stream"}
+        if provider == "openrouter": headers.update(self.openrouter_headers)
+
+        async with self._http_client().stream("POST", PROVIDERS[provider]["url"], json=payload, headers=headers, timeout=timeout) as response:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                # Baris SSE: "data: {...}", komentar ": ..." (keep-alive OpenRouter) diabaikan
+                if not line.startswith("data:"): continue
+                data = line[5:].strip()
+                if data == "[DONE]": break
+                choices = json.loads(data).get("choices") or []
+                content = choices[0].get("delta", {}).get("content") if choices else None
+                if content: yield content
+
+    async def _stream_openai(self, provider, key, model, messages, temperature, max_tokens, timeout) -> AsyncIterator[str]:
+        kwargs = {"model": model, "messages": messages, "temperature": temperature, "timeout": timeout, "stream": True}
+        if max_tokens: kwargs["max_tokens"] = max_tokens
+        stream = await self._openai_client(provider, key).chat.completions.create(**kwargs)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def _stream_gemini(self, key, model_name, prompt, system, temperature, max_tokens, timeout) -> AsyncIterator[str]:
+        return self.gemini.stream(key, model_name, prompt, system, temperature, max_tokens, timeout)
+
+    def _stream_dispatch(self, provider, key, model, prompt, system, temperature, max_tokens, timeout) -> AsyncIterator[str]:
+        kind = PROVIDERS[provider]["kind"]
+        if kind == "gemini":
+            return self._stream_gemini(key, model, prompt, system, temperature, max_tokens, timeout)
+        messages = ([{"role": "system", "content": system}] if system else []) + [{"role": "user", "content": prompt}]
+        if kind == "openai":
+            return self._stream_openai(provider, key, model, messages, temperature, max_tokens, timeout)
+        return self._stream_http(provider, key, model, messages, temperature, max_tokens, timeout)
+
+    # --- Cache respons deterministik ---
+    @staticmethod
+    def cache_key(provider: str, model: str, prompt: str, system: Optional[str] = None, json_mode: bool = False) -> str:
+        """Key cache berbasis isi: (provider, model, hash prompt)."""
+        digest = hashlib.sha256(f"{system or ''}\x00{int(json_mode)}\x00{prompt}".encode("utf-8")).hexdigest()
+        return f"{provider}:{model}:{digest}"
+
+    async def _cached_result(self, order, models, prompt, system, json_mode, parse, feature) -> Optional[AIResult]:
+        keys = {p: self.cache_key(p, models.get(p) or PROVIDERS[p]["model"], prompt, system, json_mode) for p in order}
+        found = await get_ai_cached_responses_async(list(keys.values())) if keys else {}
+        for provider in order:
+            text = found.get(keys[provider])
+            if text is None: continue
+            try:
+                value = parse(text) if parse else text
+            except Exception as e:
+                logger.debug(f"AI [{feature}]: cache {provider} tidak valid lagi: {e}")
+                continue
+            logger.info(f"AI [{feature}]: hasil {PROVIDERS[provider]['name']} diambil dari cache.")
+            return AIResult(provider, PROVIDERS[provider]["name"], text, value, 0.0, True)
+        return None
+
+    # --- Hedging antar provider ---
+    async def _attempt(self, feature, provider, prompt, parse, model, deadline, **kwargs) -> AIResult:
+        start = time.monotonic()
+        try:
+            text = await self.call(provider, prompt, timeout=deadline - start, model=model, **kwargs)
+            value = parse(text) if parse else text
+        except (asyncio.CancelledError, RateLimitTimeout, NoHealthyKey):
+            # Dibatalkan hedging / tertahan rate limit lokal / semua key cooldown sebelum leg hedging
+            # sempat jalan: tidak ada request terkirim, jadi tidak dihitung sebagai kegagalan provider
+            self.health.cancelled(feature, provider)
+            raise
+        except Exception:
+            self.health.record(feature, provider, False, time.monotonic() - start)
+            raise
+        latency = time.monotonic() - start
+        self.health.record(feature, provider, True, latency)
+        return AIResult(provider, PROVIDERS[provider]["name"], text, value, latency)
+
+    @staticmethod
+    async def _notify(callback, *args):
+        # Error di callback (mis. pesan Discord sudah dihapus) tidak boleh menggagalkan race
+        if callback is None: return
+        try:
+            await callback(*args)
+        except Exception as e:
+            logger.debug(f"AI callback error: {e}")
+
+    async def _race(self, prompt, feature, deadline, providers, models, parse, on_attempt, on_failure, **kwargs) -> AIResult:
+        """Inti complete(): hedging antar provider. Dipanggil setelah mendapat slot scheduler."""
+        policy = HEDGE_POLICIES.get(feature, HEDGE_POLICIES["default"])
+        if deadline is None: deadline = time.monotonic() + policy.budget
+        # Provider yang semua key-nya sedang cooldown dilewati; sisanya diurutkan menurut
+        # kesehatan (EWMA latency & sukses) untuk fitur ini, circuit terbuka dilewati
+        queue = self.health.order(feature, [p for p in self.available_providers(providers) if self.has_healthy_key(p)])
+        running: Dict[asyncio.Task, str] = {}
+        winner: Optional[AIResult] = None
+        launch_next = True  # provider berikutnya langsung jalan di awal dan setiap kali ada yang gagal
+
+        async def launch():
+            provider = queue.pop(0)
+            self.health.started(feature, provider)
+            await self._notify(on_attempt, provider)
+            task = asyncio.create_task(self._attempt(feature, provider, prompt, parse, models.get(provider), deadline, **kwargs))
+            running[task] = provider
+
+        try:
+            while queue or running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"AI [{feature}]: deadline habis ({policy.budget:.0f}s budget).")
+                    break
+                if queue and (launch_next or not running) and len(running) < policy.max_parallel:
+                    await launch()
+                launch_next = False
+                can_hedge = bool(queue) and len(running) < policy.max_parallel
+                done, _ = await asyncio.wait(
+                    running, timeout=min(policy.hedge_delay, remaining) if can_hedge else remaining,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    if can_hedge:
+                        logger.info(f"AI [{feature}]: belum ada jawaban setelah {policy.hedge_delay:.0f}s, hedging ke {PROVIDERS[queue[0]]['name']}.")
+                        await launch()
+                    continue
+                for task in done:
+                    provider = running.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        logger.warning(f"AI [{feature}]: {PROVIDERS[provider]['name']} gagal: {e}")
+                        await self._notify(on_failure, provider, e)
+                        launch_next = True
+                        continue
+                    logger.info(f"AI [{feature}]: {result.name} berhasil ({result.latency:.1f}s).")
+                    winner = result
+                    break
+                if winner: break
+        finally:
+            for task in running:
+                if task.done():
+                    if not task.cancelled(): task.exception()
+                else:
+                    task.cancel()
+
+        if winner is None:
+            raise AIError("Semua layanan AI gagal dihubungi atau error.")
+        return winner
+
+    async def complete(
+        self, prompt: str, *, json_mode: bool = False, temperature: float = 0.7, deadline: Optional[float] = None,
+        system: Optional[str] = None, max_tokens: Optional[int] = None, providers: Optional[List[str]] = None,
+        models: Optional[Dict[str, str]] = None, parse: Optional[Callable[[str], Any]] = None, feature: str = "default",
+        on_attempt: Optional[Callable[[str], Awaitable[None]]] = None,
+        on_failure: Optional[Callable[[str, Exception], Awaitable[None]]] = None, cache: bool = False,
+        user_id: Optional[int] = None, priority: int = PRIORITY_INTERACTIVE, on_queue: Optional[Callable[[int], Awaitable[None]]] = None,
+    ) -> AIResult:
+        """
+        Jalankan provider dengan hedging: provider pertama langsung dipanggil,
+        provider berikutnya ikut dijalankan jika belum ada jawaban setelah hedge_delay
+        (atau langsung jika yang sebelumnya gagal). Hasil valid pertama dipakai, sisanya dibatalkan.
+        deadline: batas waktu absolut (time.monotonic()); default dari budget HEDGE_POLICIES[feature].
+        providers: urutan prior; urutan akhir menyesuaikan statistik provider per fitur (HealthTracker).
+        parse: validasi/parse teks; jika raise, dianggap gagal.
+        cache: pakai & isi cache respons (hanya untuk prompt deterministik, mis. temperature 0).
+            Hasil cache dari provider mana pun dalam `providers` diterima.
+        user_id/priority/on_queue: antrean global AIScheduler (fair per user); on_queue(posisi) dipanggil saat antre.
+            Satu slot scheduler mencakup seluruh race (semua leg hedging), bukan per request HTTP.
+        """
+        models = models or {}
+        if cache:
+            hit = await self._cached_result(self.available_providers(providers), models, prompt, system, json_mode, parse, feature)
+            if hit: return hit
+
+        try:
+            async with self.scheduler.slot(user_id, priority, on_queue, None if deadline is None else deadline - time.monotonic()):
+                winner = await self._race(
+                    prompt, feature, deadline, providers, models, parse, on_attempt, on_failure,
+                    system=system, json_mode=json_mode, temperature=temperature, max_tokens=max_tokens
+                )
+        except TimeoutError:
+            raise AIError("Antrean AI terlalu panjang, deadline habis sebelum request berjalan.")
+        if cache:
+            model = models.get(winner.provider) or PROVIDERS[winner.provider]["model"]
+            key = self.cache_key(winner.provider, model, prompt, system, json_mode)
+            await put_ai_cached_response_async(key, winner.provider, model, winner.text)
+        return winner
+
+    async def stream_complete(
+        self, prompt: str, *, on_text: Callable[[str], Awaitable[None]], temperature: float = 0.7,
+        deadline: Optional[float] = None, system: Optional[str] = None, max_tokens: Optional[int] = None,
+        providers: Optional[List[str]] = None, models: Optional[Dict[str, str]] = None, feature: str = "default",
+        user_id: Optional[int] = None, priority: int = PRIORITY_INTERACTIVE, on_queue: Optional[Callable[[int], Awaitable[None]]] = None,
+    ) -> AIResult:
+        """
+        Seperti complete(), tapi teks dialirkan (streaming): on_text dipanggil dengan teks
+        terkumpul setiap ada potongan baru. Provider dicoba berurutan (tanpa hedging); jika satu
+        provider putus di tengah jalan, provider berikutnya mulai dari awal dan on_text menerima
+        teks baru yang menggantikan teks sebelumnya.
+        """
+        try:
+            async with self.scheduler.slot(user_id, priority, on_queue, None if deadline is None else deadline - time.monotonic()):
+                return await self._stream(prompt, on_text, feature, deadline, providers, models, system, temperature, max_tokens)
+        except TimeoutError:
+            raise AIError("Antrean AI terlalu panjang, deadline habis sebelum request berjalan.")
+
+    async def _stream(self, prompt, on_text, feature, deadline, providers, models, system, temperature, max_tokens) -> AIResult:
+        policy = HEDGE_POLICIES.get(feature, HEDGE_POLICIES["default"])
+        if deadline is None: deadline = time.monotonic() + policy.budget
+        models = models or {}
+        queue = self.health.order(feature, [p for p in self.available_providers(providers) if self.has_healthy_key(p)])
+
+        for provider in queue:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning(f"AI [{feature}]: deadline habis ({policy.budget:.0f}s budget).")
+                break
+            spec = PROVIDERS[provider]
+            try:
+                await self.scheduler.provider_token(provider, remaining)
+            except TimeoutError as e:
+                logger.warning(f"AI [{feature}]: {spec['name']} dilewati: {e}")
+                continue
+            pool = self.key_pools[provider]
+            try:
+                key = pool.acquire()
+            except NoHealthyKey as e:
+                # Semua key provider ini cooldown sejak antrean dibuat: lanjut ke provider berikutnya
+                logger.warning(f"AI [{feature}]: {spec['name']} dilewati: {e}")
+                continue
+            self.health.started(feature, provider)
+            start = time.monotonic()
+            first_token = None
+            parts: List[str] = []
+            try:
+                chunks = self._stream_dispatch(
+                    provider, key, models.get(provider) or spec["model"], prompt, system,
+                    temperature, max_tokens, min(remaining, spec["timeout"])
+                )
+                async for chunk in chunks:
+                    if first_token is None: first_token = time.monotonic() - start
+                    parts.append(chunk)
+                    await self._notify(on_text, "".join(parts))
+                    if time.monotonic() > deadline: raise TimeoutError("Deadline streaming habis.")
+                text = "".join(parts)
+                if not text.strip(): raise ValueError(f"Respons {spec['name']} kosong.")
+            except asyncio.CancelledError:
+                pool.cancel(key)
+                self.health.cancelled(feature, provider)
+                raise
+            except Exception as e:
+                status, headers = self._error_info(e)
+                pool.release(key, ok=False, status=status, headers=headers, error=f"{type(e).__name__}: {e}"[:120])
+                self.health.record(feature, provider, False, time.monotonic() - start)
+                logger.warning(f"AI [{feature}]: {spec['name']} gagal (stream): {e}")
+                continue
+            latency = time.monotonic() - start
+            pool.release(key, ok=True, status=200)
+            # Untuk streaming yang dirasakan user adalah waktu sampai token pertama
+            self.health.record(feature, provider, True, first_token or latency)
+            logger.info(f"AI [{feature}]: {spec['name']} berhasil (stream, token pertama {first_token or 0:.1f}s, total {latency:.1f}s).")
+            return AIResult(provider, spec["name"], text, text, latency)
+
+        raise AIError("Semua layanan AI gagal dihubungi atau error.")
+
+    @staticmethod
+    def display_name(provider: str) -> str:
+        return PROVIDERS[provider]["name"]
@@ -0,0 +1,228 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# =================================================================
+# PENJADWAL AI GLOBAL
+# =================================================================
+# - Slot: maksimal AI_MAX_CONCURRENT_REQUESTS request AI (complete/stream) berjalan bersamaan
+#   di seluruh bot. Sisanya antre menurut kelas prioritas, lalu round-robin antar user
+#   (satu user yang spam tidak bisa menghabiskan antrean orang lain).
+#   Yang dihitung request logis: satu complete() yang di-hedge ke beberapa provider tetap
+#   memakai satu slot, jadi request HTTP yang terbang bisa sampai slot x max_parallel HEDGE_POLICIES.
+# - Token bucket per provider: membatasi laju request ke tiap provider agar burst tidak
+#   memicu 429 beruntun.
+
+PRIORITY_INTERACTIVE = 0  # command / modal yang ditunggu user
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2   # scan ulang / tugas latar belakang
+
+AI_MAX_CONCURRENT_REQUESTS = int(os.getenv("AI_MAX_CONCURRENT_REQUESTS", "8"))
+AI_PROVIDER_RPS = float(os.getenv("AI_PROVIDER_RPS", "2"))      # token per detik per provider
+AI_PROVIDER_BURST = float(os.getenv("AI_PROVIDER_BURST", "5"))  # kapasitas bucket
+
+
+class RateLimitTimeout(TimeoutError):
+    """Token bucket lokal tidak memberi token sebelum deadline (throttling kita sendiri, bukan kesalahan provider)."""
+
+
+class TokenBucket:
+    """Token bucket async sederhana (satu event loop)."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, timeout: Optional[float] = None):
+        """Ambil satu token; tunggu jika habis. TimeoutError jika tidak dapat dalam `timeout` detik."""
+        give_up = None if timeout is None else time.monotonic() + timeout
+        # Lock menjaga urutan FIFO di antara yang menunggu token
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                if give_up is not None and time.monotonic() + wait > give_up:
+                    raise RateLimitTimeout("Rate limit provider: token tidak tersedia sebelum deadline.")
+                await asyncio.sleep(wait)
+
+
+class _Waiter:
+    __slots__ = ("user_id", "priority", "future", "on_queue", "last_position")
+
+    def __init__(self, user_id, priority, future, on_queue):
+        self.user_id = user_id
+        self.priority = priority
+        self.future = future
+        self.on_queue = on_queue
+        self.last_position = None
+
+
+class AIScheduler:
+    """Slot request AI global dengan prioritas + fair queuing per user, dan token bucket per provider."""
+
+    def __init__(self, max_concurrent: int = AI_MAX_CONCURRENT_REQUESTS, rate: float = AI_PROVIDER_RPS, burst: float = AI_PROVIDER_BURST):
+        self.max_concurrent = max_concurrent
+        self.active = 0
+        self.rate = rate
+        self.burst = burst
+        # prioritas -> {user_id: deque[_Waiter]}; urutan dict = giliran round-robin
+        self._queues: Dict[int, "OrderedDict[object, deque]"] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._notify_tasks: set = set()
+        self.served = 0
+        self.total_wait = 0.0
+
+    # --- Token bucket per provider ---
+    def configure_provider(self, provider: str, keys: int = 1):
+        """Kapasitas bucket sebanding dengan jumlah key provider (limit provider biasanya per key)."""
+        keys = max(keys, 1)
+        self._buckets[provider] = TokenBucket(self.rate * keys, self.burst * keys)
+
+    async def provider_token(self, provider: str, timeout: Optional[float] = None):
+        bucket = self._buckets.get(provider)
+        if bucket is None:
+            bucket = self._buckets[provider] = TokenBucket(self.rate, self.burst)
+        await bucket.acquire(timeout)
+
+    # --- Slot global ---
+    def _waiting(self) -> int:
+        return sum(len(q) for users in self._queues.values() for q in users.values())
+
+    def _position(self, waiter: _Waiter) -> int:
+        """Posisi antre (1 = berikutnya) menurut prioritas lalu round-robin antar user."""
+        ahead = 0
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if priority < waiter.priority:
+                ahead += sum(len(q) for q in users.values())
+                continue
+            if priority > waiter.priority: break
+            mine = users[waiter.user_id]
+            index = mine.index(waiter)
+            before_me = True
+            for user_id, q in users.items():
+                if user_id == waiter.user_id:
+                    ahead += index
+                    before_me = False
+                    continue
+                # User di depan dalam giliran dapat index+1 jatah sebelum saya, di belakang dapat index
+                ahead += min(len(q), index + 1 if before_me else index)
+            break
+        return ahead + 1
+
+    def _notify_positions(self):
+        for users in self._queues.values():
+            for q in users.values():
+                for waiter in q:
+                    if waiter.on_queue is None: continue
+                    position = self._position(waiter)
+                    if position != waiter.last_position:
+                        waiter.last_position = position
+                        task = asyncio.create_task(self._safe_notify(waiter.on_queue, position))
+                        self._notify_tasks.add(task)
+                        task.add_done_callback(self._notify_tasks.discard)
+
+    @staticmethod
+    async def _safe_notify(callback, position):
+        try:
+            await callback(position)
+        except Exception as e:
+            logger.debug(f"Callback antrean AI error: {e}")
+
+    def _dispatch(self):
+        while self.active < self.max_concurrent:
+            waiter = self._pop_next()
+            if waiter is None: break
+            if waiter.future.done(): continue  # dibatalkan saat menunggu
+            self.active += 1
+            waiter.future.set_result(None)
+        self._notify_positions()
+
+    def _pop_next(self) -> Optional[_Waiter]:
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            while users:
+                user_id, q = next(iter(users.items()))
+                waiter = q.popleft()
+                # Giliran user ini selesai: pindah ke belakang (round-robin)
+                del users[user_id]
+                if q: users[user_id] = q
+                if not users: del self._queues[priority]
+                return waiter
+        return None
+
+    def _remove(self, waiter: _Waiter):
+        users = self._queues.get(waiter.priority)
+        if not users or waiter.user_id not in users: return
+        q = users[waiter.user_id]
+        try:
+            q.remove(waiter)
+        except ValueError:
+            return
+        if not q: del users[waiter.user_id]
+        if not users: del self._queues[waiter.priority]
+
+    async def acquire(self, user_id=None, priority: int = PRIORITY_INTERACTIVE,
+                      on_queue: Optional[Callable[[int], Awaitable[None]]] = None, timeout: Optional[float] = None):
+        """Ambil slot request AI. on_queue(posisi) dipanggil saat harus antre dan saat posisinya berubah."""
+        if self.active < self.max_concurrent and not self._queues:
+            self.active += 1
+            self.served += 1
+            return
+        start = time.monotonic()
+        waiter = _Waiter(user_id, priority, asyncio.get_running_loop().create_future(), on_queue)
+        self._queues.setdefault(priority, OrderedDict()).setdefault(user_id, deque()).append(waiter)
+        self._notify_positions()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Slot sudah diberikan tepat saat dibatalkan: kembalikan
+                self.release()
+            else:
+                waiter.future.cancel()
+                self._remove(waiter)
+                self._notify_positions()
+            raise
+        self.served += 1
+        self.total_wait += time.monotonic() - start
+
+    def release(self):
+        self.active = max(0, self.active - 1)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id=None, priority: int = PRIORITY_INTERACTIVE,
+                   on_queue: Optional[Callable[[int], Awaitable[None]]] = None, timeout: Optional[float] = None):
+        await self.acquire(user_id, priority, on_queue, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict:
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "waiting": self._waiting(),
+            "served": self.served,
+            "avg_wait": (self.total_wait / self.served) if self.served else 0.0,
+            "tokens": {p: round(min(b.capacity, b.tokens + (time.monotonic() - b._updated) * b.rate), 1) for p, b in self._buckets.items()},
+        }
@@ -1,14 +1,15 @@
 import os
-import psycopg2
+import time
+import asyncio
+import threading
 import logging
 import json  # Ditambahkan untuk fitur catalog
-from datetime import date 
+from collections import OrderedDict, deque
+from datetime import date, datetime, timedelta, timezone
+from utils.db_backends import PostgresBackend, SQLiteBackend
 
 logger = logging.getLogger(__name__)
 
-# --- Objek Koneksi Global ---
-db_connection = None
-
 # =================================================================
 # Definisikan Batas Pangkat (Rank)
 # =================================================================
@@ -21,243 +22,962 @@ RANK_LIMITS = {
 }
 VALID_RANKS = list(RANK_LIMITS.keys())
 
-def get_db_connection():
-    """Membuat atau mengembalikan koneksi database PostgreSQL."""
-    global db_connection
-    if db_connection is None or db_connection.closed != 0:
-        try:
-            DATABASE_URL = os.getenv("DATABASE_URL")
-            if not DATABASE_URL:
-                logger.critical("❌ FATAL: DATABASE_URL tidak ditemukan di .env!")
-                return None
-            db_connection = psycopg2.connect(DATABASE_URL)
-        except Exception as e:
-            logger.error(f"❌ Gagal koneksi database: {e}")
-            db_connection = None
-    return db_connection
+# =================================================================
+# CONNECTION POOL
+# =================================================================
+# Semua query dijalankan di thread executor khusus DB (bukan di event loop),
+# dengan koneksi yang dipinjam dari pool berukuran terbatas.
+# Backend: DB_BACKEND=postgres (DATABASE_URL) atau sqlite (SQLITE_PATH, embedded, mode WAL).
+# Jika DB_BACKEND kosong: Postgres bila DATABASE_URL ada, selain itu SQLite lokal.
+DB_BACKEND = os.getenv("DB_BACKEND", "").strip().lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "mbot.db")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "10"))
+DB_HEALTHCHECK_IDLE = float(os.getenv("DB_HEALTHCHECK_IDLE", "30"))
 
-def init_database():
-    """Menginisialisasi SEMUA tabel."""
-    conn = get_db_connection()
-    if not conn: return
+# --- Objek Pool Global ---
+db_pool = None
+_pool_lock = threading.Lock()
+
+def _create_backend():
+    DATABASE_URL = os.getenv("DATABASE_URL")
+    backend = DB_BACKEND or ("postgres" if DATABASE_URL else "sqlite")
+    if backend == "sqlite":
+        if not DB_BACKEND:
+            logger.warning(f"⚠️ DATABASE_URL tidak ditemukan, memakai SQLite lokal: {SQLITE_PATH}")
+        pool = SQLiteBackend(SQLITE_PATH, DB_POOL_MAX, DB_ACQUIRE_TIMEOUT)
+        logger.info(f"✅ Database SQLite dibuka ({SQLITE_PATH}, max={DB_POOL_MAX}).")
+        return pool
+    if backend != "postgres":
+        logger.critical(f"❌ FATAL: DB_BACKEND '{backend}' tidak dikenal (postgres / sqlite).")
+        return None
+    if not DATABASE_URL:
+        logger.critical("❌ FATAL: DATABASE_URL tidak ditemukan di .env!")
+        return None
+    pool = PostgresBackend(DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, DB_ACQUIRE_TIMEOUT, DB_HEALTHCHECK_IDLE)
+    logger.info(f"✅ Pool database dibuat (min={DB_POOL_MIN}, max={DB_POOL_MAX}).")
+    return pool
+
+def get_pool():
+    """Membuat atau mengembalikan pool koneksi database (Postgres / SQLite)."""
+    global db_pool
+    if db_pool is None:
+        with _pool_lock:
+            if db_pool is None:
+                try:
+                    db_pool = _create_backend()
+                except Exception as e:
+                    logger.error(f"❌ Gagal koneksi database: {e}")
+                    db_pool = None
+    return db_pool
+
+def close_pool():
+    """Menutup semua koneksi di pool (dipanggil saat bot shutdown)."""
+    global db_pool
+    # Buffer write-behind harus masuk DB sebelum koneksi ditutup
+    _writer.stop()
+    with _pool_lock:
+        if db_pool is not None:
+            db_pool.close()
+            db_pool = None
+            logger.info("🛑 Pool database ditutup.")
+
+def _dialect():
+    pool = get_pool()
+    return pool.dialect if pool else None
+
+# =================================================================
+# INSTRUMENTASI QUERY
+# =================================================================
+# Setiap _run() dicatat: latency (sampel terbaru untuk p50/p95/p99), jumlah panggilan & error.
+# Query di atas DB_SLOW_QUERY_MS di-log dengan parameter yang disamarkan (hanya tipe/panjang).
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+DB_LATENCY_SAMPLES = int(os.getenv("DB_LATENCY_SAMPLES", "1024"))
+
+class _QueryStats:
+    __slots__ = ("calls", "errors", "slow", "total_ms", "max_ms", "samples")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.slow = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = deque(maxlen=DB_LATENCY_SAMPLES)
+
+_query_stats: dict = {}
+_stats_lock = threading.Lock()
+
+def _redact(args: tuple) -> str:
+    """Parameter query untuk log tanpa isi aslinya (ID user, komentar, dll)."""
+    parts = []
+    for a in args:
+        if a is None or isinstance(a, bool):
+            parts.append(repr(a))
+        elif isinstance(a, (str, bytes, list, tuple, dict)):
+            parts.append(f"<{type(a).__name__} len={len(a)}>")
+        else:
+            parts.append(f"<{type(a).__name__}>")
+    return "(" + ", ".join(parts) + ")"
 
+def _record_query(name: str, elapsed_ms: float, failed: bool, args: tuple):
+    with _stats_lock:
+        st = _query_stats.get(name)
+        if st is None:
+            st = _query_stats[name] = _QueryStats()
+        st.calls += 1
+        st.total_ms += elapsed_ms
+        st.max_ms = max(st.max_ms, elapsed_ms)
+        st.samples.append(elapsed_ms)
+        if failed: st.errors += 1
+        slow = elapsed_ms >= DB_SLOW_QUERY_MS
+        if slow: st.slow += 1
+    if slow:
+        logger.warning(f"🐢 Query DB lambat '{name}': {elapsed_ms:.1f} ms, params={_redact(args)}")
+
+def _percentile(sorted_samples: list, pct: float) -> float:
+    if not sorted_samples: return 0.0
+    idx = min(len(sorted_samples) - 1, max(0, int(round(pct / 100 * len(sorted_samples))) - 1))
+    return sorted_samples[idx]
+
+def get_query_stats() -> dict:
+    """Ringkasan per fungsi DB: calls, errors, slow, avg/max & p50/p95/p99 (ms)."""
+    with _stats_lock:
+        snapshot = {name: (st.calls, st.errors, st.slow, st.total_ms, st.max_ms, sorted(st.samples)) for name, st in _query_stats.items()}
+    result = {}
+    for name, (calls, errors, slow, total_ms, max_ms, samples) in snapshot.items():
+        result[name] = {
+            "calls": calls, "errors": errors, "slow": slow,
+            "avg_ms": total_ms / calls if calls else 0.0, "max_ms": max_ms,
+            "p50_ms": _percentile(samples, 50), "p95_ms": _percentile(samples, 95), "p99_ms": _percentile(samples, 99),
+        }
+    return result
+
+def reset_query_stats():
+    with _stats_lock:
+        _query_stats.clear()
+
+def _run(func, args: tuple, default):
+    """Menjalankan func(cursor, *args) dengan koneksi pinjaman. Error -> default."""
+    pool = get_pool()
+    if not pool: return default
+    name = func.__name__.lstrip("_")
+    conn = None
+    broken = False
+    failed = False
+    start = time.perf_counter()
     try:
-        with conn.cursor() as cursor:
-            # Tabel Scanner & AI
-            cursor.execute('''CREATE TABLE IF NOT EXISTS scan_history (id SERIAL PRIMARY KEY, user_id BIGINT NOT NULL, filename TEXT NOT NULL, file_hash TEXT, danger_level INTEGER NOT NULL, analyst TEXT, timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP, channel_id BIGINT);''')
-            cursor.execute('''CREATE TABLE IF NOT EXISTS daily_usage (user_id BIGINT NOT NULL, date DATE NOT NULL, count INTEGER DEFAULT 0, PRIMARY KEY (user_id, date));''')
-            cursor.execute('''CREATE TABLE IF NOT EXISTS char_story_cooldown (user_id BIGINT PRIMARY KEY, last_used_date DATE NOT NULL);''')
-            cursor.execute('''CREATE TABLE IF NOT EXISTS server_settings (guild_id BIGINT PRIMARY KEY, upload_channel_id BIGINT);''')
-            cursor.execute('''CREATE TABLE IF NOT EXISTS user_permissions (user_id BIGINT PRIMARY KEY, rank TEXT NOT NULL DEFAULT 'beginner');''')
-            cursor.execute('''CREATE TABLE IF NOT EXISTS ai_daily_usage (user_id BIGINT NOT NULL, date DATE NOT NULL, count INTEGER DEFAULT 0, PRIMARY KEY (user_id, date));''')
-
-            # Tabel Rating
-            cursor.execute('''CREATE TABLE IF NOT EXISTS rating_config (guild_id BIGINT PRIMARY KEY, log_channel_id BIGINT);''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS ratings (
-                    user_id BIGINT NOT NULL,
-                    topic TEXT NOT NULL,
-                    stars INTEGER NOT NULL,
-                    comment TEXT,
-                    created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-                    image_url TEXT,
-                    PRIMARY KEY (user_id, topic)
-                );
-            ''')
-            
-            # Tabel Role Catalogs (BARU)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS role_catalogs (
-                    message_id BIGINT PRIMARY KEY,
-                    guild_id BIGINT,
-                    channel_id BIGINT,
-                    config_data TEXT
-                );
-            ''')
-            
-            # MIGRATION: Cek apakah kolom image_url sudah ada di ratings, jika belum tambahkan
-            try:
-                cursor.execute("ALTER TABLE ratings ADD COLUMN IF NOT EXISTS image_url TEXT;")
-            except Exception as e:
-                logger.warning(f"Info Migration: {e}")
-
-        conn.commit()
-        logger.info("✅ Database berhasil diinisialisasi (termasuk Role Catalog).")
+        conn = pool.acquire()
+        with pool.cursor(conn) as cur:
+            return func(cur, *args)
     except Exception as e:
-        logger.error(f"❌ Gagal init database: {e}")
-        conn.rollback()
+        failed = True
+        broken = conn is not None and pool.is_connection_error(e)
+        logger.error(f"❌ Query DB '{func.__name__}' gagal: {e}")
+        return default
+    finally:
+        if conn is not None:
+            pool.release(conn, broken)
+        # Termasuk waktu tunggu acquire koneksi, karena itu juga dirasakan caller
+        _record_query(name, (time.perf_counter() - start) * 1000, failed, args)
+
+async def _run_async(func, args: tuple, default):
+    """Versi async dari _run: query berjalan di executor DB, event loop tetap bebas."""
+    pool = get_pool()
+    if not pool: return default
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool.executor, _run, func, args, default)
+
+class _transaction:
+    """Blok BEGIN/COMMIT eksplisit (koneksi pool berjalan dalam mode autocommit)."""
+    def __init__(self, cur):
+        self.cur = cur
+    def __enter__(self):
+        # SQLite: ambil lock tulis di awal agar read-lalu-write tidak gagal SQLITE_BUSY
+        self.cur.execute("BEGIN IMMEDIATE" if _dialect() == "sqlite" else "BEGIN")
+        return self.cur
+    def __exit__(self, exc_type, exc, tb):
+        self.cur.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+# =================================================================
+# CACHE (rank & setting guild)
+# =================================================================
+# Nilai ini hanya berubah lewat !setrank, !setuploadchannel dan /config_rating_log,
+# jadi disimpan di memori dengan TTL dan di-invalidate saat fungsi set_* berhasil.
+DB_CACHE_TTL = float(os.getenv("DB_CACHE_TTL", "300"))
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", "5000"))
+
+_MISS = object()
+
+class TTLCache:
+    """
+    Cache LRU berukuran terbatas dengan TTL per key. Aman dipakai dari banyak thread.
+    max_bytes (opsional) membatasi total ukuran entri; ukuran tiap entri diberikan pemanggil lewat put(size=...).
+    """
+
+    def __init__(self, name: str, ttl: float, maxsize: int, max_bytes: int = 0):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires, size = item
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.bytes -= size
+            self.misses += 1
+            return _MISS
+
+    def put(self, key, value, ttl: float = None, size: int = 0):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None: self.bytes -= old[2]
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl), size)
+            self.bytes += size
+            while self._data and (len(self._data) > self.maxsize or (self.max_bytes and self.bytes > self.max_bytes)):
+                self.bytes -= self._data.popitem(last=False)[1][2]
+
+    def invalidate(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is not None: self.bytes -= item[2]
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._data)
+            self._data.clear()
+            self.bytes = 0
+            return count
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl,
+                "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+_rank_cache = TTLCache("user_rank", DB_CACHE_TTL, DB_CACHE_SIZE)
+_upload_channel_cache = TTLCache("upload_channel", DB_CACHE_TTL, DB_CACHE_SIZE)
+_rating_log_cache = TTLCache("rating_log_channel", DB_CACHE_TTL, DB_CACHE_SIZE)
+# Tier memori untuk cache respons AI (tier persisten: tabel ai_cache)
+AI_CACHE_TTL_DAYS = float(os.getenv("AI_CACHE_TTL_DAYS", "30"))
+AI_CACHE_MEMORY_SIZE = int(os.getenv("AI_CACHE_MEMORY_SIZE", "2000"))
+_ai_response_cache = TTLCache("ai_response", AI_CACHE_TTL_DAYS * 86400, AI_CACHE_MEMORY_SIZE)
+# Tier memori verdict scan per sha256 file (tier persisten: tabel scan_verdicts), dibatasi jumlah & byte
+SCAN_VERDICT_TTL_DAYS = float(os.getenv("SCAN_VERDICT_TTL_DAYS", "30"))
+SCAN_VERDICT_MEMORY_SIZE = int(os.getenv("SCAN_VERDICT_MEMORY_SIZE", "5000"))
+SCAN_VERDICT_MEMORY_MB = float(os.getenv("SCAN_VERDICT_MEMORY_MB", "64"))
+SCAN_VERDICT_MAX_ENTRY_KB = int(os.getenv("SCAN_VERDICT_MAX_ENTRY_KB", "512"))  # verdict lebih besar hanya disimpan di memori
+_scan_verdict_cache = TTLCache("scan_verdict", SCAN_VERDICT_TTL_DAYS * 86400, SCAN_VERDICT_MEMORY_SIZE, int(SCAN_VERDICT_MEMORY_MB * 1024 * 1024))
+_CACHES = (_rank_cache, _upload_channel_cache, _rating_log_cache, _ai_response_cache, _scan_verdict_cache)
+
+def _cached(cache: TTLCache, key, func, args: tuple, default):
+    """_run() dengan cache. Hasil default karena DB error tidak ikut di-cache."""
+    value = cache.get(key)
+    if value is not _MISS: return value
+    value = _run(func, args, _MISS)
+    if value is _MISS: return default
+    cache.put(key, value)
+    return value
+
+async def _cached_async(cache: TTLCache, key, func, args: tuple, default):
+    value = cache.get(key)
+    if value is not _MISS: return value
+    value = await _run_async(func, args, _MISS)
+    if value is _MISS: return default
+    cache.put(key, value)
+    return value
+
+def get_cache_stats() -> dict:
+    """Counter hit/miss semua cache DB, untuk command owner."""
+    return {cache.name: cache.stats() for cache in _CACHES}
+
+def clear_caches():
+    for cache in _CACHES:
+        cache.clear()
+
+# =================================================================
+# WRITE-BEHIND (scan_history & daily_usage)
+# =================================================================
+# Baris scan_history dan penambahan daily_usage tidak ditulis per request,
+# tapi dikumpulkan lalu di-flush sekaligus tiap DB_BATCH_INTERVAL_MS atau DB_BATCH_SIZE baris.
+DB_BATCH_INTERVAL = float(os.getenv("DB_BATCH_INTERVAL_MS", "2000")) / 1000
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "200"))
+DB_BATCH_MAX_PENDING = DB_BATCH_SIZE * 50  # Batas buffer jika DB sedang down
+
+class BatchWriter:
+    """Buffer tulis di memori + thread flusher di background."""
+
+    def __init__(self, interval: float, max_rows: int, max_pending: int):
+        self.interval = interval
+        self.max_rows = max_rows
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._scan_rows: list = []
+        self._usage: dict = {}
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive(): return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._loop, name="db-batch-writer", daemon=True)
+                self._thread.start()
+
+    def add_scan(self, row: tuple):
+        with self._lock:
+            self._scan_rows.append(row)
+            full = len(self._scan_rows) >= self.max_rows
+        self._ensure_started()
+        if full: self._wake.set()
+
+    def add_usage(self, user_id, day, amount: int = 1):
+        with self._lock:
+            key = (user_id, day)
+            self._usage[key] = self._usage.get(key, 0) + amount
+            full = len(self._usage) >= self.max_rows
+        self._ensure_started()
+        if full: self._wake.set()
+
+    def pending_usage(self, user_id, day) -> int:
+        with self._lock:
+            return self._usage.get((user_id, day), 0)
+
+    def has_pending(self) -> bool:
+        with self._lock:
+            return bool(self._scan_rows or self._usage)
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> bool:
+        """Tulis semua isi buffer dalam satu transaksi. Jika gagal, data dikembalikan ke buffer."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._scan_rows = self._scan_rows, []
+                usage, self._usage = self._usage, {}
+            if not rows and not usage: return True
+            usage_rows = [(uid, day, n) for (uid, day), n in usage.items()]
+            if _run(_flush_batch, (rows, usage_rows), False):
+                return True
+            with self._lock:
+                self._scan_rows[:0] = rows
+                for key, n in usage.items():
+                    self._usage[key] = self._usage.get(key, 0) + n
+                dropped = len(self._scan_rows) - self.max_pending
+                if dropped > 0:
+                    del self._scan_rows[:dropped]
+                    logger.warning(f"⚠️ Buffer scan_history penuh, {dropped} baris terlama dibuang.")
+            return False
+
+    def stop(self):
+        """Hentikan thread flusher lalu flush sisa buffer (dipanggil saat shutdown)."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=DB_ACQUIRE_TIMEOUT + 5)
+            self._thread = None
+        self.flush()
+
+_writer = BatchWriter(DB_BATCH_INTERVAL, DB_BATCH_SIZE, DB_BATCH_MAX_PENDING)
+
+def _flush_batch(cur, scan_rows, usage_rows):
+    with _transaction(cur):
+        if scan_rows:
+            get_pool().insert_values(cur, "INSERT INTO scan_history (user_id, filename, file_hash, danger_level, analyst, channel_id) VALUES %s", scan_rows)
+        if usage_rows:
+            get_pool().insert_values(cur, """
+                INSERT INTO daily_usage (user_id, date, count) VALUES %s
+                ON CONFLICT (user_id, date) DO UPDATE SET count = daily_usage.count + EXCLUDED.count
+            """, usage_rows)
+    return True
+
+def flush_pending_writes():
+    """Paksa flush buffer write-behind (sync)."""
+    return _writer.flush()
+
+async def flush_pending_writes_async():
+    if not _writer.has_pending(): return True
+    pool = get_pool()
+    if not pool: return False
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool.executor, _writer.flush)
+
+# =================================================================
+# INISIALISASI
+# =================================================================
+
+# Migrasi bernomor, dijalankan berurutan & dicatat di schema_version.
+# Semua statement idempotent (IF NOT EXISTS) agar aman untuk DB lama yang dibuat sebelum ada versioning.
+# Statement yang berbeda per backend ditulis sebagai dict {"postgres": ..., "sqlite": ...} (None = dilewati).
+# Tambah migrasi baru di AKHIR list, jangan ubah migrasi yang sudah pernah jalan.
+MIGRATIONS = [
+    (1, "Tabel dasar (scanner, AI, rating, role catalog)", [
+        # Tabel Scanner & AI
+        {
+            "postgres": '''CREATE TABLE IF NOT EXISTS scan_history (id SERIAL PRIMARY KEY, user_id BIGINT NOT NULL, filename TEXT NOT NULL, file_hash TEXT, danger_level INTEGER NOT NULL, analyst TEXT, timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP, channel_id BIGINT);''',
+            "sqlite": '''CREATE TABLE IF NOT EXISTS scan_history (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id BIGINT NOT NULL, filename TEXT NOT NULL, file_hash TEXT, danger_level INTEGER NOT NULL, analyst TEXT, timestamp TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP, channel_id BIGINT);''',
+        },
+        '''CREATE TABLE IF NOT EXISTS daily_usage (user_id BIGINT NOT NULL, date DATE NOT NULL, count INTEGER DEFAULT 0, PRIMARY KEY (user_id, date));''',
+        '''CREATE TABLE IF NOT EXISTS char_story_cooldown (user_id BIGINT PRIMARY KEY, last_used_date DATE NOT NULL);''',
+        '''CREATE TABLE IF NOT EXISTS server_settings (guild_id BIGINT PRIMARY KEY, upload_channel_id BIGINT);''',
+        '''CREATE TABLE IF NOT EXISTS user_permissions (user_id BIGINT PRIMARY KEY, rank TEXT NOT NULL DEFAULT 'beginner');''',
+        '''CREATE TABLE IF NOT EXISTS ai_daily_usage (user_id BIGINT NOT NULL, date DATE NOT NULL, count INTEGER DEFAULT 0, PRIMARY KEY (user_id, date));''',
+        # Tabel Rating
+        '''CREATE TABLE IF NOT EXISTS rating_config (guild_id BIGINT PRIMARY KEY, log_channel_id BIGINT);''',
+        '''
+            CREATE TABLE IF NOT EXISTS ratings (
+                user_id BIGINT NOT NULL,
+                topic TEXT NOT NULL,
+                stars INTEGER NOT NULL,
+                comment TEXT,
+                created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                image_url TEXT,
+                PRIMARY KEY (user_id, topic)
+            );
+        ''',
+        # Tabel Role Catalogs
+        '''
+            CREATE TABLE IF NOT EXISTS role_catalogs (
+                message_id BIGINT PRIMARY KEY,
+                guild_id BIGINT,
+                channel_id BIGINT,
+                config_data TEXT
+            );
+        ''',
+        # Kolom image_url untuk DB lama yang dibuat sebelum kolom ini ada
+        # (SQLite selalu DB baru dengan kolom tersebut, dan tidak mendukung ADD COLUMN IF NOT EXISTS)
+        {"postgres": "ALTER TABLE ratings ADD COLUMN IF NOT EXISTS image_url TEXT;", "sqlite": None},
+    ]),
+    (2, "Index riwayat scan per user & rating per topik", [
+        # !history & !stats: WHERE user_id ORDER BY timestamp DESC / COUNT(*) per user
+        "CREATE INDEX IF NOT EXISTS idx_scan_history_user_ts ON scan_history (user_id, timestamp DESC);",
+        # Daftar ulasan: WHERE topic ORDER BY created_at DESC (PK diawali user_id, tidak terpakai)
+        "CREATE INDEX IF NOT EXISTS idx_ratings_topic_created ON ratings (topic, created_at DESC);",
+    ]),
+    (3, "Agregat rating per topik (rating_stats) + backfill", [
+        '''CREATE TABLE IF NOT EXISTS rating_stats (topic TEXT PRIMARY KEY, sum_stars BIGINT NOT NULL DEFAULT 0, count INTEGER NOT NULL DEFAULT 0);''',
+        '''
+            INSERT INTO rating_stats (topic, sum_stars, count)
+            SELECT topic, SUM(stars), COUNT(*) FROM ratings WHERE TRUE GROUP BY topic
+            ON CONFLICT (topic) DO UPDATE SET sum_stars = EXCLUDED.sum_stars, count = EXCLUDED.count;
+        ''',
+    ]),
+    (4, "Index keyset (topic, created_at, user_id) untuk paginasi ulasan", [
+        "CREATE INDEX IF NOT EXISTS idx_ratings_topic_created_user ON ratings (topic, created_at DESC, user_id DESC);",
+        "DROP INDEX IF EXISTS idx_ratings_topic_created;",
+    ]),
+    (5, "Ringkasan bulanan untuk retensi daily_usage, ai_daily_usage & scan_history", [
+        '''CREATE TABLE IF NOT EXISTS usage_monthly (kind TEXT NOT NULL, user_id BIGINT NOT NULL, month DATE NOT NULL, count BIGINT NOT NULL DEFAULT 0, PRIMARY KEY (kind, user_id, month));''',
+        '''CREATE TABLE IF NOT EXISTS scan_history_monthly (user_id BIGINT NOT NULL, month DATE NOT NULL, scans INTEGER NOT NULL DEFAULT 0, max_danger_level INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (user_id, month));''',
+    ]),
+    (6, "Cache respons AI deterministik (provider, model, hash prompt)", [
+        '''CREATE TABLE IF NOT EXISTS ai_cache (cache_key TEXT PRIMARY KEY, provider TEXT NOT NULL, model TEXT NOT NULL, response TEXT NOT NULL, created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP);''',
+        # Hapus entri kedaluwarsa saat maintenance
+        "CREATE INDEX IF NOT EXISTS idx_ai_cache_created ON ai_cache (created_at);",
+    ]),
+    (7, "Verdict scan persisten per sha256 file + versi rule-set", [
+        "CREATE TABLE IF NOT EXISTS scan_verdicts (verdict_key TEXT PRIMARY KEY, file_hash TEXT NOT NULL, rules_version TEXT NOT NULL, verdict TEXT NOT NULL, created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP);",
+        "CREATE INDEX IF NOT EXISTS idx_scan_verdicts_created ON scan_verdicts (created_at);",
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def _current_schema_version(cur):
+    if not get_pool().table_exists(cur, "schema_version"): return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cur.fetchone()[0]
+
+def _init_database(cur):
+    # Jalur cepat saat boot: skema sudah terbaru -> tidak ada DDL sama sekali
+    if _current_schema_version(cur) >= SCHEMA_VERSION:
+        return []
+
+    applied = []
+    with _transaction(cur):
+        get_pool().lock_migrations(cur)
+        cur.execute('''CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, description TEXT, applied_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP);''')
+        current = _current_schema_version(cur)
+        for version, description, statements in MIGRATIONS:
+            if version <= current: continue
+            for statement in statements:
+                if isinstance(statement, dict):
+                    statement = statement[_dialect()]
+                    if statement is None: continue
+                cur.execute(statement)
+            cur.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)", (version, description))
+            applied.append(version)
+    return applied
+
+def init_database():
+    """Menjalankan migrasi skema yang belum diterapkan."""
+    applied = _run(_init_database, (), None)
+    if applied is None: return
+    if applied:
+        logger.info(f"✅ Migrasi database diterapkan: {applied} (versi skema {SCHEMA_VERSION}).")
+    else:
+        logger.info(f"✅ Skema database sudah terbaru (versi {SCHEMA_VERSION}).")
+
+# =================================================================
+# QUERY (dipakai versi sync & async)
+# =================================================================
+
+def _set_upload_channel(cur, guild_id, channel_id):
+    cur.execute("INSERT INTO server_settings (guild_id, upload_channel_id) VALUES (%s, %s) ON CONFLICT (guild_id) DO UPDATE SET upload_channel_id = EXCLUDED.upload_channel_id", (guild_id, channel_id))
+    return True
+
+def _get_upload_channel(cur, guild_id):
+    cur.execute('SELECT upload_channel_id FROM server_settings WHERE guild_id = %s', (guild_id,))
+    res = cur.fetchone()
+    return res[0] if res else None
+
+def _check_daily_limit(cur, user_id, limit):
+    today = date.today()
+    cur.execute('SELECT count FROM daily_usage WHERE user_id = %s AND date = %s', (user_id, today))
+    res = cur.fetchone()
+    # Tambahkan pemakaian yang masih di buffer write-behind
+    pending = _writer.pending_usage(user_id, today)
+    count = (res[0] if res else 0) + pending
+    return not ((res or pending) and count >= limit)
+
+def _get_scan_history(cur, user_id, limit):
+    cur.execute("SELECT filename, danger_level, timestamp FROM scan_history WHERE user_id = %s ORDER BY timestamp DESC LIMIT %s", (user_id, limit))
+    return cur.fetchall()
+
+def _count_user_scans(cur, user_id):
+    # Scan lama yang sudah di-rollup oleh maintenance tetap dihitung lewat scan_history_monthly
+    cur.execute("""
+        SELECT (SELECT COUNT(*) FROM scan_history WHERE user_id = %s)
+             + (SELECT COALESCE(SUM(scans), 0) FROM scan_history_monthly WHERE user_id = %s)
+    """, (user_id, user_id))
+    res = cur.fetchone()
+    return int(res[0]) if res else 0
+
+def _get_user_rank(cur, user_id):
+    cur.execute('SELECT rank FROM user_permissions WHERE user_id = %s', (user_id,))
+    res = cur.fetchone()
+    if not res:
+        _set_user_rank(cur, user_id, 'beginner'); return 'beginner'
+    return res[0].lower()
+
+def _set_user_rank(cur, user_id, rank):
+    cur.execute("INSERT INTO user_permissions (user_id, rank) VALUES (%s, %s) ON CONFLICT (user_id) DO UPDATE SET rank = EXCLUDED.rank", (user_id, rank.lower()))
+    return True
+
+# Limit harian user = RANK_LIMITS[rank], di-join langsung di SQL (user tanpa baris / rank tak dikenal -> beginner)
+# (UNION ALL, bukan VALUES ... AS r(a, b), agar sama di Postgres & SQLite)
+_RANK_LIMIT_SQL = f"""
+    SELECT COALESCE(
+        (SELECT r.daily_limit FROM user_permissions p
+         JOIN ({" UNION ALL ".join(["SELECT %s AS rank, %s AS daily_limit"] + ["SELECT %s, %s"] * (len(RANK_LIMITS) - 1))}) AS r ON r.rank = LOWER(p.rank)
+         WHERE p.user_id = %s),
+        %s) AS daily_limit
+"""
+
+def _rank_limit_params(user_id):
+    return tuple(x for item in RANK_LIMITS.items() for x in item) + (user_id, RANK_LIMITS["beginner"])
+
+def _check_ai_limit(cur, user_id):
+    """Hanya membaca (tidak memakai kuota). Satu round trip."""
+    cur.execute(f"""
+        SELECT lim.daily_limit, COALESCE(u.count, 0)
+        FROM ({_RANK_LIMIT_SQL}) AS lim
+        LEFT JOIN ai_daily_usage u ON u.user_id = %s AND u.date = %s
+    """, _rank_limit_params(user_id) + (user_id, date.today()))
+    limit, curr = cur.fetchone()
+    if limit == -1: return (True, 999, -1)
+    return (curr < limit, limit - curr, limit)
+
+def _reserve_ai_quota(cur, user_id):
+    """Cek limit + tambah pemakaian secara atomik dalam SATU statement."""
+    if _dialect() == "sqlite":
+        return _reserve_ai_quota_sqlite(cur, user_id)
+    cur.execute(f"""
+        WITH lim AS ({_RANK_LIMIT_SQL}),
+        upd AS (
+            INSERT INTO ai_daily_usage (user_id, date, count)
+            SELECT %s, %s, 1 FROM lim WHERE lim.daily_limit <> 0
+            ON CONFLICT (user_id, date) DO UPDATE SET count = ai_daily_usage.count + 1
+            WHERE (SELECT daily_limit FROM lim) = -1 OR ai_daily_usage.count < (SELECT daily_limit FROM lim)
+            RETURNING count
+        )
+        SELECT lim.daily_limit, upd.count FROM lim LEFT JOIN upd ON TRUE
+    """, _rank_limit_params(user_id) + (user_id, date.today()))
+    limit, used = cur.fetchone()
+    if used is None: return (False, 0, limit)
+    if limit == -1: return (True, 999, -1)
+    return (True, limit - used, limit)
+
+def _reserve_ai_quota_sqlite(cur, user_id):
+    # SQLite tidak mendukung INSERT di dalam CTE; cukup dua statement dalam satu transaksi
+    # karena penulis SQLite selalu serial.
+    with _transaction(cur):
+        cur.execute(_RANK_LIMIT_SQL, _rank_limit_params(user_id))
+        limit = cur.fetchone()[0]
+        if limit == 0: return (False, 0, limit)
+        cur.execute("""
+            INSERT INTO ai_daily_usage (user_id, date, count) VALUES (%s, %s, 1)
+            ON CONFLICT (user_id, date) DO UPDATE SET count = ai_daily_usage.count + 1
+            WHERE %s = -1 OR ai_daily_usage.count < %s
+            RETURNING count
+        """, (user_id, date.today(), limit, limit))
+        res = cur.fetchone()
+    if res is None: return (False, 0, limit)
+    if limit == -1: return (True, 999, -1)
+    return (True, limit - res[0], limit)
+
+def _refund_ai_quota(cur, user_id):
+    cur.execute("UPDATE ai_daily_usage SET count = count - 1 WHERE user_id = %s AND date = %s AND count > 0", (user_id, date.today()))
+    return True
+
+def _set_rating_log_channel(cur, guild_id, channel_id):
+    cur.execute("INSERT INTO rating_config (guild_id, log_channel_id) VALUES (%s, %s) ON CONFLICT (guild_id) DO UPDATE SET log_channel_id = EXCLUDED.log_channel_id", (guild_id, channel_id))
+    return True
+
+def _get_rating_log_channel(cur, guild_id):
+    cur.execute("SELECT log_channel_id FROM rating_config WHERE guild_id = %s", (guild_id,))
+    res = cur.fetchone()
+    return res[0] if res else None
+
+def _add_rating(cur, user_id, topic, stars, comment, image_url=None):
+    with _transaction(cur):
+        # Kunci baris agregat topik dulu supaya rating bersamaan untuk topik yang sama berurutan
+        cur.execute("INSERT INTO rating_stats (topic) VALUES (%s) ON CONFLICT (topic) DO NOTHING", (topic,))
+        cur.execute("SELECT 1 FROM rating_stats WHERE topic = %s FOR UPDATE", (topic,))
+        cur.execute("SELECT stars FROM ratings WHERE user_id = %s AND topic = %s", (user_id, topic))
+        old = cur.fetchone()
+
+        # Jika image_url None, jangan timpa gambar lama jika sudah ada
+        cur.execute("""
+            INSERT INTO ratings (user_id, topic, stars, comment, image_url, created_at)
+            VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id, topic)
+            DO UPDATE SET stars = EXCLUDED.stars, comment = EXCLUDED.comment, image_url = COALESCE(EXCLUDED.image_url, ratings.image_url), created_at = CURRENT_TIMESTAMP;
+        """, (user_id, topic, stars, comment, image_url))
+
+        # Rating ulang: hanya selisih bintang; rating baru: tambah bintang & count
+        if old:
+            delta_sum, delta_count = stars - old[0], 0
+        else:
+            delta_sum, delta_count = stars, 1
+        cur.execute("UPDATE rating_stats SET sum_stars = sum_stars + %s, count = count + %s WHERE topic = %s", (delta_sum, delta_count, topic))
+    return True
+
+def _update_rating_image(cur, user_id, topic, image_url):
+    cur.execute("""
+        UPDATE ratings SET image_url = %s WHERE user_id = %s AND topic = %s
+    """, (image_url, user_id, topic))
+    return True
+
+def _get_rating_stats(cur, topic):
+    # Lookup primary key di tabel agregat (dijaga oleh _add_rating), bukan AVG/COUNT seluruh ratings
+    cur.execute("SELECT sum_stars, count FROM rating_stats WHERE topic = %s", (topic,))
+    res = cur.fetchone()
+    if res and res[1] > 0:
+        return round(res[0] / res[1], 2), res[1]
+    return 0.0, 0
+
+def _get_all_ratings(cur, topic):
+    cur.execute("SELECT user_id, stars, comment, created_at, image_url FROM ratings WHERE topic = %s ORDER BY created_at DESC", (topic,))
+    return cur.fetchall()
+
+def _get_ratings_page(cur, topic, limit, cursor, newer):
+    """Satu halaman ulasan (keyset pada created_at, user_id), urut terbaru dulu.
+    cursor=None -> halaman pertama. newer=False -> lebih lama dari cursor, True -> lebih baru.
+    Return (rows, has_more) di mana has_more = masih ada baris di arah yang diminta."""
+    cols = "user_id, stars, comment, created_at, image_url"
+    if cursor is None:
+        cur.execute(f"SELECT {cols} FROM ratings WHERE topic = %s ORDER BY created_at DESC, user_id DESC LIMIT %s", (topic, limit + 1))
+    elif not newer:
+        cur.execute(f"SELECT {cols} FROM ratings WHERE topic = %s AND (created_at, user_id) < (%s, %s) ORDER BY created_at DESC, user_id DESC LIMIT %s", (topic, cursor[0], cursor[1], limit + 1))
+    else:
+        cur.execute(f"SELECT {cols} FROM ratings WHERE topic = %s AND (created_at, user_id) > (%s, %s) ORDER BY created_at ASC, user_id ASC LIMIT %s", (topic, cursor[0], cursor[1], limit + 1))
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if newer and cursor is not None:
+        rows.reverse()
+    return rows, has_more
 
-# --- FUNGSI PENDUKUNG LAINNYA ---
+def _save_catalog_config(cur, message_id, guild_id, channel_id, config_data):
+    # Ubah dict ke JSON string sebelum simpan
+    data_str = json.dumps(config_data)
+    cur.execute("""
+        INSERT INTO role_catalogs (message_id, guild_id, channel_id, config_data)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (message_id) DO UPDATE SET config_data = EXCLUDED.config_data
+    """, (message_id, guild_id, channel_id, data_str))
+    return True
+
+def _get_catalog_config(cur, message_id):
+    cur.execute("SELECT config_data FROM role_catalogs WHERE message_id = %s", (message_id,))
+    res = cur.fetchone()
+    if res:
+        return json.loads(res[0])
+    return None
+
+def _ai_cache_cutoff(ttl_days):
+    return datetime.now(timezone.utc) - timedelta(days=ttl_days)
+
+def _get_ai_cache(cur, cache_keys, ttl_days):
+    placeholders = ", ".join(["%s"] * len(cache_keys))
+    cur.execute(
+        f"SELECT cache_key, response FROM ai_cache WHERE cache_key IN ({placeholders}) AND created_at >= %s",
+        (*cache_keys, _ai_cache_cutoff(ttl_days))
+    )
+    return dict(cur.fetchall())
+
+def _put_ai_cache(cur, cache_key, provider, model, response):
+    cur.execute("""
+        INSERT INTO ai_cache (cache_key, provider, model, response, created_at) VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (cache_key) DO UPDATE SET response = EXCLUDED.response, created_at = EXCLUDED.created_at
+    """, (cache_key, provider, model, response))
+    return True
+
+def _get_scan_verdicts(cur, verdict_keys, ttl_days):
+    placeholders = ", ".join(["%s"] * len(verdict_keys))
+    cur.execute(
+        f"SELECT verdict_key, verdict FROM scan_verdicts WHERE verdict_key IN ({placeholders}) AND created_at >= %s",
+        (*verdict_keys, _ai_cache_cutoff(ttl_days))
+    )
+    return dict(cur.fetchall())
+
+def _put_scan_verdict(cur, verdict_key, file_hash, rules_version, verdict):
+    cur.execute("""
+        INSERT INTO scan_verdicts (verdict_key, file_hash, rules_version, verdict, created_at) VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (verdict_key) DO UPDATE SET verdict = EXCLUDED.verdict, created_at = EXCLUDED.created_at
+    """, (verdict_key, file_hash, rules_version, verdict))
+    return True
+
+def _clear_scan_verdicts(cur):
+    cur.execute("DELETE FROM scan_verdicts")
+    return cur.rowcount
+
+# --- Maintenance: rollup bulanan + hapus baris lama agar tabel "panas" tetap kecil ---
+DB_USAGE_RETENTION_DAYS = int(os.getenv("DB_USAGE_RETENTION_DAYS", "35"))
+DB_SCAN_RETENTION_DAYS = int(os.getenv("DB_SCAN_RETENTION_DAYS", "90"))
+
+def _month_sql(column):
+    if _dialect() == "sqlite":
+        return f"date({column}, 'start of month')"
+    return f"CAST(date_trunc('month', {column}) AS DATE)"
+
+def _run_maintenance(cur, usage_days, scan_days):
+    """Rollup baris harian yang lebih tua dari retensi ke tabel bulanan, lalu hapus. Return jumlah baris dihapus per tabel."""
+    greatest = "MAX" if _dialect() == "sqlite" else "GREATEST"
+    usage_cutoff = date.today() - timedelta(days=max(usage_days, 1))
+    scan_cutoff = date.today() - timedelta(days=max(scan_days, 1))
+    reclaimed = {}
+
+    for table in ("daily_usage", "ai_daily_usage"):
+        month = _month_sql("date")
+        with _transaction(cur):
+            cur.execute(f"""
+                INSERT INTO usage_monthly (kind, user_id, month, count)
+                SELECT %s, user_id, {month}, SUM(count) FROM {table} WHERE date < %s GROUP BY user_id, {month}
+                ON CONFLICT (kind, user_id, month) DO UPDATE SET count = usage_monthly.count + EXCLUDED.count
+            """, (table, usage_cutoff))
+            cur.execute(f"DELETE FROM {table} WHERE date < %s", (usage_cutoff,))
+            reclaimed[table] = cur.rowcount
+
+    month = _month_sql("timestamp")
+    with _transaction(cur):
+        cur.execute(f"""
+            INSERT INTO scan_history_monthly (user_id, month, scans, max_danger_level)
+            SELECT user_id, {month}, COUNT(*), MAX(danger_level) FROM scan_history WHERE timestamp < %s GROUP BY user_id, {month}
+            ON CONFLICT (user_id, month) DO UPDATE SET
+                scans = scan_history_monthly.scans + EXCLUDED.scans,
+                max_danger_level = {greatest}(scan_history_monthly.max_danger_level, EXCLUDED.max_danger_level)
+        """, (scan_cutoff,))
+        cur.execute("DELETE FROM scan_history WHERE timestamp < %s", (scan_cutoff,))
+        reclaimed["scan_history"] = cur.rowcount
+
+    cur.execute("DELETE FROM ai_cache WHERE created_at < %s", (_ai_cache_cutoff(AI_CACHE_TTL_DAYS),))
+    reclaimed["ai_cache"] = cur.rowcount
+    cur.execute("DELETE FROM scan_verdicts WHERE created_at < %s", (_ai_cache_cutoff(SCAN_VERDICT_TTL_DAYS),))
+    reclaimed["scan_verdicts"] = cur.rowcount
+    return reclaimed
+
+# =================================================================
+# FUNGSI PENDUKUNG (SYNC) - wrapper tipis selama migrasi ke versi async
+# =================================================================
 
 def set_upload_channel(guild_id, channel_id):
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO server_settings (guild_id, upload_channel_id) VALUES (%s, %s) ON CONFLICT (guild_id) DO UPDATE SET upload_channel_id = EXCLUDED.upload_channel_id", (guild_id, channel_id))
-        conn.commit(); return True
-    except: conn.rollback(); return False
+    ok = _run(_set_upload_channel, (guild_id, channel_id), False)
+    if ok: _upload_channel_cache.invalidate(guild_id)
+    return ok
 
 def get_upload_channel(guild_id):
-    conn = get_db_connection()
-    if not conn: return None
-    try:
-        with conn.cursor() as cur:
-            cur.execute('SELECT upload_channel_id FROM server_settings WHERE guild_id = %s', (guild_id,))
-            res = cur.fetchone()
-        return res[0] if res else None
-    except: return None
+    return _cached(_upload_channel_cache, guild_id, _get_upload_channel, (guild_id,), None)
 
 def check_daily_limit(user_id, limit):
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        with conn.cursor() as cur:
-            cur.execute('SELECT count FROM daily_usage WHERE user_id = %s AND date = %s', (user_id, date.today()))
-            res = cur.fetchone()
-        return not (res and res[0] >= limit)
-    except: return False
+    return _run(_check_daily_limit, (user_id, limit), False)
 
 def increment_daily_usage(user_id):
-    conn = get_db_connection()
-    if not conn: return
-    try:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO daily_usage (user_id, date, count) VALUES (%s, %s, 1) ON CONFLICT (user_id, date) DO UPDATE SET count = daily_usage.count + 1", (user_id, date.today()))
-        conn.commit()
-    except: conn.rollback()
+    _writer.add_usage(user_id, date.today())
 
 def save_scan_history(user_id, filename, file_hash, danger_level, analyst, channel_id):
-    conn = get_db_connection()
-    if not conn: return
-    try:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO scan_history (user_id, filename, file_hash, danger_level, analyst, channel_id) VALUES (%s, %s, %s, %s, %s, %s)", (user_id, filename, file_hash, danger_level, analyst, channel_id))
-        conn.commit()
-    except: conn.rollback()
+    _writer.add_scan((user_id, filename, file_hash, danger_level, analyst, channel_id))
+
+def get_scan_history(user_id, limit):
+    _writer.flush()
+    return _run(_get_scan_history, (user_id, limit), None)
+
+def count_user_scans(user_id):
+    _writer.flush()
+    return _run(_count_user_scans, (user_id,), None)
 
 def get_user_rank(user_id):
-    conn = get_db_connection()
-    if not conn: return 'beginner'
-    try:
-        with conn.cursor() as cur:
-            cur.execute('SELECT rank FROM user_permissions WHERE user_id = %s', (user_id,))
-            res = cur.fetchone()
-        if not res: 
-            set_user_rank(user_id, 'beginner'); return 'beginner'
-        return res[0].lower()
-    except: return 'beginner'
+    return _cached(_rank_cache, user_id, _get_user_rank, (user_id,), 'beginner')
 
 def set_user_rank(user_id, rank):
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO user_permissions (user_id, rank) VALUES (%s, %s) ON CONFLICT (user_id) DO UPDATE SET rank = EXCLUDED.rank", (user_id, rank.lower()))
-        conn.commit(); return True
-    except: conn.rollback(); return False
+    ok = _run(_set_user_rank, (user_id, rank), False)
+    if ok: _rank_cache.invalidate(user_id)
+    return ok
 
 def check_ai_limit(user_id):
-    conn = get_db_connection()
-    if not conn: return (False, 0, 0)
-    try:
-        rank = get_user_rank(user_id)
-        limit = RANK_LIMITS.get(rank, 5)
-        if limit == -1: return (True, 999, -1)
-        with conn.cursor() as cur:
-            cur.execute('SELECT count FROM ai_daily_usage WHERE user_id = %s AND date = %s', (user_id, date.today()))
-            res = cur.fetchone()
-        curr = res[0] if res else 0
-        return (curr < limit, limit - curr, limit)
-    except: return (False, 0, 0)
-
-def increment_ai_usage(user_id):
-    conn = get_db_connection()
-    if not conn: return
-    try:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO ai_daily_usage (user_id, date, count) VALUES (%s, %s, 1) ON CONFLICT (user_id, date) DO UPDATE SET count = ai_daily_usage.count + 1", (user_id, date.today()))
-        conn.commit()
-    except: conn.rollback()
+    return _run(_check_ai_limit, (user_id,), (False, 0, 0))
+
+def reserve_ai_quota(user_id):
+    """Memakai 1 kuota AI jika masih ada. Return (allowed, remaining, limit)."""
+    return _run(_reserve_ai_quota, (user_id,), (False, 0, 0))
+
+def refund_ai_quota(user_id):
+    """Mengembalikan 1 kuota AI (dipakai jika semua provider AI gagal)."""
+    return _run(_refund_ai_quota, (user_id,), False)
+
+def run_maintenance(usage_days=None, scan_days=None):
+    """Retensi + rollup bulanan. Return {tabel: baris_dihapus} atau None jika DB error."""
+    _writer.flush()
+    return _run(_run_maintenance, (usage_days or DB_USAGE_RETENTION_DAYS, scan_days or DB_SCAN_RETENTION_DAYS), None)
+
+# =================================================================
+# CACHE RESPONS AI (LRU memori + tabel ai_cache dengan TTL)
+# =================================================================
+
+def _ai_cache_lookup_memory(cache_keys):
+    found, missing = {}, []
+    for key in cache_keys:
+        value = _ai_response_cache.get(key)
+        if value is _MISS: missing.append(key)
+        else: found[key] = value
+    return found, missing
+
+def get_ai_cached_responses(cache_keys):
+    """Return {cache_key: teks respons} untuk key yang ada di cache (memori lalu DB)."""
+    found, missing = _ai_cache_lookup_memory(cache_keys)
+    if missing:
+        rows = _run(_get_ai_cache, (missing, AI_CACHE_TTL_DAYS), {})
+        for key, response in rows.items(): _ai_response_cache.put(key, response)
+        found.update(rows)
+    return found
 
+def put_ai_cached_response(cache_key, provider, model, response):
+    _ai_response_cache.put(cache_key, response)
+    return _run(_put_ai_cache, (cache_key, provider, model, response), False)
+
+# =================================================================
+# VERDICT SCAN (LRU memori berbatas byte + tabel scan_verdicts dengan TTL)
+# =================================================================
+# Key "<sha256>:<mode AI>:<versi rule-set>" -> {"issues", "summary", "analyst", "results"}.
+# Versi rule-set ikut di key, jadi verdict lama otomatis tidak terpakai saat pola/prompt berubah.
+
+def _scan_verdict_lookup_memory(verdict_keys):
+    found, missing = {}, []
+    for key in verdict_keys:
+        value = _scan_verdict_cache.get(key)
+        if value is _MISS: missing.append(key)
+        else: found[key] = value
+    return found, missing
+
+def _load_scan_verdicts(rows):
+    """Decode JSON dari DB lalu isi tier memori."""
+    verdicts = {}
+    for key, raw in rows.items():
+        try:
+            verdicts[key] = json.loads(raw)
+        except ValueError:
+            continue
+        _scan_verdict_cache.put(key, verdicts[key], size=len(raw))
+    return verdicts
+
+def _encode_scan_verdict(verdict_key, verdict, persist):
+    """Simpan ke tier memori. Return JSON untuk DB, atau None jika tidak perlu/terlalu besar untuk dipersist."""
+    raw = json.dumps(verdict, ensure_ascii=False)
+    _scan_verdict_cache.put(verdict_key, verdict, size=len(raw))
+    if not persist or len(raw) > SCAN_VERDICT_MAX_ENTRY_KB * 1024: return None
+    return raw
+
+def get_scan_verdicts(verdict_keys):
+    """Return {verdict_key: verdict} untuk key yang ada di cache (memori lalu DB)."""
+    found, missing = _scan_verdict_lookup_memory(verdict_keys)
+    if missing:
+        found.update(_load_scan_verdicts(_run(_get_scan_verdicts, (missing, SCAN_VERDICT_TTL_DAYS), {})))
+    return found
+
+def put_scan_verdict(verdict_key, file_hash, rules_version, verdict, persist=True):
+    raw = _encode_scan_verdict(verdict_key, verdict, persist)
+    if raw is None: return False
+    return _run(_put_scan_verdict, (verdict_key, file_hash, rules_version, raw), False)
+
+def clear_scan_verdicts(persistent=False):
+    """Kosongkan tier memori (dan tabel scan_verdicts jika persistent). Return (entri memori, baris DB)."""
+    rows = _run(_clear_scan_verdicts, (), 0) if persistent else 0
+    return _scan_verdict_cache.clear(), rows
 
 # =================================================================
 # FUNGSI RATING
 # =================================================================
 
 def set_rating_log_channel(guild_id, channel_id):
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO rating_config (guild_id, log_channel_id) VALUES (%s, %s) ON CONFLICT (guild_id) DO UPDATE SET log_channel_id = EXCLUDED.log_channel_id", (guild_id, channel_id))
-        conn.commit(); return True
-    except: conn.rollback(); return False
+    ok = _run(_set_rating_log_channel, (guild_id, channel_id), False)
+    if ok: _rating_log_cache.invalidate(guild_id)
+    return ok
 
 def get_rating_log_channel(guild_id):
-    conn = get_db_connection()
-    if not conn: return None
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT log_channel_id FROM rating_config WHERE guild_id = %s", (guild_id,))
-            res = cur.fetchone()
-        return res[0] if res else None
-    except: return None
+    return _cached(_rating_log_cache, guild_id, _get_rating_log_channel, (guild_id,), None)
 
 def add_rating(user_id, topic, stars, comment, image_url=None):
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        with conn.cursor() as cur:
-            # Jika image_url None, jangan timpa gambar lama jika sudah ada
-            cur.execute("""
-                INSERT INTO ratings (user_id, topic, stars, comment, image_url, created_at)
-                VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                ON CONFLICT (user_id, topic) 
-                DO UPDATE SET stars = EXCLUDED.stars, comment = EXCLUDED.comment, image_url = COALESCE(EXCLUDED.image_url, ratings.image_url), created_at = CURRENT_TIMESTAMP;
-            """, (user_id, topic, stars, comment, image_url))
-        conn.commit()
-        return True
-    except: conn.rollback(); return False
+    return _run(_add_rating, (user_id, topic, stars, comment, image_url), False)
 
 def update_rating_image(user_id, topic, image_url):
     """Update URL gambar untuk rating yang sudah ada."""
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE ratings SET image_url = %s WHERE user_id = %s AND topic = %s
-            """, (image_url, user_id, topic))
-        conn.commit()
-        return True
-    except Exception as e:
-        logger.error(f"Gagal update rating image: {e}")
-        conn.rollback(); return False
+    return _run(_update_rating_image, (user_id, topic, image_url), False)
 
 def get_rating_stats(topic):
-    conn = get_db_connection()
-    if not conn: return 0.0, 0
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT AVG(stars), COUNT(*) FROM ratings WHERE topic = %s", (topic,))
-            res = cur.fetchone()
-            if res and res[0] is not None:
-                return round(float(res[0]), 2), res[1]
-            return 0.0, 0
-    except: return 0.0, 0
+    return _run(_get_rating_stats, (topic,), (0.0, 0))
 
 def get_all_ratings(topic):
     """Mengambil daftar ulasan untuk topik tertentu."""
-    conn = get_db_connection()
-    if not conn: return []
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT user_id, stars, comment, created_at, image_url FROM ratings WHERE topic = %s ORDER BY created_at DESC", (topic,))
-            return cur.fetchall()
-    except Exception as e:
-        logger.error(f"Gagal get_all_ratings: {e}")
-        return []
+    return _run(_get_all_ratings, (topic,), [])
+
+def get_ratings_page(topic, limit, cursor=None, newer=False):
+    """Halaman ulasan berbasis cursor (created_at, user_id). Return (rows, has_more)."""
+    return _run(_get_ratings_page, (topic, limit, cursor, newer), ([], False))
 
 # =================================================================
 # FUNGSI ROLE CATALOG (BARU)
@@ -265,35 +985,117 @@ def get_all_ratings(topic):
 
 def save_catalog_config(message_id, guild_id, channel_id, config_data):
     """Menyimpan konfigurasi katalog role baru."""
-    conn = get_db_connection()
-    if not conn: return False
-    try:
-        # Ubah dict ke JSON string sebelum simpan
-        data_str = json.dumps(config_data)
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO role_catalogs (message_id, guild_id, channel_id, config_data)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (message_id) DO UPDATE SET config_data = EXCLUDED.config_data
-            """, (message_id, guild_id, channel_id, data_str))
-        conn.commit()
-        return True
-    except Exception as e:
-        logger.error(f"Gagal save catalog: {e}")
-        conn.rollback()
-        return False
+    return _run(_save_catalog_config, (message_id, guild_id, channel_id, config_data), False)
 
 def get_catalog_config(message_id):
     """Mengambil konfigurasi katalog berdasarkan ID pesan."""
-    conn = get_db_connection()
-    if not conn: return None
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT config_data FROM role_catalogs WHERE message_id = %s", (message_id,))
-            res = cur.fetchone()
-        if res:
-            return json.loads(res[0])
-        return None
-    except Exception as e:
-        logger.error(f"Gagal get catalog: {e}")
-        return None
+    return _run(_get_catalog_config, (message_id,), None)
+
+# =================================================================
+# VERSI ASYNC (dipakai oleh cogs, tidak memblokir event loop)
+# =================================================================
+
+async def set_upload_channel_async(guild_id, channel_id):
+    ok = await _run_async(_set_upload_channel, (guild_id, channel_id), False)
+    if ok: _upload_channel_cache.invalidate(guild_id)
+    return ok
+
+async def get_upload_channel_async(guild_id):
+    return await _cached_async(_upload_channel_cache, guild_id, _get_upload_channel, (guild_id,), None)
+
+async def check_daily_limit_async(user_id, limit):
+    return await _run_async(_check_daily_limit, (user_id, limit), False)
+
+async def increment_daily_usage_async(user_id):
+    _writer.add_usage(user_id, date.today())
+
+async def save_scan_history_async(user_id, filename, file_hash, danger_level, analyst, channel_id):
+    """Masuk buffer write-behind, tidak menunggu DB."""
+    _writer.add_scan((user_id, filename, file_hash, danger_level, analyst, channel_id))
+
+async def get_scan_history_async(user_id, limit):
+    """Riwayat scan terbaru milik user. None jika DB error."""
+    await flush_pending_writes_async()
+    return await _run_async(_get_scan_history, (user_id, limit), None)
+
+async def count_user_scans_async(user_id):
+    """Total scan milik user. None jika DB error."""
+    await flush_pending_writes_async()
+    return await _run_async(_count_user_scans, (user_id,), None)
+
+async def get_user_rank_async(user_id):
+    return await _cached_async(_rank_cache, user_id, _get_user_rank, (user_id,), 'beginner')
+
+async def set_user_rank_async(user_id, rank):
+    ok = await _run_async(_set_user_rank, (user_id, rank), False)
+    if ok: _rank_cache.invalidate(user_id)
+    return ok
+
+async def check_ai_limit_async(user_id):
+    return await _run_async(_check_ai_limit, (user_id,), (False, 0, 0))
+
+async def reserve_ai_quota_async(user_id):
+    return await _run_async(_reserve_ai_quota, (user_id,), (False, 0, 0))
+
+async def refund_ai_quota_async(user_id):
+    return await _run_async(_refund_ai_quota, (user_id,), False)
+
+async def run_maintenance_async(usage_days=None, scan_days=None):
+    await flush_pending_writes_async()
+    return await _run_async(_run_maintenance, (usage_days or DB_USAGE_RETENTION_DAYS, scan_days or DB_SCAN_RETENTION_DAYS), None)
+
+async def get_ai_cached_responses_async(cache_keys):
+    found, missing = _ai_cache_lookup_memory(cache_keys)
+    if missing:
+        rows = await _run_async(_get_ai_cache, (missing, AI_CACHE_TTL_DAYS), {})
+        for key, response in rows.items(): _ai_response_cache.put(key, response)
+        found.update(rows)
+    return found
+
+async def put_ai_cached_response_async(cache_key, provider, model, response):
+    _ai_response_cache.put(cache_key, response)
+    return await _run_async(_put_ai_cache, (cache_key, provider, model, response), False)
+
+async def get_scan_verdicts_async(verdict_keys):
+    found, missing = _scan_verdict_lookup_memory(verdict_keys)
+    if missing:
+        found.update(_load_scan_verdicts(await _run_async(_get_scan_verdicts, (missing, SCAN_VERDICT_TTL_DAYS), {})))
+    return found
+
+async def put_scan_verdict_async(verdict_key, file_hash, rules_version, verdict, persist=True):
+    raw = _encode_scan_verdict(verdict_key, verdict, persist)
+    if raw is None: return False
+    return await _run_async(_put_scan_verdict, (verdict_key, file_hash, rules_version, raw), False)
+
+async def clear_scan_verdicts_async(persistent=False):
+    rows = await _run_async(_clear_scan_verdicts, (), 0) if persistent else 0
+    return _scan_verdict_cache.clear(), rows
+
+async def set_rating_log_channel_async(guild_id, channel_id):
+    ok = await _run_async(_set_rating_log_channel, (guild_id, channel_id), False)
+    if ok: _rating_log_cache.invalidate(guild_id)
+    return ok
+
+async def get_rating_log_channel_async(guild_id):
+    return await _cached_async(_rating_log_cache, guild_id, _get_rating_log_channel, (guild_id,), None)
+
+async def add_rating_async(user_id, topic, stars, comment, image_url=None):
+    return await _run_async(_add_rating, (user_id, topic, stars, comment, image_url), False)
+
+async def update_rating_image_async(user_id, topic, image_url):
+    return await _run_async(_update_rating_image, (user_id, topic, image_url), False)
+
+async def get_rating_stats_async(topic):
+    return await _run_async(_get_rating_stats, (topic,), (0.0, 0))
+
+async def get_all_ratings_async(topic):
+    return await _run_async(_get_all_ratings, (topic,), [])
+
+async def get_ratings_page_async(topic, limit, cursor=None, newer=False):
+    return await _run_async(_get_ratings_page, (topic, limit, cursor, newer), ([], False))
+
+async def save_catalog_config_async(message_id, guild_id, channel_id, config_data):
+    return await _run_async(_save_catalog_config, (message_id, guild_id, channel_id, config_data), False)
+
+async def get_catalog_config_async(message_id):
+    return await _run_async(_get_catalog_config, (message_id,), None)
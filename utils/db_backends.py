@@ -0,0 +1,240 @@
+import os
+import re
+import time
+import queue
+import sqlite3
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# =================================================================
+# BACKEND STORAGE untuk utils.database
+# =================================================================
+# Setiap backend menyediakan: acquire/release koneksi, cursor(conn), close(),
+# executor (thread khusus DB), dialect, is_connection_error(e),
+# table_exists(cur, name), lock_migrations(cur) dan insert_values(cur, sql, rows).
+# Query di utils.database ditulis dengan placeholder %s (gaya psycopg2).
+
+class PostgresBackend:
+    """Pool koneksi PostgreSQL (min/max) dengan timeout acquire dan health check."""
+    dialect = "postgres"
+
+    def __init__(self, dsn: str, minconn: int, maxconn: int, acquire_timeout: float, healthcheck_idle: float):
+        # psycopg2 hanya di-import jika backend Postgres dipakai
+        import psycopg2
+        from psycopg2 import pool as pg_pool
+        from psycopg2.extras import execute_values
+        self._psycopg2 = psycopg2
+        self._execute_values = execute_values
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, dsn)
+        # ThreadedConnectionPool langsung error jika habis, semaphore ini membuat caller menunggu
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used: dict = {}
+        self.acquire_timeout = acquire_timeout
+        self.healthcheck_idle = healthcheck_idle
+        self.maxconn = maxconn
+        self.executor = ThreadPoolExecutor(max_workers=maxconn, thread_name_prefix="db")
+
+    def _is_healthy(self, conn) -> bool:
+        """Koneksi yang lama menganggur di-ping dulu sebelum dipakai."""
+        if conn.closed != 0:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0) < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f"Tidak ada koneksi DB tersedia dalam {self.acquire_timeout} detik")
+        try:
+            conn = self._pool.getconn()
+            if conn.closed == 0 and not conn.autocommit:
+                conn.autocommit = True
+            if not self._is_healthy(conn):
+                self._last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+                conn.autocommit = True
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken: bool = False):
+        try:
+            if broken or conn.closed != 0:
+                self._last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    def cursor(self, conn):
+        return conn.cursor()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self._pool.closeall()
+
+    def is_connection_error(self, e: Exception) -> bool:
+        return isinstance(e, (self._psycopg2.OperationalError, self._psycopg2.InterfaceError))
+
+    def table_exists(self, cur, name: str) -> bool:
+        cur.execute("SELECT to_regclass(%s)", (name,))
+        return cur.fetchone()[0] is not None
+
+    def lock_migrations(self, cur):
+        # Kunci agar dua instance bot tidak menjalankan migrasi bersamaan
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('mbot_schema_migrations'))")
+
+    def insert_values(self, cur, sql: str, rows: list):
+        """sql berisi satu 'VALUES %s' -> semua baris dikirim dalam satu statement."""
+        self._execute_values(cur, sql, rows)
+
+
+# --- SQLite: tipe tanggal disimpan sebagai teks ISO, dibaca kembali sebagai date/datetime (UTC) ---
+def _adapt_datetime(value: datetime) -> str:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    # Format sama dengan CURRENT_TIMESTAMP SQLite agar perbandingan teks (keyset) konsisten
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f" if value.microsecond else "%Y-%m-%d %H:%M:%S")
+
+def _convert_timestamp(raw: bytes) -> datetime:
+    return datetime.fromisoformat(raw.decode()).replace(tzinfo=timezone.utc)
+
+sqlite3.register_adapter(datetime, _adapt_datetime)
+sqlite3.register_adapter(date, lambda d: d.isoformat())
+sqlite3.register_converter("TIMESTAMPTZ", _convert_timestamp)
+sqlite3.register_converter("DATE", lambda raw: date.fromisoformat(raw.decode()))
+
+_FOR_UPDATE_RE = re.compile(r"\s+FOR\s+UPDATE\b", re.IGNORECASE)
+_VALUES_RE = re.compile(r"VALUES\s+%s", re.IGNORECASE)
+
+class _SQLiteCursor:
+    """Cursor sqlite3 yang menerima SQL bergaya psycopg2 (%s, FOR UPDATE)."""
+
+    def __init__(self, cur):
+        self._cur = cur
+
+    @staticmethod
+    def _translate(sql: str) -> str:
+        # SQLite mengunci seluruh DB saat menulis, jadi FOR UPDATE tidak diperlukan
+        return _FOR_UPDATE_RE.sub("", sql).replace("%s", "?")
+
+    def execute(self, sql, params=()):
+        self._cur.execute(self._translate(sql), params)
+        return self
+
+    def executemany(self, sql, seq):
+        self._cur.executemany(self._translate(sql), seq)
+        return self
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    def close(self):
+        self._cur.close()
+
+class SQLiteBackend:
+    """Backend SQLite embedded (mode WAL) untuk development, CI dan benchmark tanpa Postgres."""
+    dialect = "sqlite"
+
+    def __init__(self, path: str, maxconn: int, acquire_timeout: float):
+        self.acquire_timeout = acquire_timeout
+        self.maxconn = maxconn
+        self._keepalive = None
+        if path == ":memory:":
+            # Semua koneksi berbagi satu DB in-memory; _keepalive menjaga DB tetap hidup
+            self._target, self._uri = f"file:mbot_{id(self)}?mode=memory&cache=shared", True
+            self._keepalive = self._connect()
+        else:
+            self._target, self._uri = path, False
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self.executor = ThreadPoolExecutor(max_workers=maxconn, thread_name_prefix="db")
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self._target, uri=self._uri, timeout=self.acquire_timeout,
+            detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+            isolation_level=None  # autocommit, transaksi lewat BEGIN/COMMIT eksplisit
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.acquire_timeout * 1000)}")
+        return conn
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f"Tidak ada koneksi DB tersedia dalam {self.acquire_timeout} detik")
+        try:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken: bool = False):
+        try:
+            if broken or conn.in_transaction:
+                conn.close()
+            else:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def cursor(self, conn):
+        cur = _SQLiteCursor(conn.cursor())
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        if self._keepalive is not None:
+            self._keepalive.close()
+
+    def is_connection_error(self, e: Exception) -> bool:
+        return isinstance(e, sqlite3.InterfaceError)
+
+    def table_exists(self, cur, name: str) -> bool:
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", (name,))
+        return cur.fetchone() is not None
+
+    def lock_migrations(self, cur):
+        # Penulis SQLite sudah serial (satu writer per file)
+        pass
+
+    def insert_values(self, cur, sql: str, rows: list):
+        if not rows: return
+        placeholders = "(" + ", ".join(["%s"] * len(rows[0])) + ")"
+        cur.executemany(_VALUES_RE.sub(f"VALUES {placeholders}", sql, count=1), rows)
@@ -0,0 +1,191 @@
+import os
+import time
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# =================================================================
+# POOL API KEY (pengganti itertools.cycle)
+# =================================================================
+# Key yang gagal (429, kredit habis, dicabut, 5xx) masuk cooldown eksponensial.
+# Key dipilih dari yang sehat dengan beban (request in-flight) paling kecil.
+
+KEY_COOLDOWN_BASE = float(os.getenv("AI_KEY_COOLDOWN_BASE", "5"))
+KEY_COOLDOWN_MAX = float(os.getenv("AI_KEY_COOLDOWN_MAX", "900"))
+# 401/402/403: key dicabut atau kredit habis, tidak perlu dicoba lagi dalam waktu dekat
+KEY_DISABLE_SECONDS = float(os.getenv("AI_KEY_DISABLE_SECONDS", "3600"))
+FATAL_STATUS = {401, 402, 403}
+
+
+class NoHealthyKey(Exception):
+    """Semua key provider sedang cooldown."""
+
+
+def mask_key(key: str) -> str:
+    return f"…{key[-4:]}" if len(key) > 4 else "…"
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """'20', '1.5', '6m0s', '250ms', '1h2m3s' -> detik."""
+    value = value.strip().lower()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total, number = 0.0, ""
+    i = 0
+    while i < len(value):
+        ch = value[i]
+        if ch.isdigit() or ch == ".":
+            number += ch
+        elif number:
+            if value.startswith("ms", i):
+                total += float(number) / 1000; i += 1
+            elif ch in "hms":
+                total += float(number) * {"h": 3600, "m": 60, "s": 1}[ch]
+            else:
+                return None
+            number = ""
+        i += 1
+    return total if not number else None
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Retry-After (detik atau HTTP-date) / retry-after-ms dari header response."""
+    if not headers: return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value: return None
+    seconds = _parse_duration(value)
+    if seconds is not None: return seconds
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def rate_limit_reset_seconds(headers) -> Optional[float]:
+    """Jika header rate-limit menyatakan sisa request 0, kembalikan detik sampai reset."""
+    if not headers: return None
+    for remaining_h, reset_h in (("x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+                                 ("x-ratelimit-remaining", "x-ratelimit-reset")):
+        remaining = headers.get(remaining_h)
+        if remaining is None: continue
+        try:
+            if float(remaining) > 0: return None
+        except ValueError:
+            return None
+        reset = headers.get(reset_h)
+        if not reset: return KEY_COOLDOWN_BASE
+        seconds = _parse_duration(reset)
+        if seconds is None: return KEY_COOLDOWN_BASE
+        if seconds > 1e12: seconds = seconds / 1000 - time.time()  # epoch milidetik (OpenRouter)
+        elif seconds > 1e9: seconds -= time.time()  # epoch detik
+        return max(0.0, seconds)
+    return None
+
+
+class KeyState:
+    __slots__ = ("key", "in_flight", "successes", "failures", "consecutive_failures",
+                 "cooldown_until", "last_status", "last_error", "last_used")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.last_status: Optional[int] = None
+        self.last_error: Optional[str] = None
+        self.last_used = 0.0
+
+
+class KeyPool:
+    """Key satu provider. Dipakai bersama oleh semua cog lewat AIGateway (event loop tunggal, tanpa lock)."""
+
+    def __init__(self, provider: str, keys: List[str]):
+        self.provider = provider
+        self._states: Dict[str, KeyState] = {k: KeyState(k) for k in dict.fromkeys(keys)}
+
+    def __len__(self):
+        return len(self._states)
+
+    def healthy_count(self, now: Optional[float] = None) -> int:
+        now = now or time.monotonic()
+        return sum(1 for s in self._states.values() if s.cooldown_until <= now)
+
+    def acquire(self) -> str:
+        """Pilih key sehat dengan in-flight paling sedikit; seri -> yang paling lama tidak dipakai."""
+        now = time.monotonic()
+        healthy = [s for s in self._states.values() if s.cooldown_until <= now]
+        if not healthy:
+            soonest = min(s.cooldown_until for s in self._states.values()) - now if self._states else 0
+            raise NoHealthyKey(f"Semua key {self.provider} cooldown ({soonest:.0f}s lagi).")
+        state = min(healthy, key=lambda s: (s.in_flight, s.consecutive_failures, s.last_used))
+        state.in_flight += 1
+        state.last_used = now
+        return state.key
+
+    @staticmethod
+    def is_key_error(status: Optional[int]) -> bool:
+        """Error yang berasal dari key/provider (bukan JSON invalid, timeout lokal, dsb.)."""
+        return status is not None and (status == 429 or status in FATAL_STATUS or status >= 500)
+
+    def cancel(self, key: str):
+        """Request dibatalkan (mis. kalah hedging): hanya kurangi in-flight."""
+        state = self._states.get(key)
+        if state is not None: state.in_flight = max(0, state.in_flight - 1)
+
+    def release(self, key: str, *, ok: bool, status: Optional[int] = None, headers=None, error: Optional[str] = None):
+        state = self._states.get(key)
+        if state is None: return
+        state.in_flight = max(0, state.in_flight - 1)
+        state.last_status = status
+        now = time.monotonic()
+
+        if ok:
+            state.successes += 1
+            state.consecutive_failures = 0
+            state.last_error = None
+            reset = rate_limit_reset_seconds(headers)
+            if reset:
+                state.cooldown_until = now + min(reset, KEY_COOLDOWN_MAX)
+            return
+
+        state.failures += 1
+        state.last_error = error
+        if not self.is_key_error(status):
+            return
+        state.consecutive_failures += 1
+        if status in FATAL_STATUS:
+            cooldown = KEY_DISABLE_SECONDS
+        else:
+            backoff = KEY_COOLDOWN_BASE * 2 ** min(state.consecutive_failures - 1, 16)
+            cooldown = min(max(retry_after_seconds(headers) or 0.0, backoff), KEY_COOLDOWN_MAX)
+        state.cooldown_until = now + cooldown
+        logger.warning(f"🔑 Key {self.provider} {mask_key(key)} cooldown {cooldown:.0f}s (HTTP {status}).")
+
+    def reset(self):
+        """Keluarkan semua key dari cooldown (admin)."""
+        for s in self._states.values():
+            s.cooldown_until = 0.0
+            s.consecutive_failures = 0
+
+    def snapshot(self) -> List[Dict]:
+        now = time.monotonic()
+        return [{
+            "key": mask_key(s.key),
+            "in_flight": s.in_flight,
+            "successes": s.successes,
+            "failures": s.failures,
+            "cooldown": max(0.0, s.cooldown_until - now),
+            "last_status": s.last_status,
+            "last_error": s.last_error,
+        } for s in self._states.values()]
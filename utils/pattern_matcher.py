@@ -0,0 +1,119 @@
+import re
+import logging
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# =================================================================
+# MULTI-PATTERN MATCHER UNTUK SCANNER
+# =================================================================
+# Pola literal (URL webhook, "loadstring", "MoonSec", ...) digabung ke satu automaton
+# Aho-Corasick sehingga konten cukup dibaca sekali; pola regex sisanya dikompilasi sekali
+# saat import. Tanpa pyahocorasick, literal dicari dengan str.find (tetap tanpa regex).
+
+try:
+    import ahocorasick
+except ImportError:  # dependency opsional
+    ahocorasick = None
+
+_REGEX_META = set("^$*+?{}[]\\|()")
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+_IDENT_PREFIX = "[a-zA-Z_][a-zA-Z0-9_]*"
+
+
+def _is_literal(pattern: str) -> bool:
+    # '.' dianggap titik biasa: pola seperti "pastebin.com" memang dimaksudkan literal
+    return not any(ch in _REGEX_META for ch in pattern)
+
+
+def _compile(pattern: str) -> "re.Pattern":
+    # Pola yang diawali identifier tidak perlu dicoba dari tengah identifier: kalau cocok di posisi i
+    # (didahului huruf/_), pasti juga cocok di i-1, jadi match paling kiri (hasil finditer) tetap sama.
+    # Tanpa lookbehind, regex ini mengulang scan tiap identifier per karakter (kuadratik).
+    if pattern.startswith(_IDENT_PREFIX):
+        return re.compile(f"(?<![a-zA-Z_]){pattern}", re.IGNORECASE)
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def _lower(text: str) -> str:
+    """Lowercase ASCII saja agar offset tetap sama dengan teks asli (pola semuanya ASCII)."""
+    return text.lower() if text.isascii() else text.translate(_ASCII_LOWER)
+
+
+def newline_offsets(text: str) -> List[int]:
+    """Offset setiap '\\n' (terurut), dibangun sekali per file untuk lookup nomor baris."""
+    offsets = []
+    pos = text.find("\n")
+    while pos != -1:
+        offsets.append(pos)
+        pos = text.find("\n", pos + 1)
+    return offsets
+
+
+def line_number(offsets: List[int], pos: int) -> int:
+    """Nomor baris (mulai 1) untuk offset `pos`: jumlah newline sebelum pos + 1, O(log n)."""
+    return bisect_left(offsets, pos) + 1
+
+
+class PatternMatcher:
+    """Cocokkan banyak pola sekaligus (case-insensitive). Hasil: (pattern, offset awal) per kemunculan."""
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = list(dict.fromkeys(patterns))
+        self.literals = [p for p in self.patterns if _is_literal(p)]
+        self.regexes: List[Tuple[str, "re.Pattern"]] = []
+        for p in self.patterns:
+            if p in self.literals: continue
+            try:
+                self.regexes.append((p, _compile(p)))
+            except re.error as e:
+                logger.error(f"Regex error pada pattern '{p}': {e}")
+
+        self._automaton = None
+        if ahocorasick is not None and self.literals:
+            self._automaton = ahocorasick.Automaton()
+            for p in self.literals:
+                key = p.lower()
+                existing = self._automaton.get(key, ())
+                self._automaton.add_word(key, existing + (p,))
+            self._automaton.make_automaton()
+        self._order = {p: i for i, p in enumerate(self.patterns)}
+
+    @property
+    def engine(self) -> str:
+        return "aho-corasick" if self._automaton is not None else "str.find"
+
+    def _literal_matches(self, text: str) -> List[Tuple[str, int]]:
+        lowered = _lower(text)
+        matches: List[Tuple[str, int]] = []
+        if self._automaton is not None:
+            for end, found in self._automaton.iter(lowered):
+                for p in found:
+                    matches.append((p, end - len(p) + 1))
+            return matches
+        for p in self.literals:
+            key = p.lower()
+            # Sama seperti re.finditer: kemunculan tidak saling tumpang tindih
+            start = lowered.find(key)
+            while start != -1:
+                matches.append((p, start))
+                start = lowered.find(key, start + len(key))
+        return matches
+
+    def finditer(self, text: str) -> List[Tuple[str, int]]:
+        """Semua kemunculan, urut sesuai urutan pola lalu posisi (sama seperti loop re.finditer per pola)."""
+        matches = self._literal_matches(text)
+        if self._automaton is not None:
+            # Automaton melaporkan kemunculan yang tumpang tindih; samakan dengan semantik re.finditer
+            last_end: Dict[str, int] = {}
+            filtered = []
+            for p, start in sorted(matches, key=lambda m: (self._order[m[0]], m[1])):
+                if start < last_end.get(p, 0): continue
+                last_end[p] = start + len(p)
+                filtered.append((p, start))
+            matches = filtered
+        for p, regex in self.regexes:
+            matches.extend((p, m.start()) for m in regex.finditer(text))
+        matches.sort(key=lambda m: (self._order[m[0]], m[1]))
+        return matches
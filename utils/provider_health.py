@@ -0,0 +1,127 @@
+import os
+import time
+import logging
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# =================================================================
+# KESEHATAN PROVIDER AI (per fitur): EWMA latency/sukses + circuit breaker
+# =================================================================
+# Urutan fallback di cog hanya dipakai sebagai prior; urutan sebenarnya diatur dari
+# skor = latency EWMA / tingkat sukses EWMA (lebih kecil = lebih baik).
+
+AI_EWMA_ALPHA = float(os.getenv("AI_EWMA_ALPHA", "0.2"))
+AI_PRIOR_LATENCY = float(os.getenv("AI_PRIOR_LATENCY", "10"))  # detik, untuk provider yang belum punya data
+AI_BREAKER_THRESHOLD = int(os.getenv("AI_BREAKER_THRESHOLD", "3"))  # gagal beruntun sebelum circuit dibuka
+AI_BREAKER_COOLDOWN = float(os.getenv("AI_BREAKER_COOLDOWN", "60"))  # detik sebelum probe ulang
+AI_BREAKER_COOLDOWN_MAX = float(os.getenv("AI_BREAKER_COOLDOWN_MAX", "600"))
+# Tingkat gagal "dilupakan" perlahan (half-life, detik) agar provider yang tersingkir
+# ke belakang urutan tetap mendapat kesempatan lagi
+AI_HEALTH_HALFLIFE = float(os.getenv("AI_HEALTH_HALFLIFE", "600"))
+# Selisih kecil per posisi agar urutan prior menang saat skor sama
+_PRIOR_STEP = 0.01
+
+
+class ProviderHealth:
+    __slots__ = ("latency", "success", "updated", "samples", "consecutive_failures", "open_until", "trips", "probing")
+
+    def __init__(self):
+        self.latency = AI_PRIOR_LATENCY
+        self.success = 1.0
+        self.updated = 0.0
+        self.samples = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0   # > now: circuit terbuka
+        self.trips = 0          # berapa kali berturut-turut dibuka (cooldown eksponensial)
+        self.probing = False    # half-open: satu request percobaan sedang berjalan
+
+    def success_rate(self, now: float) -> float:
+        idle = now - self.updated if self.updated else 0.0
+        return 1.0 - (1.0 - self.success) * 0.5 ** (idle / AI_HEALTH_HALFLIFE)
+
+    def score(self, now: float) -> float:
+        return self.latency / max(self.success_rate(now), 0.05)
+
+    def state(self, now: float) -> str:
+        if self.open_until > now: return "open"
+        if self.trips: return "half-open"
+        return "closed"
+
+
+class HealthTracker:
+    """Statistik per (fitur, provider). Dipakai dari satu event loop, jadi tanpa lock."""
+
+    def __init__(self):
+        self._health: Dict[Tuple[str, str], ProviderHealth] = {}
+
+    def _get(self, feature: str, provider: str) -> ProviderHealth:
+        h = self._health.get((feature, provider))
+        if h is None:
+            h = self._health[(feature, provider)] = ProviderHealth()
+        return h
+
+    def order(self, feature: str, providers: List[str]) -> List[str]:
+        """
+        Urutkan provider berdasarkan skor dan buang yang circuit-nya terbuka.
+        Circuit yang cooldown-nya habis boleh dicoba satu kali (half-open probe).
+        Jika semua terbuka, provider yang paling cepat pulih tetap dicoba agar request tidak langsung gagal.
+        """
+        now = time.monotonic()
+        allowed, blocked = [], []
+        for idx, p in enumerate(providers):
+            h = self._get(feature, p)
+            if h.open_until > now or (h.trips and h.probing):
+                blocked.append((h.open_until, p))
+                continue
+            allowed.append((h.score(now) * (1 + _PRIOR_STEP * idx), p))
+        if not allowed and blocked:
+            return [min(blocked)[1]]
+        return [p for _, p in sorted(allowed)]
+
+    def started(self, feature: str, provider: str):
+        h = self._get(feature, provider)
+        if h.trips: h.probing = True
+
+    def record(self, feature: str, provider: str, ok: bool, latency: float):
+        h = self._get(feature, provider)
+        now = time.monotonic()
+        h.probing = False
+        h.samples += 1
+        h.success = h.success_rate(now)
+        h.success += AI_EWMA_ALPHA * ((1.0 if ok else 0.0) - h.success)
+        h.updated = now
+        if ok:
+            h.latency += AI_EWMA_ALPHA * (latency - h.latency)
+            h.consecutive_failures = 0
+            if h.trips: logger.info(f"✅ Circuit AI {provider} [{feature}] tertutup lagi.")
+            h.trips = 0
+            h.open_until = 0.0
+            return
+        h.consecutive_failures += 1
+        # Probe half-open gagal langsung membuka lagi; selain itu tunggu ambang gagal beruntun
+        if h.trips or h.consecutive_failures >= AI_BREAKER_THRESHOLD:
+            cooldown = min(AI_BREAKER_COOLDOWN * 2 ** min(h.trips, 10), AI_BREAKER_COOLDOWN_MAX)
+            h.trips += 1
+            h.open_until = now + cooldown
+            logger.warning(f"⛔ Circuit AI {provider} [{feature}] dibuka {cooldown:.0f}s ({h.consecutive_failures}x gagal beruntun).")
+
+    def cancelled(self, feature: str, provider: str):
+        # Kalah hedging: tidak ada informasi sukses/gagal
+        self._get(feature, provider).probing = False
+
+    def snapshot(self) -> Dict[str, List[Dict]]:
+        now = time.monotonic()
+        result: Dict[str, List[Dict]] = {}
+        for (feature, provider), h in sorted(self._health.items()):
+            if not h.samples: continue
+            result.setdefault(feature, []).append({
+                "provider": provider,
+                "latency": h.latency,
+                "success": h.success_rate(now),
+                "samples": h.samples,
+                "score": h.score(now),
+                "state": h.state(now),
+                "reopen_in": max(0.0, h.open_until - now),
+            })
+        return result
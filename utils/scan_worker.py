@@ -0,0 +1,120 @@
+import os
+import io
+import asyncio
+import hashlib
+import logging
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import py7zr
+import rarfile
+
+from utils.pattern_matcher import PatternMatcher, newline_offsets, line_number
+
+logger = logging.getLogger(__name__)
+
+# =================================================================
+# WORKER POOL SCANNER (CPU)
+# =================================================================
+# Ekstrak arsip, decode UTF-8, pencocokan pola & SHA-256 dijalankan di proses terpisah
+# agar event loop bot tidak macet saat memindai file besar / .7z (py7zr murni Python).
+# Cog hanya menerima hasil ringkas; AI & I/O Discord tetap di event loop.
+
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "2"))  # 0 = tanpa proses, jalankan di thread
+
+ARCHIVE_EXTENSIONS = ('.zip', '.7z', '.rar')
+
+# Diisi per proses oleh _init_worker (matcher dibangun sekali per worker)
+_patterns: Dict[str, Dict] = {}
+_matcher: Optional[PatternMatcher] = None
+
+
+def _init_worker(patterns: Dict[str, Dict]):
+    global _patterns, _matcher
+    _patterns = patterns
+    _matcher = PatternMatcher(list(patterns))
+
+
+def detect_issues(text: str) -> List[Dict]:
+    issues = []
+    # Index newline dibangun sekali per file; nomor baris tiap match lewat bisect
+    offsets = newline_offsets(text)
+    for pattern, start in _matcher.finditer(text):
+        issues.append({'pattern': pattern, 'line': line_number(offsets, start), **_patterns[pattern]})
+    return issues
+
+
+def _within_size(name: str, size: int, max_member: int) -> bool:
+    if size > max_member:
+        logger.warning(f"Lewati {name}: terlalu besar setelah ekstrak.")
+        return False
+    return True
+
+
+def read_archive(content: bytes, filename: str, allowed_ext: Tuple[str, ...], max_files: int, max_member: int) -> List[Tuple[str, bytes]]:
+    """
+    Baca member arsip yang didukung langsung dari memori (tanpa ekstrak ke folder temp).
+    Member yang terlalu besar dibuang dulu, baru dibatasi max_files (sama untuk zip, 7z & rar).
+    RAR dengan kompresi tetap butuh tool unrar; rarfile sendiri yang menulis file sementara bila perlu.
+    """
+    name = filename.lower()
+    members: List[Tuple[str, bytes]] = []
+    try:
+        buffer = io.BytesIO(content)
+        if name.endswith('.zip'):
+            with zipfile.ZipFile(buffer, 'r') as zf:
+                infos = [m for m in zf.infolist() if m.filename.endswith(allowed_ext) and not m.filename.startswith('__MACOSX/')
+                         and _within_size(m.filename, m.file_size, max_member)][:max_files]
+                for info in infos: members.append((info.filename, zf.read(info)))
+        elif name.endswith('.7z'):
+            with py7zr.SevenZipFile(buffer, mode='r') as szf:
+                targets = [m.filename for m in szf.files if m.filename.endswith(allowed_ext) and not m.is_directory
+                           and _within_size(m.filename, m.uncompressed or 0, max_member)][:max_files]
+                if targets:
+                    for member, data in szf.read(targets=targets).items(): members.append((member, data.read()))
+        elif name.endswith('.rar'):
+            with rarfile.RarFile(buffer) as rf:
+                infos = [m for m in rf.infolist() if m.filename.endswith(allowed_ext) and not m.is_dir()
+                         and _within_size(m.filename, m.file_size, max_member)][:max_files]
+                for info in infos: members.append((info.filename, rf.read(info)))
+    except Exception as e:
+        logger.error(f"Gagal membaca arsip {filename}: {e}")
+    return members
+
+
+def scan_upload(content: bytes, filename: str, allowed_ext: Tuple[str, ...], max_files: int, max_member: int) -> Tuple[str, List[Dict]]:
+    """
+    Seluruh kerja CPU untuk satu upload. Hasil: (sha256 upload, daftar file) dengan tiap file
+    {"name", "hash", "text", "issues"}; "text" tetap dikirim balik karena dibutuhkan untuk prompt AI.
+    """
+    if filename.lower().endswith(ARCHIVE_EXTENSIONS):
+        entries = read_archive(content, filename, allowed_ext, max_files, max_member)
+    else:
+        entries = [(filename, content)]
+    files = []
+    for name, data in entries:
+        text = data.decode('utf-8', errors='ignore')
+        files.append({"name": name, "hash": hashlib.sha256(data).hexdigest(), "text": text, "issues": detect_issues(text)})
+    return hashlib.sha256(content).hexdigest(), files
+
+
+class ScanPool:
+    """ProcessPoolExecutor untuk scan_upload; dipakai dari event loop lewat run_in_executor."""
+
+    def __init__(self, patterns: Dict[str, Dict], workers: int = SCAN_WORKERS):
+        self.workers = workers
+        if workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(patterns,))
+        else:
+            # Tanpa proses terpisah: matcher dibangun di proses utama, kerja jalan di thread default
+            self._executor = None
+            _init_worker(patterns)
+
+    async def scan_upload(self, content: bytes, filename: str, allowed_ext: Sequence[str], max_files: int, max_member: int) -> Tuple[str, List[Dict]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, scan_upload, content, filename, tuple(allowed_ext), max_files, max_member)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)